@@ -0,0 +1,194 @@
+"""Server-side cache of serialized API responses.
+
+Bodies are stored under a key made of the path, the normalized query
+parameters and the versions of the dataset scopes the view reads, so a write
+to one table only invalidates the responses that depend on it; stale entries
+are never read again and age out of the backend.
+
+Two backends are available, chosen with ``RESPONSE_CACHE``:
+
+* ``memory``: an in-process LRU bounded by total bytes and entry age.
+* ``shared``: a store shared by every worker, through a client with the
+  ``get``/``set(name, value, ex=seconds)`` interface of redis-py. Set
+  ``RESPONSE_CACHE_URL`` to use Redis; without it an in-process stand-in
+  with the same interface is used.
+"""
+import json
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app
+
+from api.etag import request_key
+from dataset_version import GTFS
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 300
+# Response headers stored along with the body.
+CACHED_HEADERS = ('Content-Type', 'Content-Encoding', 'Vary', 'X-Next-Cursor', 'Link')
+
+
+def _pack(response):
+    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+    return json.dumps(headers).encode() + b"\n" + response.get_data()
+
+
+def _unpack(value):
+    headers, body = value.split(b"\n", 1)
+    return body, json.loads(headers)
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by the total size of the stored bodies and a TTL."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self.size -= len(value)
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self.size)
+
+
+class LocalSharedClient:
+    """In-process stand-in for a shared store such as Redis (get/set with ex)."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._values.get(name)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._values[name]
+                return None
+            return entry[0]
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            expires = time.monotonic() + ex if ex else float("inf")
+            self._values[name] = (value, expires)
+
+
+class SharedCache:
+    """Cache stored in a shared client; eviction is left to the store."""
+
+    def __init__(self, client, ttl=DEFAULT_TTL, prefix="api:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception:
+            # A store outage must not take the API down.
+            self.stats["errors"] += 1
+            return None
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + key, value, ex=self.ttl)
+        except Exception:
+            self.stats["errors"] += 1
+
+    def info(self):
+        return dict(self.stats)
+
+
+def _shared_client(url):
+    if not url:
+        return LocalSharedClient()
+    try:
+        import redis
+    except ImportError as exc:
+        raise RuntimeError("RESPONSE_CACHE_URL requires the 'redis' package") from exc
+    return redis.Redis.from_url(url)
+
+
+def init_cache(app):
+    """Create the response cache configured for ``app`` (None when disabled)."""
+    backend = app.config.setdefault('RESPONSE_CACHE', 'memory')
+    ttl = app.config.setdefault('RESPONSE_CACHE_TTL', DEFAULT_TTL)
+    if backend == 'memory':
+        cache = LRUCache(app.config.setdefault('RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES), ttl)
+    elif backend == 'shared':
+        cache = SharedCache(_shared_client(app.config.get('RESPONSE_CACHE_URL')), ttl)
+    elif backend == 'none':
+        cache = None
+    else:
+        raise ValueError(f"Unknown RESPONSE_CACHE backend '{backend}'")
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def cached(*scopes):
+    """Serve successful responses of the view from the response cache.
+
+    ``scopes`` are the dataset scopes the view reads (``gtfs`` if none);
+    bumping any of them makes the cached bodies unreachable.
+    """
+    scopes = scopes or (GTFS,)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None:
+                return view(*args, **kwargs)
+            key = request_key(scopes)
+            value = cache.get(key)
+            if value is not None:
+                body, headers = _unpack(value)
+                return current_app.response_class(body, headers=headers)
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.set(key, _pack(response))
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,59 @@
+"""HTTP validators for the read API.
+
+Responses carry a strong ETag derived from the request and the versions of
+the dataset scopes the view reads, so a client or proxy revalidating with ``If-None-Match`` gets a 304
+without the view (or the database) doing any work, and ``Cache-Control``
+lets a CDN in front of the app serve repeated reads.
+"""
+import hashlib
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from dataset_version import GTFS, current_version
+from api.formats import negotiate
+
+
+DEFAULT_MAX_AGE = 60
+
+
+def request_key(scopes):
+    """Identify the current request's response at the current versions of ``scopes``.
+
+    The negotiated format and encoding are part of the key, so every variant
+    gets its own ETag and cache entry.
+    """
+    args = "&".join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    versions = ".".join(str(current_version(scope)) for scope in scopes)
+    mimetype, encoding = negotiate()
+    return f"{request.path}?{args}@{versions};{mimetype};{encoding or 'identity'}"
+
+
+def request_etag(scopes):
+    return hashlib.blake2b(request_key(scopes).encode(), digest_size=16).hexdigest()
+
+
+def versioned(*scopes):
+    """Answer conditional GETs with 304 and tag successful responses.
+
+    ``scopes`` are the dataset scopes the view reads (``gtfs`` if none).
+    """
+    scopes = scopes or (GTFS,)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            etag = request_etag(scopes)
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.vary.update(('Accept', 'Accept-Encoding'))
+            max_age = current_app.config.get('API_CACHE_MAX_AGE', DEFAULT_MAX_AGE)
+            response.headers['Cache-Control'] = f"public, max-age={max_age}"
+            return response
+        return wrapped
+    return decorator
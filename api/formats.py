@@ -0,0 +1,78 @@
+"""Response formats and compression negotiated from the request headers.
+
+``Accept`` selects the body format:
+
+* ``application/json`` (default): one object per row.
+* ``application/vnd.rutas.columnar+json``: lists of rows become one list per
+  field, so keys are not repeated on every element.
+* ``application/msgpack``: MessagePack of the row layout.
+
+``Accept-Encoding`` selects brotli or gzip compression for bodies larger
+than ``MIN_COMPRESS_BYTES``.
+"""
+import gzip
+
+import brotli
+import msgpack
+from flask import current_app, request
+
+
+JSON = 'application/json'
+COLUMNAR_JSON = 'application/vnd.rutas.columnar+json'
+MSGPACK = 'application/msgpack'
+FORMATS = (JSON, COLUMNAR_JSON, MSGPACK, 'application/x-msgpack')
+ENCODINGS = ('br', 'gzip')
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def negotiate():
+    """``(mimetype, encoding or None)`` preferred by the current request."""
+    mimetype = request.accept_mimetypes.best_match(FORMATS, default=JSON)
+    if mimetype == 'application/x-msgpack':
+        mimetype = MSGPACK
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    return mimetype, encoding
+
+
+def to_columnar(data):
+    """Turn every list of objects with the same keys into an object of lists."""
+    if isinstance(data, dict):
+        return {key: to_columnar(value) for key, value in data.items()}
+    if isinstance(data, list):
+        if data and all(isinstance(item, dict) for item in data):
+            keys = list(data[0])
+            if all(item.keys() == data[0].keys() for item in data):
+                return {key: to_columnar([item[key] for item in data]) for key in keys}
+        return [to_columnar(item) for item in data]
+    return data
+
+
+def encode(data, mimetype):
+    if mimetype == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    if mimetype == COLUMNAR_JSON:
+        data = to_columnar(data)
+    return current_app.json.dumps(data, separators=(',', ':')).encode()
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def api_response(data, status=200, headers=None):
+    """Response with ``data`` in the format and encoding the client accepts."""
+    mimetype, encoding = negotiate()
+    body = encode(data, mimetype)
+    response = current_app.response_class(body, status=status, headers=headers,
+                                          mimetype=mimetype)
+    if encoding and len(body) >= MIN_COMPRESS_BYTES:
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
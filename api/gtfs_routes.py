@@ -1,51 +1,147 @@
 from flask import Blueprint, jsonify, request
-from sqlalchemy import func
-from datetime import datetime
+from sqlalchemy import case
+from datetime import datetime, timedelta
 
-from models import db, Region, Route, Stop, Trip, StopTime, Calendar, CalendarDate
+from models import (
+    db, Region, Route, Stop, Trip, StopTime, ServiceDay, RoutePattern, RoutePatternStop,
+)
+from gtfs_time import to_seconds
+from timetable import get_timetable
+from planner import MAX_ITINERARIES, plan
+from spatial import cluster, stop_grid
+from api.etag import versioned
+from api.cache import cached
+from api.formats import api_response
+from api.pagination import (
+    keyset_page, list_page, page_args, page_response, stream_response,
+)
 
 bp = Blueprint('gtfs_routes', __name__)
 
-@bp.route('/api/rutas')
-def rutas():
-    region = request.args.get('region')
+DEFAULT_DEPARTURES = 10
+MAX_DEPARTURES = 100
+SECONDS_PER_DAY = 24 * 3600
+DEFAULT_NEAREST = 5
+MAX_NEAREST = 50
+DEFAULT_RADIUS_M = 10000
+MAX_RADIUS_M = 50000
+# Viewports at lower zoom levels, or with more stops than this, are clustered.
+CLUSTER_BELOW_ZOOM = 15
+MAX_BBOX_STOPS = 2000
+# Web map zoom levels accepted by /api/paradas/bbox.
+MIN_ZOOM = 0
+MAX_ZOOM = 22
+
+# Dataset scopes each endpoint reads (see dataset_version).
+ROUTE_SCOPES = ('routes',)
+STOP_SCOPES = ('stops', 'trips', 'stop_times')
+DEPARTURE_SCOPES = ('trips', 'stop_times', 'service_days')
+PLANNER_SCOPES = ('routes', 'stops', 'trips', 'stop_times', 'service_days')
+LOCATION_SCOPES = ('stops',)
+
+def routes_query(region=None):
+    """Routes, optionally of the regions whose name contains ``region``."""
     query = Route.query
     if region:
         query = query.join(Region).filter(Region.name.ilike(f"%{region}%"))
-    routes = query.all()
-    return jsonify([
-        {
-            'route_id': r.id,
-            'route_short_name': r.short_name,
-            'route_long_name': r.long_name,
-            'route_type': r.type,
-        }
-        for r in routes
-    ])
+    return query
 
-@bp.route('/api/paradas')
-def paradas():
-    route_id = request.args.get('ruta')
-    if not route_id:
-        return jsonify([]), 400
-    stops = (
+def stops_query(route_id):
+    """Ordered stops of every stop pattern of ``route_id``, by pattern id."""
+    return (
         db.session.query(
             Stop.id.label('stop_id'),
             Stop.name.label('stop_name'),
             Stop.lat.label('stop_lat'),
             Stop.lon.label('stop_lon'),
-            StopTime.stop_sequence.label('sequence'),
+            RoutePatternStop.sequence.label('sequence'),
+            RoutePattern.id.label('pattern_id'),
+            RoutePattern.direction_id.label('direction_id'),
+            RoutePattern.trip_count.label('trip_count'),
         )
-        .join(StopTime)
+        .select_from(RoutePattern)
+        .join(RoutePatternStop, RoutePatternStop.pattern_id == RoutePattern.id)
+        .join(Stop, Stop.id == RoutePatternStop.stop_id)
+        .filter(RoutePattern.route_id == route_id)
+        .order_by(RoutePattern.id, RoutePatternStop.sequence)
+    )
+
+def departures_query(route_id, stop_id, target_date, after=0, limit=DEFAULT_DEPARTURES):
+    """Departures of ``route_id`` at ``stop_id`` on ``target_date`` from ``after`` seconds."""
+    # Trips of the previous service day running past midnight (times beyond
+    # 24:00:00) also depart on the requested date.
+    previous_date = target_date - timedelta(days=1)
+    offset = case((ServiceDay.date == previous_date, SECONDS_PER_DAY), else_=0)
+    return (
+        db.session.query(StopTime.arrival_time, StopTime.departure_time)
         .join(Trip)
-        .filter(Trip.route_id == route_id)
-        .order_by(StopTime.stop_sequence)
-        .all()
+        .join(ServiceDay, ServiceDay.service_id == StopTime.service_id)
+        .filter(
+            ServiceDay.date.in_([target_date, previous_date]),
+            Trip.route_id == route_id,
+            StopTime.stop_id == stop_id,
+            StopTime.departure_secs >= after + offset,
+        )
+        .order_by(StopTime.departure_secs - offset)
+        .limit(limit)
     )
-    return jsonify([s._asdict() for s in stops])
+
+def _route_json(r):
+    return {
+        'route_id': r.id,
+        'route_short_name': r.short_name,
+        'route_long_name': r.long_name,
+        'route_type': r.type,
+    }
+
+@bp.route('/api/rutas')
+@versioned(*ROUTE_SCOPES)
+@cached(*ROUTE_SCOPES)
+def rutas():
+    """Routes by id, one page per request, or all of them with ``stream=1``."""
+    query = routes_query(request.args.get('region'))
+    if request.args.get('stream'):
+        columns = query.with_entities(Route.id, Route.short_name, Route.long_name, Route.type)
+        return stream_response(columns, _route_json)
+    try:
+        after, limit = page_args()
+        routes, more = keyset_page(query, [Route.id], after, limit)
+    except ValueError:
+        return jsonify({'error': 'cursor o limite inválido'}), 400
+    return page_response([_route_json(r) for r in routes], [routes[-1].id] if more else None)
+
+@bp.route('/api/paradas')
+@versioned(*STOP_SCOPES)
+@cached(*STOP_SCOPES)
+def paradas():
+    """Stops of a route by pattern and sequence, paginated like ``rutas``."""
+    route_id = request.args.get('ruta')
+    if not route_id:
+        return jsonify([]), 400
+    query = stops_query(route_id)
+    if request.args.get('stream'):
+        return stream_response(query, lambda s: s._asdict())
+    try:
+        after, limit = page_args()
+        timetable = get_timetable()
+        if timetable is not None:
+            stops, more = list_page(timetable.stops(route_id),
+                                    lambda s: (s['pattern_id'], s['sequence']), (int, int),
+                                    after, limit)
+        else:
+            stops, more = keyset_page(query, [RoutePattern.id, RoutePatternStop.sequence],
+                                      after, limit)
+            stops = [s._asdict() for s in stops]
+    except ValueError:
+        return jsonify({'error': 'cursor o limite inválido'}), 400
+    next_key = [stops[-1]['pattern_id'], stops[-1]['sequence']] if more else None
+    return page_response(stops, next_key)
 
 @bp.route('/api/horarios')
+@versioned(*DEPARTURE_SCOPES)
+@cached(*DEPARTURE_SCOPES)
 def horarios():
+    """Next departures of a route at a stop on a date, after ``hora``."""
     route_id = request.args.get('ruta')
     stop_id = request.args.get('parada')
     fecha = request.args.get('fecha')
@@ -55,36 +151,130 @@ def horarios():
         target_date = datetime.strptime(fecha, '%Y-%m-%d').date()
     except ValueError:
         return jsonify({'error': 'fecha inválida'}), 400
+    after = to_seconds(request.args.get('hora', '00:00'))
+    if after is None:
+        return jsonify({'error': 'hora inválida'}), 400
+    try:
+        limit = min(int(request.args.get('limite', DEFAULT_DEPARTURES)), MAX_DEPARTURES)
+    except ValueError:
+        return jsonify({'error': 'limite inválido'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limite inválido'}), 400
 
-    weekday = ['monday','tuesday','wednesday','thursday','friday','saturday','sunday'][target_date.weekday()]
-    base_services = db.session.query(Calendar.service_id).filter(
-        Calendar.start_date <= target_date,
-        Calendar.end_date >= target_date,
-        getattr(Calendar, weekday) == True
-    )
-    added_services = db.session.query(CalendarDate.service_id).filter(
-        CalendarDate.date == target_date,
-        CalendarDate.exception_type == 1
-    )
-    removed_services = db.session.query(CalendarDate.service_id).filter(
-        CalendarDate.date == target_date,
-        CalendarDate.exception_type == 2
-    )
-    services = {s.service_id for s in base_services.union(added_services)}
-    services -= {s.service_id for s in removed_services}
-    if not services:
-        return jsonify([])
+    timetable = get_timetable()
+    if timetable is not None:
+        return api_response(timetable.departures(route_id, stop_id, target_date, after, limit))
+    times = departures_query(route_id, stop_id, target_date, after, limit).all()
+    return api_response([{'arrival_time': t.arrival_time, 'departure_time': t.departure_time} for t in times])
 
-    times = (
-        db.session.query(StopTime.arrival_time, StopTime.departure_time)
-        .join(Trip)
-        .filter(
-            Trip.route_id == route_id,
-            Trip.service_id.in_(services),
-            StopTime.stop_id == stop_id,
-        )
-        .order_by(StopTime.arrival_time)
-        .limit(10)
-        .all()
-    )
-    return jsonify([{'arrival_time': t.arrival_time, 'departure_time': t.departure_time} for t in times])
+def _stops_param(timetable, stops_arg, region_arg):
+    """Interned stop ids from a comma-separated stop list or a region name."""
+    if stops_arg:
+        return [timetable.stop_index[s] for s in stops_arg.split(',') if s in timetable.stop_index]
+    if region_arg:
+        return timetable.region_stops(region_arg).tolist()
+    return []
+
+@bp.route('/api/planificar')
+@versioned(*PLANNER_SCOPES)
+@cached(*PLANNER_SCOPES)
+def planificar():
+    """Earliest-arrival itineraries between stops (``origen``/``destino``) or
+    regions (``region_origen``/``region_destino``) from ``hora`` on ``fecha``."""
+    fecha = request.args.get('fecha')
+    if not fecha:
+        return jsonify({'error': 'fecha requerida'}), 400
+    try:
+        target_date = datetime.strptime(fecha, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'fecha inválida'}), 400
+    after = to_seconds(request.args.get('hora', '00:00'))
+    if after is None:
+        return jsonify({'error': 'hora inválida'}), 400
+    try:
+        itineraries = min(int(request.args.get('opciones', 3)), MAX_ITINERARIES)
+    except ValueError:
+        return jsonify({'error': 'opciones inválido'}), 400
+    if itineraries < 1:
+        return jsonify({'error': 'opciones inválido'}), 400
+
+    timetable = get_timetable()
+    if timetable is None:
+        return jsonify({'error': 'planificador deshabilitado'}), 503
+    origins = _stops_param(timetable, request.args.get('origen'), request.args.get('region_origen'))
+    destinations = _stops_param(timetable, request.args.get('destino'),
+                                request.args.get('region_destino'))
+    if not origins or not destinations:
+        return jsonify({'error': 'origen o destino desconocido'}), 400
+    return api_response(plan(timetable, origins, destinations, target_date, after, itineraries))
+
+def _stop_json(timetable, stop):
+    return {
+        'stop_id': timetable.stop_ids[stop],
+        'stop_name': timetable.stop_names[stop],
+        'stop_lat': float(timetable.stop_lat[stop]),
+        'stop_lon': float(timetable.stop_lon[stop]),
+    }
+
+@bp.route('/api/paradas/cercanas')
+@versioned(*LOCATION_SCOPES)
+@cached(*LOCATION_SCOPES)
+def paradas_cercanas():
+    """The ``k`` stops nearest to ``lat``/``lon`` within ``radio`` meters."""
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        k = min(int(request.args.get('k', DEFAULT_NEAREST)), MAX_NEAREST)
+        radius = min(float(request.args.get('radio', DEFAULT_RADIUS_M)), MAX_RADIUS_M)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat, lon, k o radio inválidos'}), 400
+    if k < 1 or not radius > 0:
+        return jsonify({'error': 'lat, lon, k o radio inválidos'}), 400
+
+    timetable = get_timetable()
+    if timetable is None:
+        return jsonify({'error': 'índice espacial deshabilitado'}), 503
+    stops, distances = stop_grid(timetable).nearest(lat, lon, k, radius)
+    return api_response([
+        dict(_stop_json(timetable, stop), distance_m=round(float(distance), 1))
+        for stop, distance in zip(stops.tolist(), distances)
+    ])
+
+@bp.route('/api/paradas/bbox')
+@versioned(*LOCATION_SCOPES)
+@cached(*LOCATION_SCOPES)
+def paradas_bbox():
+    """Stops inside ``bbox=min_lon,min_lat,max_lon,max_lat``, clustered when
+    ``zoom`` is low or the viewport holds too many of them."""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in request.args['bbox'].split(','))
+        zoom = int(request.args['zoom']) if 'zoom' in request.args else None
+    except (KeyError, ValueError):
+        return jsonify({'error': 'bbox o zoom inválidos'}), 400
+    if zoom is not None and not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        return jsonify({'error': 'bbox o zoom inválidos'}), 400
+
+    timetable = get_timetable()
+    if timetable is None:
+        return jsonify({'error': 'índice espacial deshabilitado'}), 503
+    stops = stop_grid(timetable).within(min_lat, min_lon, max_lat, max_lon)
+    if len(stops) <= MAX_BBOX_STOPS and (zoom is None or zoom >= CLUSTER_BELOW_ZOOM):
+        return api_response({'stops': [_stop_json(timetable, stop) for stop in stops.tolist()],
+                             'clusters': []})
+
+    # Cluster at the requested zoom, or coarser until at most MAX_BBOX_STOPS
+    # stops and clusters are left, whatever zoom the client asked for.
+    zoom = min(zoom if zoom is not None else MAX_ZOOM, CLUSTER_BELOW_ZOOM - 1)
+    labels, counts, lats, lons = cluster(timetable.stop_lat[stops], timetable.stop_lon[stops], zoom)
+    while len(counts) > MAX_BBOX_STOPS and zoom > MIN_ZOOM:
+        zoom -= 1
+        labels, counts, lats, lons = cluster(timetable.stop_lat[stops], timetable.stop_lon[stops],
+                                             zoom)
+    single = counts[labels] == 1
+    return api_response({
+        'stops': [_stop_json(timetable, stop) for stop in stops[single].tolist()],
+        'clusters': [
+            {'lat': float(lat), 'lon': float(lon), 'count': int(count)}
+            for lat, lon, count in zip(lats, lons, counts) if count > 1
+        ],
+    })
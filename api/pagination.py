@@ -0,0 +1,99 @@
+"""Keyset pagination and streaming JSON for list endpoints.
+
+Pages are ordered by a unique key and the client passes back the key of the
+last row it received as an opaque ``cursor``, so every page is an index
+range scan no matter how deep it is. The body stays a list (in the format
+negotiated by ``api.formats``); the cursor of the next page goes in the
+``X-Next-Cursor`` and ``Link`` headers. Streamed responses are always JSON.
+"""
+import json
+import base64
+from urllib.parse import urlencode
+
+from flask import current_app, request, stream_with_context
+from sqlalchemy import tuple_
+
+from api.formats import api_response
+
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip by the server-side cursor while streaming.
+STREAM_BATCH = 1000
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Key values encoded in ``cursor``; raises ValueError if it is malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as exc:
+        raise ValueError("invalid cursor") from exc
+    if not isinstance(values, list):
+        raise ValueError("invalid cursor")
+    return values
+
+
+def _check_cursor(after, types):
+    """Raise ValueError unless ``after`` holds one value of each of ``types``."""
+    if len(after) != len(types):
+        raise ValueError("invalid cursor")
+    for value, expected in zip(after, types):
+        # JSON has no separate bool type to tell from int, so reject it here.
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise ValueError("invalid cursor")
+
+
+def page_args():
+    """``(cursor values or None, page size)`` from the request; ValueError if invalid."""
+    cursor = request.args.get('cursor')
+    limit = int(request.args.get('limite', DEFAULT_PAGE_SIZE))
+    if limit < 1:
+        raise ValueError("invalid limit")
+    return (decode_cursor(cursor) if cursor else None), min(limit, MAX_PAGE_SIZE)
+
+
+def keyset_page(query, key_columns, after, limit):
+    """Rows of ``query`` after the key ``after``, plus whether more follow."""
+    if after is not None:
+        _check_cursor(after, [column.type.python_type for column in key_columns])
+        query = query.filter(tuple_(*key_columns) > tuple_(*after))
+    rows = query.order_by(None).order_by(*key_columns).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def list_page(items, key, types, after, limit):
+    """Same as ``keyset_page`` for an in-memory list already sorted by ``key``,
+    whose values have the Python ``types``."""
+    if after is not None:
+        _check_cursor(after, types)
+        after = tuple(after)
+        items = [item for item in items if key(item) > after]
+    return items[:limit], len(items) > limit
+
+
+def page_response(items, next_key=None):
+    """List response linking to the page after ``next_key`` when given."""
+    response = api_response(items)
+    if next_key is not None:
+        cursor = encode_cursor(next_key)
+        args = request.args.to_dict()
+        args['cursor'] = cursor
+        response.headers['X-Next-Cursor'] = cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
+
+
+def stream_response(query, to_json):
+    """Stream every row of ``query`` as a JSON list from a server-side cursor."""
+    def generate():
+        rows = query.execution_options(yield_per=STREAM_BATCH)
+        yield "["
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + json.dumps(to_json(row), ensure_ascii=False)
+        yield "]"
+    return current_app.response_class(stream_with_context(generate()),
+                                      mimetype='application/json')
@@ -1,7 +1,13 @@
+import time
+
+# Measured from here so the startup report includes the cost of the imports.
+_import_started = time.perf_counter()
+
 import os
+import json
 import datetime
-import jwt
 from functools import wraps
+from itertools import groupby
 from flask import (
     Flask,
     jsonify,
@@ -11,22 +17,57 @@ from flask import (
     url_for,
     render_template,
     flash,
+    stream_with_context,
     send_file,
 )
+import click
 from flask_cors import CORS
+from sqlalchemy.orm import contains_eager
 from dotenv import load_dotenv
 from models import db, User, Region, Route, Stop, Trip, StopTime
-from api.gtfs_routes import bp as gtfs_routes_bp
-import pandas as pd
-import tempfile
-import zipfile
-import io
+from api.gtfs_routes import bp as gtfs_routes_bp, stops_query
+from timetable import init_timetable
+from api.cache import init_cache
+from dataset_version import bump_version, current_version
+from metrics import init_metrics, query_budget
+from export_artifact import artifact_path, build_export, export_status, init_export
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+# Routes per page in the admin list.
+ADMIN_PAGE_SIZE = 100
+
+
+def bootstrap(app):
+    """Create missing tables and the admin user (needs an app context)."""
+    db.create_all()
+    if db.session.query(User.id).first() is None:
+        admin = User(username='admin')
+        admin.set_password(app.config['ADMIN_PASSWORD'])
+        db.session.add(admin)
+        db.session.commit()
+
+
+def report_startup(app, timings):
+    """Keep the startup timings in ``app.extensions`` and log them."""
+    timings = dict(timings, imports=round(IMPORT_SECONDS, 4))
+    timings['total'] = round(sum(timings.values()), 4)
+    app.extensions['startup'] = timings
+    budget = app.config['STARTUP_BUDGET_SECONDS']
+    details = ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in timings.items())
+    if budget and timings['total'] > budget:
+        app.logger.warning('Startup took %.3fs, over its budget of %.3fs (%s)',
+                           timings['total'], budget, details)
+    else:
+        app.logger.info('Startup took %.3fs (%s)', timings['total'], details)
 
 
 def create_app():
+    started = time.perf_counter()
+    timings = {}
     load_dotenv()
     app = Flask(__name__)
-    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    CORS(app, resources={r"/api/*": {"origins": "*", "expose_headers": ["X-Next-Cursor", "Link"]}})
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'changeme')
     app.config['SQLALCHEMY_DATABASE_URI'] = (
         f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@"
@@ -35,16 +76,53 @@ def create_app():
     app.config['ADMIN_PASSWORD'] = os.getenv('ADMIN_PASSWORD', 'changeme')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.permanent_session_lifetime = datetime.timedelta(days=int(os.getenv('SESSION_DAYS', '7')))
+    app.config['TIMETABLE_ENGINE'] = os.getenv('TIMETABLE_ENGINE', '1') == '1'
+    app.config['DATASET_VERSION_TTL'] = float(os.getenv('DATASET_VERSION_TTL', '2'))
+    app.config['API_CACHE_MAX_AGE'] = int(os.getenv('API_CACHE_MAX_AGE', '60'))
+    app.config['RESPONSE_CACHE'] = os.getenv('RESPONSE_CACHE', 'memory')
+    app.config['RESPONSE_CACHE_URL'] = os.getenv('RESPONSE_CACHE_URL')
+    app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', '300'))
+    app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    app.config['EXPORT_DIR'] = os.getenv('EXPORT_DIR', os.path.join('data', 'export'))
+    app.config['EXPORT_ON_IMPORT'] = os.getenv('EXPORT_ON_IMPORT', '1') == '1'
+    app.config['METRICS'] = os.getenv('METRICS', '1') == '1'
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR') or None
+    app.config['SLOW_REQUEST_SECONDS'] = float(os.getenv('SLOW_REQUEST_SECONDS', '1'))
+    app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET', '10'))
+    app.config['APP_BOOTSTRAP'] = os.getenv('APP_BOOTSTRAP', '1') == '1'
+    app.config['STARTUP_BUDGET_SECONDS'] = float(os.getenv('STARTUP_BUDGET_SECONDS', '0'))
+    timings['config'] = time.perf_counter() - started
     db.init_app(app)
+    init_metrics(app)
+    init_timetable(app)
+    init_cache(app)
+    init_export(app)
     app.register_blueprint(gtfs_routes_bp)
+    timings['extensions'] = time.perf_counter() - started - timings['config']
 
-    with app.app_context():
-        db.create_all()
-        if User.query.count() == 0:
-            admin = User(username='admin')
-            admin.set_password(app.config['ADMIN_PASSWORD'])
-            db.session.add(admin)
-            db.session.commit()
+    # Workers started with APP_BOOTSTRAP=0 touch no database at startup; the
+    # schema and the admin user come from `flask init-db` at deploy time.
+    if app.config['APP_BOOTSTRAP']:
+        phase_started = time.perf_counter()
+        with app.app_context():
+            bootstrap(app)
+        timings['bootstrap'] = time.perf_counter() - phase_started
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Create the tables and the admin user if they are missing."""
+        bootstrap(app)
+        click.echo('Database initialized')
+
+    @app.cli.command('build-export')
+    def build_export_command():
+        """Build the GTFS export of the current data version if it is missing."""
+        info = build_export(app)
+        if info is None:
+            click.echo('Another process is building the export')
+        else:
+            click.echo(f"GTFS export version {info['version']} at "
+                       f"{artifact_path(app.config['EXPORT_DIR'], info['version'])}")
 
     def login_required(view):
         @wraps(view)
@@ -81,46 +159,55 @@ def create_app():
 
     @app.route('/')
     @login_required
+    @query_budget(2)
     def list_routes():
         search = request.args.get('region')
-        query = Route.query.join(Region)
+        after = request.args.get('after', type=int)
+        query = Route.query.join(Region).options(contains_eager(Route.region))
         if search:
             query = query.filter(Region.name.ilike(f"%{search}%"))
-        routes = query.all()
-        return render_template('routes.html', routes=routes, search=search)
+        if after is not None:
+            query = query.filter(Route.id > after)
+        routes = query.order_by(Route.id).limit(ADMIN_PAGE_SIZE + 1).all()
+        next_after = routes[ADMIN_PAGE_SIZE - 1].id if len(routes) > ADMIN_PAGE_SIZE else None
+        return render_template('routes.html', routes=routes[:ADMIN_PAGE_SIZE], search=search,
+                               after=after, next_after=next_after)
 
     @app.route('/routes/new', methods=['GET', 'POST'])
     @login_required
     def new_route():
-        regions = Region.query.all()
         if request.method == 'POST':
             region_id = request.form.get('region_id')
             short_name = request.form.get('short_name')
             long_name = request.form.get('long_name')
             route = Route(region_id=region_id, short_name=short_name, long_name=long_name)
             db.session.add(route)
+            bump_version(db.session, 'routes')
             db.session.commit()
             return redirect(url_for('list_routes'))
-        return render_template('route_form.html', regions=regions, route=None)
+        return render_template('route_form.html', regions=Region.query.order_by(Region.name).all(),
+                               route=None)
 
     @app.route('/routes/<int:route_id>/edit', methods=['GET', 'POST'])
     @login_required
     def edit_route(route_id):
         route = Route.query.get_or_404(route_id)
-        regions = Region.query.all()
         if request.method == 'POST':
             route.region_id = request.form.get('region_id')
             route.short_name = request.form.get('short_name')
             route.long_name = request.form.get('long_name')
+            bump_version(db.session, 'routes')
             db.session.commit()
             return redirect(url_for('list_routes'))
-        return render_template('route_form.html', route=route, regions=regions)
+        return render_template('route_form.html', route=route,
+                               regions=Region.query.order_by(Region.name).all())
 
     @app.route('/routes/<int:route_id>/delete', methods=['POST'])
     @login_required
     def delete_route(route_id):
         route = Route.query.get_or_404(route_id)
         db.session.delete(route)
+        bump_version(db.session, 'routes', 'trips', 'stop_times')
         db.session.commit()
         return redirect(url_for('list_routes'))
 
@@ -128,8 +215,9 @@ def create_app():
     @login_required
     def view_stops(route_id):
         route = Route.query.get_or_404(route_id)
-        stops = Stop.query.join(StopTime).join(Trip).filter(Trip.route_id == route_id).all()
-        return render_template('stops.html', route=route, stops=stops)
+        # One list of ordered stops per pattern, in pattern order.
+        patterns = [list(stops) for _, stops in groupby(stops_query(route_id), key=lambda s: s.pattern_id)]
+        return render_template('stops.html', route=route, patterns=patterns)
 
     @app.route('/stops/<stop_id>/edit', methods=['GET', 'POST'])
     @login_required
@@ -139,6 +227,7 @@ def create_app():
             stop.name = request.form.get('name')
             stop.lat = float(request.form.get('lat'))
             stop.lon = float(request.form.get('lon'))
+            bump_version(db.session, 'stops')
             db.session.commit()
             return redirect(url_for('view_stops', route_id=request.form.get('route_id')))
         return render_template('stop_form.html', stop=stop)
@@ -161,6 +250,7 @@ def create_app():
                             long_name=item.get('ruta'),
                         )
                         db.session.add(route)
+                    bump_version(db.session, 'routes')
                     db.session.commit()
                     flash('Datos importados')
                     return redirect(url_for('list_routes'))
@@ -169,24 +259,30 @@ def create_app():
     @app.route('/export_gtfs')
     @login_required
     def export_gtfs():
-        # Export simple routes and stops to GTFS format
-        tmpdir = tempfile.mkdtemp()
-        routes_df = pd.read_sql(Route.query.statement, db.session.bind)
-        routes_df.rename(columns={'id': 'route_id', 'short_name': 'route_short_name', 'long_name': 'route_long_name', 'type': 'route_type'}, inplace=True)
-        routes_df.to_csv(os.path.join(tmpdir, 'routes.txt'), index=False)
-
-        stops_df = pd.read_sql(Stop.query.statement, db.session.bind)
-        stops_df.rename(columns={'id': 'stop_id', 'name': 'stop_name', 'lat': 'stop_lat', 'lon': 'stop_lon'}, inplace=True)
-        stops_df.to_csv(os.path.join(tmpdir, 'stops.txt'), index=False)
-
-        data = io.BytesIO()
-        with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for fname in ['routes.txt', 'stops.txt']:
-                path = os.path.join(tmpdir, fname)
-                if os.path.exists(path):
-                    zf.write(path, arcname=fname)
-        data.seek(0)
-        return send_file(data, mimetype='application/zip', download_name='gtfs.zip', as_attachment=True)
+        # Serve the prebuilt artifact of the current version (with ETag and
+        # Range support); until a loader or `flask build-export` builds it,
+        # stream a fresh export.
+        version = current_version()
+        path = os.path.abspath(artifact_path(app.config['EXPORT_DIR'], version))
+        if os.path.exists(path):
+            return send_file(path, mimetype='application/zip', download_name='gtfs.zip',
+                             as_attachment=True, conditional=True, etag=f'gtfs-{version}')
+        from gtfs_export import iter_gtfs_zip
+
+        def generate():
+            with db.engine.connect() as connection:
+                connection = connection.execution_options(isolation_level='REPEATABLE READ')
+                yield from iter_gtfs_zip(connection)
+        return app.response_class(
+            stream_with_context(generate()),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=gtfs.zip'},
+        )
+
+    @app.route('/export_gtfs/estado')
+    @login_required
+    def export_gtfs_status():
+        return jsonify(export_status(app, current_version()))
 
     @app.route('/api/register', methods=['POST'])
     def register():
@@ -209,6 +305,8 @@ def create_app():
 
         user = User.query.filter_by(username=data['username']).first()
         if user and user.check_password(data['password']):
+            import jwt
+
             expiration_hours = int(os.getenv('TOKEN_EXPIRATION_HOURS', '12'))
             payload = {
                 'user_id': user.id,
@@ -227,6 +325,8 @@ def create_app():
 
         return jsonify({'error': 'invalid credentials'}), 401
 
+    timings['routes'] = time.perf_counter() - started - sum(timings.values())
+    report_startup(app, {phase: round(seconds, 4) for phase, seconds in timings.items()})
     return app
 
 
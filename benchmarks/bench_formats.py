@@ -0,0 +1,76 @@
+"""Benchmark de tamaño y latencia de los formatos de respuesta de la API.
+
+Pide /api/paradas y /api/horarios de rutas aleatorias con cada combinación de
+``Accept`` y ``Accept-Encoding`` a través del cliente de pruebas de Flask,
+con la caché de respuestas desactivada:
+
+    python benchmarks/bench_formats.py --requests 100 --date 2025-03-03
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime as dt
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.formats import COLUMNAR_JSON, JSON, MSGPACK  # noqa: E402
+
+
+VARIANTS = [(mimetype, encoding)
+            for mimetype in (JSON, COLUMNAR_JSON, MSGPACK)
+            for encoding in ("identity", "gzip", "br")]
+
+
+def _sample_urls(app, count, date, seed):
+    from models import db, Route, StopTime, Trip
+
+    rng = random.Random(seed)
+    with app.app_context():
+        route_ids = [r for (r,) in db.session.query(Route.id).order_by(Route.id)]
+        routes = rng.sample(route_ids, min(count, len(route_ids)))
+        stops = {}
+        for route_id in routes:
+            stop = (db.session.query(StopTime.stop_id).join(Trip)
+                    .filter(Trip.route_id == route_id).limit(1).scalar())
+            if stop is not None:
+                stops[route_id] = stop
+    paradas = [f"/api/paradas?ruta={r}&limite=1000" for r in routes]
+    horarios = [f"/api/horarios?ruta={r}&parada={s}&fecha={date}&hora=06:00&limite=100"
+                for r, s in stops.items()]
+    return {"paradas": paradas, "horarios": horarios}
+
+
+def run(app, count, date, seed):
+    app.extensions["response_cache"] = None
+    client = app.test_client()
+    endpoints = _sample_urls(app, count, date, seed)
+    for name, urls in endpoints.items():
+        print(f"/api/{name}: {len(urls)} requests per variant")
+        print(f"  {'format':40} {'encoding':9} {'bytes avg':>10} {'ms p50':>8} {'ms p90':>8}")
+        for mimetype, encoding in VARIANTS:
+            headers = {"Accept": mimetype, "Accept-Encoding": encoding}
+            sizes, timings = [], []
+            for url in urls:
+                start = time.perf_counter()
+                response = client.get(url, headers=headers)
+                timings.append(time.perf_counter() - start)
+                sizes.append(len(response.get_data()))
+            ms = np.array(timings) * 1000
+            print(f"  {mimetype:40} {encoding:9} {np.mean(sizes):10.0f} "
+                  f"{np.percentile(ms, 50):8.2f} {np.percentile(ms, 90):8.2f}")
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Benchmark de formatos y compresión de la API")
+    parser.add_argument("--requests", type=int, default=50, help="rutas a consultar")
+    parser.add_argument("--date", default=dt.date.today().isoformat(), help="fecha YYYY-MM-DD")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    run(create_app(), args.requests, args.date, args.seed)
@@ -0,0 +1,79 @@
+"""Benchmark de /api/planificar sobre pares origen-destino aleatorios.
+
+Construye el horario en memoria desde la base configurada y mide el tiempo
+de ``planner.plan`` para cada par, sin pasar por HTTP:
+
+    python benchmarks/bench_planner.py --pairs 500 --date 2025-03-03 --time 07:00
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime as dt
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gtfs_time import to_seconds  # noqa: E402
+from planner import plan, warm  # noqa: E402
+from timetable import Timetable  # noqa: E402
+
+
+def _percentiles(samples):
+    values = np.array(samples) * 1000
+    return {name: round(float(np.percentile(values, q)), 2)
+            for name, q in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))}
+
+
+def run(app, pairs, date, after, itineraries, seed):
+    from models import db
+
+    with app.app_context():
+        start = time.perf_counter()
+        with db.engine.connect() as connection:
+            timetable = Timetable.load(connection)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        connections = timetable.connections
+        prepare = time.perf_counter() - start
+        # As get_timetable does, so the first query does not pay for the day's connections.
+        start = time.perf_counter()
+        warm(timetable, date)
+        warm_time = time.perf_counter() - start
+
+    # Only stops with departures can be origins or destinations.
+    served = np.flatnonzero(np.diff(timetable.stop_offsets) > 0)
+    rng = random.Random(seed)
+    timings, found, transfers = [], 0, []
+    for _ in range(pairs):
+        origin, destination = rng.sample(served.tolist(), 2)
+        start = time.perf_counter()
+        result = plan(timetable, [origin], [destination], date, after, itineraries)
+        timings.append(time.perf_counter() - start)
+        if result:
+            found += 1
+            transfers.append(result[0]["transfers"])
+
+    print(f"timetable: {len(timetable.stop_ids)} stops, {len(timetable.trip_ids)} trips, "
+          f"{len(connections.departure)} connections")
+    print(f"build {build:.2f}s, connections {prepare:.2f}s, warm {warm_time:.2f}s")
+    print(f"{pairs} pairs, {found} with itineraries"
+          + (f", {np.mean(transfers):.2f} transfers on average" if transfers else ""))
+    print("ms per query:", _percentiles(timings))
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description="Benchmark del planificador de viajes")
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--date", default=dt.date.today().isoformat(), help="fecha YYYY-MM-DD")
+    parser.add_argument("--time", default="07:00", help="hora de salida")
+    parser.add_argument("--itineraries", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    run(create_app(), args.pairs, dt.date.fromisoformat(args.date), to_seconds(args.time),
+        args.itineraries, args.seed)
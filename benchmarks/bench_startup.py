@@ -0,0 +1,90 @@
+"""Tiempo de arranque en frío de la aplicación.
+
+Inicia varias veces un intérprete nuevo que importa ``app`` y llama a
+``create_app()``, como hace cada worker de gunicorn, y reporta la mediana y el
+máximo de cada fase (importaciones, configuración, extensiones, bootstrap y
+rutas). Con ``--budget`` termina con código 1 si la mediana del total lo
+supera, para usarlo en CI:
+
+    APP_BOOTSTRAP=0 python benchmarks/bench_startup.py --runs 10 --budget 1.5
+
+``--imports N`` muestra además los N módulos cuya importación es más lenta
+(según ``python -X importtime``).
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, time
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+timings = dict(app.extensions['startup'], wall=round(time.perf_counter() - started, 4))
+print(json.dumps(timings))
+"""
+
+
+def measure(runs):
+    """Startup timings of ``runs`` fresh interpreters."""
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, capture_output=True,
+                                text=True, check=True)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def summarize(samples):
+    phases = [phase for phase in samples[0] if all(phase in s for s in samples)]
+    return {
+        phase: {
+            "median": round(statistics.median(s[phase] for s in samples), 4),
+            "max": round(max(s[phase] for s in samples), 4),
+        }
+        for phase in phases
+    }
+
+
+def slowest_imports(count):
+    """``(seconds, module)`` of the slowest top-level imports made by ``app``."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Only modules imported directly by ``app`` (one level of indentation).
+        if name.startswith("   ") and not name.startswith("    ") and cumulative.strip().isdigit():
+            modules.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide el arranque en frío de la aplicación")
+    parser.add_argument("--runs", type=int, default=5, help="intérpretes a iniciar")
+    parser.add_argument("--budget", type=float, help="segundos máximos (mediana del total)")
+    parser.add_argument("--imports", type=int, default=0,
+                        help="cantidad de importaciones más lentas a mostrar")
+    parser.add_argument("--out", help="archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    summary = summarize(measure(args.runs))
+    for phase, values in summary.items():
+        print(f"{phase:12} median {values['median']:.3f}s  max {values['max']:.3f}s")
+    if args.imports:
+        print("slowest imports:")
+        for seconds, name in slowest_imports(args.imports):
+            print(f"  {seconds:.3f}s  {name}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"runs": args.runs, "phases": summary}, f, indent=2)
+    if args.budget and summary["total"]["median"] > args.budget:
+        print(f"startup over budget: {summary['total']['median']:.3f}s > {args.budget:.3f}s")
+        sys.exit(1)
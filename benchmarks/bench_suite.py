@@ -0,0 +1,240 @@
+"""Suite de benchmarks de cargadores, exportación y endpoints de la API.
+
+Mide contra la base PostgreSQL configurada (usa una base desechable: los
+datos se cargan en ella) la carga GTFS (``load_gtfs_data``), la importación
+JSON (``json_to_db``), la exportación (``/export_gtfs``) y cada endpoint de
+``api/gtfs_routes``. Registra el rendimiento, la latencia p50/p99 y el pico de
+memoria residente en un archivo JSON, para comparar corridas:
+
+    python benchmarks/generate_feed.py --out data/bench/gtfs --json-dir data/bench/json --json-routes 500
+    python benchmarks/bench_suite.py --data-dir data/bench/gtfs --json-dir data/bench/json \\
+        --date 2025-03-03 --out bench-results.json
+    python benchmarks/bench_suite.py --compare bench-anterior.json bench-results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import subprocess
+import datetime as dt
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+STEPS = ("load", "json", "export", "api")
+
+
+def _peak_rss_mb():
+    """Peak resident memory of this process and of its finished children, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {"self": round(own, 1), "children": round(children, 1)}
+
+
+def _latency(samples):
+    values = np.array(samples) * 1000
+    total = sum(samples)
+    return {
+        "requests": len(samples),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+        "requests_per_sec": round(len(samples) / total, 1) if total else 0.0,
+    }
+
+
+def bench_load(app, data_dir, workers):
+    from gtfs_loader import load_gtfs_data
+
+    start = time.perf_counter()
+    stats = load_gtfs_data(app, data_dir, workers=workers)
+    elapsed = time.perf_counter() - start
+    rows = sum(v["read"] for v in stats.values())
+    return {
+        "seconds": round(elapsed, 2),
+        "rows": rows,
+        "rows_per_sec": round(rows / elapsed, 1),
+        "tables": {name: {"read": v["read"], "inserted": v["inserted"],
+                          "rows_per_sec": v["rows_per_sec"]} for name, v in stats.items()},
+    }
+
+
+def bench_json(app, json_dir):
+    from json_loader import json_to_db
+
+    start = time.perf_counter()
+    summary = json_to_db(app, json_dir)
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 2),
+        "files": len(summary),
+        "files_per_sec": round(len(summary) / elapsed, 1) if elapsed else 0.0,
+        "stop_times": sum(c["stop_times"] for c in summary.values()),
+    }
+
+
+def _client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': app.config['ADMIN_PASSWORD']})
+    return client
+
+
+def bench_export(app):
+    """Time the streaming export (no prebuilt artifact) end to end."""
+    client = _client(app)
+    start = time.perf_counter()
+    response = client.get('/export_gtfs')
+    size = sum(len(chunk) for chunk in response.response)
+    response.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 2),
+        "bytes": size,
+        "mb_per_sec": round(size / elapsed / 1e6, 2),
+    }
+
+
+def _api_urls(app, count, date, seed):
+    """Random requests for every endpoint, built from the loaded data."""
+    from timetable import Timetable
+    from models import db
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            timetable = Timetable.load(connection)
+    rng = random.Random(seed)
+    served = np.flatnonzero(np.diff(timetable.stop_offsets) > 0).tolist()
+    routes = timetable.route_ids.tolist()
+    located = [s for s in range(len(timetable.stop_ids))
+               if timetable.stop_lat[s] or timetable.stop_lon[s]]
+    urls = {name: [] for name in ("rutas", "paradas", "horarios", "planificar",
+                                  "paradas_cercanas", "paradas_bbox")}
+    for _ in range(count):
+        urls["rutas"].append(f"/api/rutas?limite={rng.choice((50, 500))}")
+        urls["paradas"].append(f"/api/paradas?ruta={rng.choice(routes)}")
+        stop = rng.choice(served)
+        begin, end = timetable.stop_offsets[stop], timetable.stop_offsets[stop + 1]
+        route = int(timetable.route_ids[timetable.departure_route[rng.randrange(begin, end)]])
+        hour = f"{rng.randrange(5, 22):02d}:00"
+        urls["horarios"].append(f"/api/horarios?ruta={route}&parada={timetable.stop_ids[stop]}"
+                                f"&fecha={date}&hora={hour}")
+        origin, destination = rng.sample(served, 2)
+        urls["planificar"].append(f"/api/planificar?origen={timetable.stop_ids[origin]}"
+                                  f"&destino={timetable.stop_ids[destination]}&fecha={date}&hora={hour}")
+        if located:
+            s = rng.choice(located)
+            lat, lon = float(timetable.stop_lat[s]), float(timetable.stop_lon[s])
+            urls["paradas_cercanas"].append(f"/api/paradas/cercanas?lat={lat}&lon={lon}&k=10")
+            zoom = rng.choice((11, 13, 15, 16))
+            half = 180.0 / 2 ** zoom
+            urls["paradas_bbox"].append(f"/api/paradas/bbox?bbox={lon - half},{lat - half},"
+                                        f"{lon + half},{lat + half}&zoom={zoom}")
+    return urls
+
+
+def bench_api(app, count, date, seed):
+    """Latency of every endpoint without the response cache or conditional requests."""
+    app.extensions['response_cache'] = None
+    client = app.test_client()
+    client.get('/api/ping')
+    # Build the timetable and spatial index outside the measurements.
+    start = time.perf_counter()
+    client.get('/api/paradas/cercanas?lat=0&lon=0')
+    warmup = time.perf_counter() - start
+    results = {"warmup_seconds": round(warmup, 2)}
+    for name, urls in _api_urls(app, count, date, seed).items():
+        timings, errors = [], 0
+        for url in urls:
+            start = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            timings.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+        if timings:
+            results[name] = dict(_latency(timings), errors=errors)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(app, args):
+    app.config['EXPORT_ON_IMPORT'] = False
+    app.config['SLOW_REQUEST_SECONDS'] = 0
+    results = {
+        "started_at": dt.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "steps": {},
+    }
+    steps = args.steps.split(",")
+    if "load" in steps and args.data_dir:
+        results["steps"]["load"] = bench_load(app, args.data_dir, args.workers)
+    if "json" in steps and args.json_dir:
+        results["steps"]["json"] = bench_json(app, args.json_dir)
+    if "export" in steps:
+        results["steps"]["export"] = bench_export(app)
+    if "api" in steps:
+        results["steps"]["api"] = bench_api(app, args.requests, args.date, args.seed)
+    results["peak_rss_mb"] = _peak_rss_mb()
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results["steps"], indent=2))
+    print(f"peak RSS: {results['peak_rss_mb']} MB; results written to {args.out}")
+
+
+def _flatten(data, prefix=""):
+    for key, value in data.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(before_path, after_path):
+    """Print every numeric result of two runs side by side with the change."""
+    def load(path):
+        with open(path) as f:
+            run = json.load(f)
+        return dict(_flatten(dict(run["steps"], peak_rss_mb=run["peak_rss_mb"])))
+
+    before, after = load(before_path), load(after_path)
+    for key in sorted(set(before) & set(after)):
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"{key:45} {old:>12} {new:>12} {change:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de carga, exportación y API")
+    parser.add_argument("--data-dir", help="feed GTFS a cargar (ver generate_feed.py)")
+    parser.add_argument("--json-dir", help="rutas JSON a importar")
+    parser.add_argument("--workers", type=int, default=1, help="procesos de carga GTFS")
+    parser.add_argument("--requests", type=int, default=200, help="solicitudes por endpoint")
+    parser.add_argument("--date", default=dt.date.today().isoformat(), help="fecha YYYY-MM-DD")
+    parser.add_argument("--steps", default=",".join(STEPS),
+                        help=f"pasos a medir, separados por comas ({', '.join(STEPS)})")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench-results.json", help="archivo de resultados")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"),
+                        help="compara dos archivos de resultados y termina")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        from app import create_app
+
+        run(create_app(), args)
@@ -0,0 +1,247 @@
+"""Generador determinista de feeds GTFS sintéticos a escala nacional.
+
+Reparte las paradas alrededor de las principales ciudades de Nicaragua. Cada
+ruta recorre paradas de una ciudad en ambos sentidos, con frecuencias que
+dependen del servicio: laborables, sábados y domingos. Los calendarios
+incluyen excepciones en los feriados nacionales. Con la misma semilla y los
+mismos parámetros el feed es idéntico byte a byte:
+
+    python benchmarks/generate_feed.py --out data/bench/gtfs \\
+        --routes 1000 --stops 50000 --trips 100000 --stops-per-trip 100
+
+Con ``--json-dir`` se generan además archivos de rutas en el formato del
+scraper, para medir ``json_loader``.
+"""
+import os
+import csv
+import json
+import math
+import argparse
+import datetime as dt
+
+import numpy as np
+
+
+# (name, lat, lon, relative size, spread in degrees)
+CITIES = [
+    ("Managua", 12.136, -86.251, 30, 0.08),
+    ("León", 12.435, -86.879, 8, 0.04),
+    ("Masaya", 11.974, -86.094, 7, 0.03),
+    ("Chinandega", 12.629, -87.131, 6, 0.03),
+    ("Matagalpa", 12.925, -85.917, 6, 0.03),
+    ("Estelí", 13.092, -86.354, 6, 0.03),
+    ("Granada", 11.934, -85.956, 5, 0.03),
+    ("Jinotega", 13.091, -86.000, 4, 0.03),
+    ("Juigalpa", 12.106, -85.364, 3, 0.03),
+    ("Rivas", 11.438, -85.826, 3, 0.03),
+    ("Bluefields", 12.013, -83.764, 3, 0.03),
+    ("Puerto Cabezas", 14.035, -83.388, 2, 0.03),
+]
+# service_id -> (weekdays it runs Monday..Sunday, share of the trips)
+SERVICES = {
+    "LAB": ((1, 1, 1, 1, 1, 0, 0), 0.6),
+    "SAB": ((0, 0, 0, 0, 0, 1, 0), 0.25),
+    "DOM": ((0, 0, 0, 0, 0, 0, 1), 0.15),
+}
+# Fixed-date national holidays (month, day); Holy Week is computed per year.
+HOLIDAYS = [(1, 1), (5, 1), (7, 19), (9, 14), (9, 15), (12, 8), (12, 25)]
+AGENCIES = 5
+# Longest trip, from the first to the last stop.
+MAX_TRIP_SECONDS = 4 * 3600
+
+
+def _easter(year):
+    """Gregorian Easter Sunday (anonymous algorithm)."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    return dt.date(year, month, (h + l - 7 * m + 114) % 31 + 1)
+
+
+def holidays(start, end):
+    days = []
+    for year in range(start.year, end.year + 1):
+        easter = _easter(year)
+        days += [dt.date(year, m, d) for m, d in HOLIDAYS]
+        days += [easter - dt.timedelta(days=3), easter - dt.timedelta(days=2)]
+    return sorted(day for day in days if start <= day <= end)
+
+
+def _hms(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _writer(path, header):
+    f = open(path, "w", newline="", encoding="utf-8")
+    writer = csv.writer(f)
+    writer.writerow(header)
+    return f, writer
+
+
+def generate(out_dir, routes=1000, stops=50000, trips=100000, stops_per_trip=100,
+             start=dt.date(2025, 1, 1), days=365, seed=1, json_dir=None, json_routes=0):
+    """Write the feed to ``out_dir``; return the number of rows per file."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    end = start + dt.timedelta(days=days - 1)
+    counts = {}
+
+    with open(os.path.join(out_dir, "agency.txt"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["agency_id", "agency_name", "agency_url", "agency_timezone", "agency_lang"])
+        for a in range(1, AGENCIES + 1):
+            writer.writerow([f"A{a}", f"Cooperativa {a}", f"https://example.org/a{a}",
+                             "America/Managua", "es"])
+    counts["agency"] = AGENCIES
+
+    with open(os.path.join(out_dir, "calendar.txt"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["service_id", "monday", "tuesday", "wednesday", "thursday", "friday",
+                         "saturday", "sunday", "start_date", "end_date"])
+        for service_id, (weekdays, _) in SERVICES.items():
+            writer.writerow([service_id, *weekdays, start.strftime("%Y%m%d"), end.strftime("%Y%m%d")])
+    counts["calendar"] = len(SERVICES)
+
+    # Holidays run the Sunday service instead of the regular one.
+    exceptions = 0
+    with open(os.path.join(out_dir, "calendar_dates.txt"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["service_id", "date", "exception_type"])
+        for day in holidays(start, end):
+            weekday = day.weekday()
+            for service_id, (weekdays, _) in SERVICES.items():
+                if weekdays[weekday] and service_id != "DOM":
+                    writer.writerow([service_id, day.strftime("%Y%m%d"), 2])
+                    exceptions += 1
+            if weekday != 6:
+                writer.writerow(["DOM", day.strftime("%Y%m%d"), 1])
+                exceptions += 1
+    counts["calendar_dates"] = exceptions
+
+    # Stops around the cities, in proportion to their size.
+    sizes = np.array([c[3] for c in CITIES], dtype=float)
+    stop_city = rng.choice(len(CITIES), size=stops, p=sizes / sizes.sum())
+    centers = np.array([(c[1], c[2]) for c in CITIES])
+    spread = np.array([c[4] for c in CITIES])[stop_city]
+    stop_lat = centers[stop_city, 0] + rng.normal(0, 1, stops) * spread
+    stop_lon = centers[stop_city, 1] + rng.normal(0, 1, stops) * spread
+    city_stops = [np.flatnonzero(stop_city == c) for c in range(len(CITIES))]
+    with open(os.path.join(out_dir, "stops.txt"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stop_id", "stop_name", "stop_lat", "stop_lon"])
+        for i in range(stops):
+            writer.writerow([f"S{i}", f"{CITIES[stop_city[i]][0]} - Parada {i}",
+                             round(float(stop_lat[i]), 6), round(float(stop_lon[i]), 6)])
+    counts["stops"] = stops
+
+    # Routes: a city, a path through its stops ordered along a random
+    # bearing, a speed and whether it runs past midnight.
+    route_city = rng.choice(len(CITIES), size=routes, p=sizes / sizes.sum())
+    patterns = []
+    with open(os.path.join(out_dir, "routes.txt"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["route_id", "agency_id", "route_short_name", "route_long_name", "route_type"])
+        for r in range(routes):
+            candidates = city_stops[route_city[r]]
+            if len(candidates) < 2:
+                candidates = np.arange(stops)
+            length = int(np.clip(rng.normal(stops_per_trip, stops_per_trip / 5), 2, len(candidates)))
+            path = rng.choice(candidates, size=length, replace=False)
+            bearing = rng.uniform(0, math.pi)
+            path = path[np.argsort(stop_lat[path] * math.cos(bearing) + stop_lon[path] * math.sin(bearing))]
+            km = np.hypot(np.diff(stop_lat[path]), np.diff(stop_lon[path])) * 111.0
+            speed = rng.uniform(15, 30) / 3600  # km per second
+            hops = np.maximum(30, km / speed + 20)
+            # Long zigzagging paths are squeezed into a realistic trip length.
+            hops = np.maximum(30, hops * min(1.0, MAX_TRIP_SECONDS / hops.sum())).astype(int)
+            patterns.append((path, hops, rng.random() < 0.1))
+            city = CITIES[route_city[r]][0]
+            writer.writerow([r + 1, f"A{r % AGENCIES + 1}", f"{r + 1}",
+                             f"{city} {r + 1}", 3])
+    counts["routes"] = routes
+
+    # Trips per route and service, spread over the service span.
+    trips_per_route = rng.multinomial(trips, np.full(routes, 1 / routes))
+    services = list(SERVICES)
+    shares = np.array([SERVICES[s][1] for s in services])
+    trip_file, trip_writer = _writer(os.path.join(out_dir, "trips.txt"),
+                                     ["route_id", "service_id", "trip_id", "trip_headsign",
+                                      "direction_id"])
+    st_file, st_writer = _writer(os.path.join(out_dir, "stop_times.txt"),
+                                 ["trip_id", "arrival_time", "departure_time", "stop_id",
+                                  "stop_sequence"])
+    trip_id = 0
+    stop_times = 0
+    try:
+        for r, count in enumerate(trips_per_route.tolist()):
+            path, hops, night = patterns[r]
+            offsets = np.concatenate([[0], np.cumsum(hops)])
+            per_service = rng.multinomial(count, shares)
+            for service_id, service_trips in zip(services, per_service.tolist()):
+                if not service_trips:
+                    continue
+                first = rng.uniform(4.5, 6.5) * 3600
+                last = (rng.uniform(24, 25) if night else rng.uniform(21, 23.5)) * 3600
+                departures = np.sort(np.linspace(first, last, service_trips)
+                                     + rng.normal(0, 60, service_trips))
+                for n, departure in enumerate(departures.tolist()):
+                    direction = n % 2
+                    stop_ids = path if direction == 0 else path[::-1]
+                    times = departure + (offsets if direction == 0 else offsets[-1] - offsets[::-1])
+                    trip = f"T{trip_id}"
+                    trip_id += 1
+                    headsign = f"{CITIES[stop_city[stop_ids[-1]]][0]} - Parada {stop_ids[-1]}"
+                    trip_writer.writerow([r + 1, service_id, trip, headsign, direction])
+                    st_writer.writerows(
+                        (trip, t, t, f"S{s}", seq)
+                        for seq, (s, t) in enumerate(zip(stop_ids.tolist(), map(_hms, times)), 1)
+                    )
+                    stop_times += len(stop_ids)
+    finally:
+        trip_file.close()
+        st_file.close()
+    counts["trips"] = trip_id
+    counts["stop_times"] = stop_times
+
+    if json_dir and json_routes:
+        os.makedirs(json_dir, exist_ok=True)
+        for i in range(json_routes):
+            path, hops, _ = patterns[i % routes]
+            city = CITIES[route_city[i % routes]][0]
+            departures = np.arange(rng.uniform(5, 6) * 3600, 21 * 3600, rng.uniform(600, 1800))
+            data = {
+                "region": city,
+                "ruta": f"{city} JSON {i + 1}",
+                "paradas": [f"{city} - Parada {s}" for s in path[:30].tolist()],
+                "salidas": [{"hora": _hms(t)[:5]} for t in departures.tolist()],
+            }
+            with open(os.path.join(json_dir, f"ruta_{i + 1:05d}.json"), "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+        counts["json_routes"] = json_routes
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera un feed GTFS sintético")
+    parser.add_argument("--out", default="data/bench/gtfs", help="directorio del feed")
+    parser.add_argument("--routes", type=int, default=1000)
+    parser.add_argument("--stops", type=int, default=50000)
+    parser.add_argument("--trips", type=int, default=100000)
+    parser.add_argument("--stops-per-trip", type=int, default=100,
+                        help="paradas promedio por viaje (stop_times = trips * este valor)")
+    parser.add_argument("--start-date", default="2025-01-01", help="inicio del calendario YYYY-MM-DD")
+    parser.add_argument("--days", type=int, default=365, help="días cubiertos por el calendario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json-dir", help="directorio para rutas en formato JSON")
+    parser.add_argument("--json-routes", type=int, default=0, help="cantidad de rutas JSON")
+    args = parser.parse_args()
+
+    print(generate(args.out, args.routes, args.stops, args.trips, args.stops_per_trip,
+                   dt.date.fromisoformat(args.start_date), args.days, args.seed,
+                   args.json_dir, args.json_routes))
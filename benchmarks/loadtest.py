@@ -0,0 +1,256 @@
+"""Prueba de carga HTTP de la API bajo gunicorn, con reporte de SLO.
+
+Levanta la aplicación (``app:create_app()``) con gunicorn en local para cada
+cantidad de workers indicada y reproduce una mezcla ponderada de solicitudes
+(``/api/rutas`` por región, ``/api/paradas`` y ``/api/horarios`` por fecha)
+con rampas de concurrencia. Por etapa y endpoint reporta solicitudes por
+segundo, latencia p50/p95/p99 y tasa de errores, y marca si se cumple el SLO.
+Al final muestra el mayor rendimiento sostenido dentro del SLO por cantidad
+de workers:
+
+    python benchmarks/loadtest.py --workers 1,4 --concurrency 1,8,32,64 \\
+        --duration 20 --mix rutas=1,paradas=3,horarios=6 --date 2025-03-03
+
+Las solicitudes se generan desde la base configurada, así que debe tener
+datos cargados (ver ``generate_feed.py``). ``--url`` apunta a un servidor ya
+levantado en lugar de iniciar gunicorn. El generador corre en un solo
+proceso; si su CPU se satura, los resultados de alta concurrencia lo miden a
+él y no a la API.
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import subprocess
+import datetime as dt
+import urllib.request
+from collections import Counter, defaultdict
+
+import aiohttp
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_MIX = "rutas=1,paradas=3,horarios=6"
+BOOT_TIMEOUT = 60
+REQUEST_TIMEOUT = 30
+# Requests kept per endpoint for each kind of pool.
+POOL_SIZE = 2000
+
+
+def parse_mix(value):
+    """``"rutas=1,paradas=3"`` -> ``{"rutas": 1.0, "paradas": 3.0}``."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def request_pools(app, dates, seed):
+    """Request paths per endpoint built from the data in the configured database."""
+    from sqlalchemy import func
+    from models import db, Region, Route, RoutePattern, RoutePatternStop
+
+    rng = random.Random(seed)
+    with app.app_context():
+        regions = [name for (name,) in
+                   db.session.query(Region.name).join(Route).distinct().limit(POOL_SIZE)]
+        routes = [route_id for (route_id,) in db.session.query(Route.id).limit(POOL_SIZE)]
+        stops = db.session.query(RoutePattern.route_id, RoutePatternStop.stop_id) \
+            .join(RoutePatternStop, RoutePatternStop.pattern_id == RoutePattern.id) \
+            .order_by(func.random()).limit(POOL_SIZE).all()
+    return {
+        "rutas": [f"/api/rutas?region={rng.choice(regions)}" for _ in range(POOL_SIZE)] if regions
+        else ["/api/rutas"],
+        "paradas": [f"/api/paradas?ruta={route_id}" for route_id in routes],
+        "horarios": [
+            f"/api/horarios?ruta={route_id}&parada={stop_id}&fecha={rng.choice(dates)}"
+            f"&hora={rng.randrange(5, 22):02d}:{rng.choice(('00', '30'))}"
+            for route_id, stop_id in stops
+        ],
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, port, threads):
+    """Run gunicorn with ``workers`` processes; return the process once it answers."""
+    env = dict(os.environ, SLOW_REQUEST_SECONDS="0")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--threads", str(threads),
+         "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "app:create_app()"],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.monotonic() + BOOT_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/ping", timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def run_stage(base_url, pools, mix, concurrency, duration, seed):
+    """Closed-loop load: ``concurrency`` clients issuing requests for ``duration`` seconds."""
+    names = [name for name in mix if pools.get(name)]
+    weights = [mix[name] for name in names]
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    loop = asyncio.get_running_loop()
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        deadline = loop.time() + duration
+
+        async def client(index):
+            rng = random.Random(seed * 1000 + index)
+            while loop.time() < deadline:
+                name = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    async with session.get(base_url + rng.choice(pools[name])) as response:
+                        await response.read()
+                        status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status = "error"
+                latencies[name].append(time.perf_counter() - start)
+                statuses[name][status] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+def _stage_report(latencies, statuses, elapsed, concurrency, slo_p99_ms, slo_error_rate):
+    endpoints = {}
+    for name, samples in sorted(latencies.items()):
+        ms = np.array(samples) * 1000
+        errors = sum(count for status, count in statuses[name].items()
+                     if status == "error" or status >= 500)
+        error_rate = errors / len(samples)
+        p99 = float(np.percentile(ms, 99))
+        endpoints[name] = {
+            "requests": len(samples),
+            "requests_per_sec": round(len(samples) / elapsed, 1),
+            "p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(ms, 95)), 2),
+            "p99_ms": round(p99, 2),
+            "max_ms": round(float(ms.max()), 2),
+            "error_rate": round(error_rate, 5),
+            "statuses": {str(status): count for status, count in statuses[name].items()},
+            "slo_ok": p99 <= slo_p99_ms and error_rate <= slo_error_rate,
+        }
+    total = sum(e["requests"] for e in endpoints.values())
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "requests": total,
+        "requests_per_sec": round(total / elapsed, 1),
+        "slo_ok": bool(endpoints) and all(e["slo_ok"] for e in endpoints.values()),
+        "endpoints": endpoints,
+    }
+
+
+def _print_stage(workers, stage):
+    print(f"workers={workers} concurrency={stage['concurrency']}: "
+          f"{stage['requests_per_sec']} req/s, SLO {'ok' if stage['slo_ok'] else 'FAILED'}")
+    for name, e in stage["endpoints"].items():
+        print(f"  {name:10} {e['requests_per_sec']:>9} req/s  p50 {e['p50_ms']:>8} ms  "
+              f"p95 {e['p95_ms']:>8} ms  p99 {e['p99_ms']:>8} ms  errors {e['error_rate']:.3%}")
+
+
+def run(args):
+    from app import create_app
+
+    mix = parse_mix(args.mix)
+    dates = args.date.split(",")
+    pools = request_pools(create_app(), dates, args.seed)
+    report = {
+        "started_at": dt.datetime.now().isoformat(timespec="seconds"),
+        "mix": mix,
+        "slo": {"p99_ms": args.slo_p99_ms, "error_rate": args.slo_error_rate},
+        "duration": args.duration,
+        "runs": [],
+    }
+    worker_counts = [None] if args.url else [int(w) for w in args.workers.split(",")]
+    port = args.port or _free_port()
+    for workers in worker_counts:
+        process = None if args.url else start_server(workers, port, args.threads)
+        base_url = args.url or f"http://127.0.0.1:{port}"
+        try:
+            # Let every worker build its timetable before measuring.
+            if args.warmup:
+                asyncio.run(run_stage(base_url, pools, mix, max(workers or 1, 1) * 2,
+                                      args.warmup, args.seed))
+            stages = []
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                latencies, statuses, elapsed = asyncio.run(
+                    run_stage(base_url, pools, mix, concurrency, args.duration, args.seed))
+                stage = _stage_report(latencies, statuses, elapsed, concurrency,
+                                      args.slo_p99_ms, args.slo_error_rate)
+                _print_stage(workers, stage)
+                stages.append(stage)
+        finally:
+            if process is not None:
+                stop_server(process)
+        within_slo = [s for s in stages if s["slo_ok"]]
+        best = max(within_slo, key=lambda s: s["requests_per_sec"]) if within_slo else None
+        report["runs"].append({
+            "workers": workers,
+            "threads": args.threads,
+            "stages": stages,
+            "max_requests_per_sec_within_slo": best["requests_per_sec"] if best else 0,
+            "at_concurrency": best["concurrency"] if best else None,
+        })
+        print(f"workers={workers}: {report['runs'][-1]['max_requests_per_sec_within_slo']} "
+              f"req/s sustained within SLO")
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API con gunicorn")
+    parser.add_argument("--workers", default="1", help="cantidades de workers de gunicorn, p. ej. 1,4")
+    parser.add_argument("--threads", type=int, default=1, help="hilos por worker")
+    parser.add_argument("--concurrency", default="1,4,16,32",
+                        help="clientes concurrentes de cada etapa de la rampa")
+    parser.add_argument("--duration", type=float, default=15, help="segundos por etapa")
+    parser.add_argument("--warmup", type=float, default=5,
+                        help="segundos de calentamiento sin medir antes de la rampa")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="pesos por endpoint")
+    parser.add_argument("--date", default=dt.date.today().isoformat(),
+                        help="fechas YYYY-MM-DD para /api/horarios, separadas por comas")
+    parser.add_argument("--slo-p99-ms", type=float, default=250, help="latencia p99 máxima")
+    parser.add_argument("--slo-error-rate", type=float, default=0.001,
+                        help="proporción máxima de errores (5xx o de conexión)")
+    parser.add_argument("--url", help="servidor ya levantado (no inicia gunicorn)")
+    parser.add_argument("--port", type=int, help="puerto local (por defecto, uno libre)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="loadtest-report.json", help="archivo del reporte")
+    run(parser.parse_args())
@@ -0,0 +1,70 @@
+"""Version counters of the data served by the API.
+
+The ``gtfs`` scope covers all of it; writers also bump a scope per table
+they touch (``routes``, ``stops``, ``trips``, ``stop_times``,
+``service_days``). Each transaction that writes to those tables bumps them
+before committing, so a loader that commits in batches bumps once per batch
+and again after rebuilding derived tables. Readers compare
+versions to know whether something derived from the data (HTTP validators,
+cached responses, the in-memory timetable) is still current, depending only
+on the scopes they read. The counters are cached per process for
+``DATASET_VERSION_TTL`` seconds so that check rarely reaches the database.
+"""
+import time
+import datetime as dt
+
+from flask import current_app, has_app_context
+from sqlalchemy import select, text
+
+from models import db, DatasetVersion
+
+
+GTFS = "gtfs"
+TABLE_SCOPES = ("routes", "stops", "trips", "stop_times", "service_days")
+DEFAULT_TTL = 2.0
+
+
+def _cache(app):
+    return app.extensions.setdefault("dataset_versions", {})
+
+
+def bump_version(connection, *tables):
+    """Increment the ``gtfs`` version and those of ``tables``; return the first.
+
+    ``connection`` may be a Connection or a Session; the change becomes
+    visible when the caller commits.
+    """
+    now = dt.datetime.utcnow()
+    versions = [
+        connection.execute(
+            text(
+                "INSERT INTO dataset_versions (scope, version, updated_at) "
+                "VALUES (:scope, 1, :now) "
+                "ON CONFLICT (scope) DO UPDATE SET version = dataset_versions.version + 1, "
+                "updated_at = excluded.updated_at "
+                "RETURNING version"
+            ),
+            {"scope": scope, "now": now},
+        ).scalar()
+        for scope in (GTFS, *tables)
+    ]
+    if has_app_context():
+        _cache(current_app).clear()
+    return versions[0]
+
+
+def current_versions():
+    """Version of every scope as of at most ``DATASET_VERSION_TTL`` seconds ago."""
+    cache = _cache(current_app)
+    ttl = current_app.config.get("DATASET_VERSION_TTL", DEFAULT_TTL)
+    now = time.monotonic()
+    if cache and now - cache["fetched_at"] < ttl:
+        return cache["versions"]
+    versions = dict(db.session.execute(select(DatasetVersion.scope, DatasetVersion.version)).all())
+    cache.update(versions=versions, fetched_at=now)
+    return versions
+
+
+def current_version(scope=GTFS):
+    """Version of ``scope`` as of at most ``DATASET_VERSION_TTL`` seconds ago."""
+    return current_versions().get(scope, 0)
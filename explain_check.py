@@ -0,0 +1,115 @@
+import sys
+import json
+import argparse
+from typing import Dict, List, Optional, Set, Tuple
+
+from models import db, Trip, StopTime, ServiceDay
+from api.gtfs_routes import routes_query, stops_query, departures_query
+
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+# Left on, these let the planner read a table in full whenever the seeded
+# database is small, hiding a missing index.
+PLANNER_OFF = ("enable_seqscan", "enable_hashjoin", "enable_mergejoin")
+
+
+def _sample_parameters() -> Optional[Dict[str, object]]:
+    """Pick a route, one of its stops and a service date present in the database."""
+    row = (
+        db.session.query(Trip.route_id, StopTime.stop_id, ServiceDay.date)
+        .join(StopTime, StopTime.trip_id == Trip.id)
+        .join(ServiceDay, ServiceDay.service_id == Trip.service_id)
+        .first()
+    )
+    if row is None:
+        return None
+    return {"route_id": row.route_id, "stop_id": row.stop_id, "date": row.date}
+
+
+def blueprint_queries(params: Dict[str, object]) -> List[Tuple[str, object, Set[str]]]:
+    """Return (name, query, tables allowed to be read in full) per endpoint query."""
+    return [
+        # A full listing reads the whole table by design.
+        ("rutas", routes_query(), {"routes"}),
+        ("paradas", stops_query(params["route_id"]), set()),
+        ("horarios", departures_query(params["route_id"], params["stop_id"],
+                                      params["date"], 7 * 3600), set()),
+    ]
+
+
+def _full_scans(plan: dict) -> List[str]:
+    """Relations read in full anywhere in an EXPLAIN plan tree.
+
+    Besides ``Seq Scan`` this counts index scans without an index condition,
+    which is how PostgreSQL walks a whole table when sequential scans are off.
+    """
+    found = []
+    node = plan.get("Node Type")
+    if node == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    elif node in INDEX_SCANS and "Index Cond" not in plan:
+        found.append(plan.get("Relation Name") or plan.get("Index Name"))
+    for child in plan.get("Plans", []):
+        found.extend(_full_scans(child))
+    return found
+
+
+def explain(query) -> dict:
+    """Return the JSON plan chosen by PostgreSQL for a SQLAlchemy query."""
+    connection = db.session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect,
+                                      compile_kwargs={"render_postcompile": True})
+    result = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def check_plans(app, verbose: bool = False) -> List[str]:
+    """Revisa el plan de cada consulta del blueprint GTFS.
+
+    Los planes se obtienen sin recorridos secuenciales ni hash/merge joins:
+    así el resultado no depende del tamaño de las tablas de la base local y
+    un recorrido completo de una tabla solo aparece cuando ningún índice
+    sirve a la consulta.
+    Retorna la lista de regresiones encontradas (vacía si todo está bien).
+    """
+    failures: List[str] = []
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            raise RuntimeError("EXPLAIN checks require PostgreSQL")
+        params = _sample_parameters()
+        if params is None:
+            raise RuntimeError("No trips with service days found; load a GTFS feed first")
+
+        for setting in PLANNER_OFF:
+            db.session.execute(db.text(f"SET LOCAL {setting} = off"))
+        for name, query, allowed in blueprint_queries(params):
+            plan = explain(query)
+            scans = [table for table in _full_scans(plan) if table not in allowed]
+            status = "OK" if not scans else "FULL SCAN " + ", ".join(sorted(set(scans)))
+            print(f"{name}: {status} (cost {plan['Total Cost']})")
+            if verbose:
+                print(json.dumps(plan, indent=2))
+            if scans:
+                failures.append(f"{name}: full scan on {', '.join(sorted(set(scans)))}")
+        db.session.rollback()
+    return failures
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    parser = argparse.ArgumentParser(
+        description="Verifica que las consultas de la API GTFS usen índices"
+    )
+    parser.add_argument("--seed", metavar="DIR", help="carga antes un feed GTFS desde DIR")
+    parser.add_argument("--verbose", action="store_true", help="muestra el plan completo")
+    args = parser.parse_args()
+
+    app = create_app()
+    if args.seed:
+        from gtfs_loader import load_gtfs_data
+
+        load_gtfs_data(app, args.seed)
+    sys.exit(1 if check_plans(app, args.verbose) else 0)
@@ -0,0 +1,158 @@
+"""Prebuilt GTFS export kept on disk per dataset version.
+
+``build_export`` writes the zip of ``gtfs_export`` for the current ``gtfs``
+dataset version to ``EXPORT_DIR/gtfs-<version>.zip`` together with a small
+JSON file with its build time, size and checksum. It runs outside the web
+workers: the loaders call it after an import that changed data and
+``flask build-export`` covers admin edits from cron. Downloads are then a
+static file serve, or a streamed export while no artifact is current. A
+lock file lets only one process build at a time, and the previous artifact
+is kept so a download that started before a rebuild is not cut short.
+"""
+import os
+import json
+import time
+import fcntl
+import hashlib
+import datetime as dt
+
+from sqlalchemy import select
+
+from models import db, DatasetVersion
+from dataset_version import GTFS
+
+
+DEFAULT_DIR = os.path.join("data", "export")
+# Artifacts kept on disk, newest first.
+KEEP_ARTIFACTS = 2
+
+
+def artifact_path(directory, version):
+    return os.path.join(directory, f"gtfs-{version}.zip")
+
+
+def _metadata_path(directory, version):
+    return os.path.join(directory, f"gtfs-{version}.json")
+
+
+def _artifact_versions(directory):
+    """Versions with a complete artifact in ``directory``, newest first."""
+    versions = []
+    for name in os.listdir(directory) if os.path.isdir(directory) else ():
+        stem, ext = os.path.splitext(name)
+        if ext == ".json" and stem.startswith("gtfs-") and stem[5:].isdigit():
+            versions.append(int(stem[5:]))
+    return sorted(versions, reverse=True)
+
+
+def artifact_info(directory, version=None):
+    """Metadata of the artifact of ``version`` (newest if None), or None."""
+    if version is None:
+        versions = _artifact_versions(directory)
+        if not versions:
+            return None
+        version = versions[0]
+    try:
+        with open(_metadata_path(directory, version)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _dataset_version(connection):
+    return connection.execute(
+        select(DatasetVersion.version).where(DatasetVersion.scope == GTFS)
+    ).scalar() or 0
+
+
+def build_artifact(directory):
+    """Write the artifact of the current dataset version unless it exists.
+
+    Must run in an app context. Returns its metadata, or None if another
+    process holds the build lock.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        start = time.perf_counter()
+        with db.engine.connect() as connection:
+            connection = connection.execution_options(isolation_level="REPEATABLE READ")
+            # Read in the same snapshot as the export, so the version matches the data.
+            version = _dataset_version(connection)
+            info = artifact_info(directory, version)
+            if info is not None:
+                return info
+            # Imported here so workers that never build an artifact skip the
+            # export (and loader) modules at startup.
+            from gtfs_export import iter_gtfs_zip
+
+            path = artifact_path(directory, version)
+            digest = hashlib.sha256()
+            size = 0
+            with open(path + ".tmp", "wb") as out:
+                for chunk in iter_gtfs_zip(connection):
+                    out.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        os.replace(path + ".tmp", path)
+        info = {
+            "version": version,
+            "built_at": dt.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "build_seconds": round(time.perf_counter() - start, 2),
+            "size": size,
+            "sha256": digest.hexdigest(),
+        }
+        with open(_metadata_path(directory, version) + ".tmp", "w") as f:
+            json.dump(info, f)
+        os.replace(_metadata_path(directory, version) + ".tmp", _metadata_path(directory, version))
+        for old in _artifact_versions(directory)[KEEP_ARTIFACTS:]:
+            for old_path in (_metadata_path(directory, old), artifact_path(directory, old)):
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+        return info
+
+
+def build_export(app):
+    """Build the artifact of the current version if missing; return its metadata.
+
+    Returns None when another process is already building it.
+    """
+    with app.app_context():
+        info = build_artifact(app.config['EXPORT_DIR'])
+        if info is not None:
+            app.logger.info("GTFS export version %s ready (%s bytes, built in %.2fs)",
+                            info["version"], info["size"], info["build_seconds"])
+        return info
+
+
+def _building(directory):
+    """Whether some process holds the build lock of ``directory``."""
+    try:
+        with open(os.path.join(directory, ".lock")) as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        return False
+    except BlockingIOError:
+        return True
+    return False
+
+
+def init_export(app):
+    """Register the export settings on ``app``."""
+    app.config.setdefault('EXPORT_DIR', DEFAULT_DIR)
+    app.config.setdefault('EXPORT_ON_IMPORT', True)
+
+
+def export_status(app, version):
+    """Artifact state for ``version``: the newest one on disk and whether it is current."""
+    directory = app.config['EXPORT_DIR']
+    info = artifact_info(directory)
+    return {
+        "current_version": version,
+        "artifact": info,
+        "up_to_date": info is not None and info["version"] == version,
+        "building": _building(directory),
+    }
@@ -10,10 +10,27 @@ apiClient.interceptors.request.use((config) => {
   return config;
 });
 
+// List endpoints return one page per request; follow X-Next-Cursor until the
+// last page and resolve with the first response carrying every row.
+const fetchAllPages = async (url, params) => {
+  const first = await apiClient.get(url, { params });
+  const data = [...(first.data || [])];
+  let cursor = first.headers['x-next-cursor'];
+  while (cursor) {
+    const page = await apiClient.get(url, { params: { ...params, cursor } });
+    data.push(...(page.data || []));
+    cursor = page.headers['x-next-cursor'];
+  }
+  return { ...first, data };
+};
+
 export const fetchRoutes = (region) =>
-  apiClient.get('/api/rutas', { params: { region } });
+  fetchAllPages('/api/rutas', { region });
 
 export const fetchStops = (routeId) =>
-  apiClient.get('/api/paradas', { params: { ruta: routeId } });
+  fetchAllPages('/api/paradas', { ruta: routeId });
+
+export const fetchPlan = (params) =>
+  apiClient.get('/api/planificar', { params });
 
 export default apiClient;
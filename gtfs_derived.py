@@ -0,0 +1,149 @@
+"""Tables derived from the imported GTFS data.
+
+They are rebuilt by the loaders after every import so the read API can
+answer with simple indexed lookups instead of recomputing them per request.
+"""
+import datetime as dt
+from itertools import groupby
+
+from sqlalchemy import bindparam, select
+
+from models import (
+    Calendar, CalendarDate, ServiceDay, Trip, StopTime, RoutePattern, RoutePatternStop,
+)
+from gtfs_time import WEEKDAYS
+
+
+# Days after today covered by service_days.
+DEFAULT_HORIZON_DAYS = 365
+
+
+def expand_service_days(calendars, exceptions, end):
+    """Return the set of ``(date, service_id)`` pairs in service up to ``end``.
+
+    ``calendars`` yields ``(service_id, start_date, end_date, *weekday flags)``
+    rows and ``exceptions`` ``(service_id, date, exception_type)`` rows, as in
+    calendar.txt and calendar_dates.txt.
+    """
+    days = set()
+    for service_id, start_date, end_date, *flags in calendars:
+        day = start_date
+        last = min(end_date, end)
+        while day <= last:
+            if flags[day.weekday()]:
+                days.add((day, service_id))
+            day += dt.timedelta(days=1)
+    for service_id, date, exception_type in exceptions:
+        if date > end:
+            continue
+        if exception_type == 1:
+            days.add((date, service_id))
+        elif exception_type == 2:
+            days.discard((date, service_id))
+    return days
+
+
+def build_service_days(connection, horizon_days=DEFAULT_HORIZON_DAYS, today=None):
+    """Rebuild service_days from calendar and calendar_dates.
+
+    Covers every date of the feed up to ``horizon_days`` after ``today``;
+    run it periodically (``gtfs_loader.py --refresh-service-days``) to keep
+    the horizon moving forward. The table is left untouched when its rows
+    would not change. Returns ``(rows, changed)``.
+    """
+    end = (today or dt.date.today()) + dt.timedelta(days=horizon_days)
+    calendars = connection.execute(select(
+        Calendar.service_id, Calendar.start_date, Calendar.end_date,
+        *(getattr(Calendar, day) for day in WEEKDAYS),
+    )).all()
+    exceptions = connection.execute(select(
+        CalendarDate.service_id, CalendarDate.date, CalendarDate.exception_type,
+    )).all()
+    days = expand_service_days(calendars, exceptions, end)
+    stored = set(connection.execute(select(ServiceDay.date, ServiceDay.service_id)).tuples())
+    if stored == days:
+        return len(days), False
+
+    connection.execute(ServiceDay.__table__.delete())
+    if days:
+        connection.execute(
+            ServiceDay.__table__.insert(),
+            [{"date": date, "service_id": service_id} for date, service_id in sorted(days)],
+        )
+    return len(days), True
+
+
+def group_route_patterns(stop_times):
+    """Count the trips sharing each ``(route_id, direction_id, stops)`` pattern.
+
+    ``stop_times`` yields ``(trip_id, route_id, direction_id, stop_id)`` rows
+    ordered by trip and stop sequence; ``stops`` is the trip's ordered tuple
+    of stop ids.
+    """
+    patterns = {}
+    for (_, route_id, direction_id), rows in groupby(stop_times, key=lambda r: r[:3]):
+        key = (route_id, direction_id, tuple(row[3] for row in rows))
+        patterns[key] = patterns.get(key, 0) + 1
+    return patterns
+
+
+def build_route_patterns(connection):
+    """Bring route_patterns and route_pattern_stops up to date with trips and stop_times.
+
+    A pattern keeps its id while its route, direction and stops stay the
+    same, so the ``/api/paradas`` cursors that hold it remain valid; only its
+    trip count is updated. Patterns no longer used by any trip are deleted
+    and new ones are numbered after every existing id, by route and
+    decreasing trip count, so the most common pattern of a new route comes
+    first. Returns the number of patterns.
+    """
+    stop_times = connection.execute(
+        select(StopTime.trip_id, Trip.route_id, Trip.direction_id, StopTime.stop_id)
+        .join(Trip, Trip.id == StopTime.trip_id)
+        .order_by(StopTime.trip_id, StopTime.stop_sequence),
+        execution_options={"yield_per": 10000},
+    )
+    patterns = group_route_patterns(stop_times)
+
+    stored = connection.execute(
+        select(RoutePattern.id, RoutePattern.route_id, RoutePattern.direction_id,
+               RoutePattern.trip_count, RoutePatternStop.stop_id)
+        .join(RoutePatternStop, RoutePatternStop.pattern_id == RoutePattern.id)
+        .order_by(RoutePattern.id, RoutePatternStop.sequence),
+        execution_options={"yield_per": 10000},
+    )
+    existing = {}
+    for (pattern_id, route_id, direction_id, trip_count), rows in groupby(stored,
+                                                                          key=lambda r: r[:4]):
+        stops = tuple(row[4] for row in rows)
+        existing[(route_id, direction_id, stops)] = (pattern_id, trip_count)
+    next_id = max((pattern_id for pattern_id, _ in existing.values()), default=0) + 1
+
+    stale = [pattern_id for key, (pattern_id, _) in existing.items() if key not in patterns]
+    if stale:
+        connection.execute(RoutePatternStop.__table__.delete()
+                           .where(RoutePatternStop.pattern_id.in_(stale)))
+        connection.execute(RoutePattern.__table__.delete().where(RoutePattern.id.in_(stale)))
+    recounted = [{"pattern_id": existing[key][0], "new_count": trip_count}
+                 for key, trip_count in patterns.items()
+                 if key in existing and existing[key][1] != trip_count]
+    if recounted:
+        connection.execute(
+            RoutePattern.__table__.update()
+            .where(RoutePattern.id == bindparam("pattern_id"))
+            .values(trip_count=bindparam("new_count")),
+            recounted,
+        )
+
+    added = sorted(((key, count) for key, count in patterns.items() if key not in existing),
+                   key=lambda item: (item[0][0], -item[1], item[0][1] is None, item[0][1] or 0))
+    pattern_rows, stop_rows = [], []
+    for pattern_id, ((route_id, direction_id, stops), trip_count) in enumerate(added, next_id):
+        pattern_rows.append({"id": pattern_id, "route_id": route_id,
+                             "direction_id": direction_id, "trip_count": trip_count})
+        stop_rows.extend({"pattern_id": pattern_id, "sequence": sequence, "stop_id": stop_id}
+                         for sequence, stop_id in enumerate(stops, 1))
+    if pattern_rows:
+        connection.execute(RoutePattern.__table__.insert(), pattern_rows)
+        connection.execute(RoutePatternStop.__table__.insert(), stop_rows)
+    return len(patterns)
@@ -0,0 +1,107 @@
+"""Streaming export of the loaded feed as a GTFS zip.
+
+Each table is read with a server-side cursor in batches of ``EXPORT_BATCH``
+rows and written as CSV straight into a zip stream, whose compressed bytes
+are yielded as they are produced. Memory use is bounded by the batch size,
+not by the size of the feed, and nothing is written to disk.
+"""
+import io
+import csv
+import zipfile
+import datetime as dt
+
+from sqlalchemy import text
+
+from gtfs_time import WEEKDAYS
+
+
+# Rows fetched per round trip and written to the zip between yields.
+EXPORT_BATCH = 10000
+
+# GTFS file -> (header, query returning the columns in header order). Every
+# query is ordered by the table's key so exports of the same data are equal.
+EXPORT_TABLES = [
+    ("agency.txt",
+     ["agency_id", "agency_name", "agency_url", "agency_timezone", "agency_lang", "agency_phone"],
+     "SELECT agency_id, agency_name, agency_url, agency_timezone, agency_lang, agency_phone "
+     "FROM agency ORDER BY agency_id"),
+    ("stops.txt",
+     ["stop_id", "stop_name", "stop_lat", "stop_lon"],
+     "SELECT id, name, lat, lon FROM stops ORDER BY id"),
+    ("routes.txt",
+     ["route_id", "route_short_name", "route_long_name", "route_type"],
+     "SELECT id, short_name, long_name, type FROM routes ORDER BY id"),
+    ("trips.txt",
+     ["route_id", "service_id", "trip_id", "trip_headsign", "direction_id"],
+     "SELECT route_id, service_id, id, headsign, direction_id FROM trips ORDER BY id"),
+    ("stop_times.txt",
+     ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"],
+     "SELECT trip_id, arrival_time, departure_time, stop_id, stop_sequence "
+     "FROM stop_times ORDER BY trip_id, stop_sequence"),
+    ("calendar.txt",
+     ["service_id"] + WEEKDAYS + ["start_date", "end_date"],
+     f"SELECT service_id, {', '.join(WEEKDAYS)}, start_date, end_date "
+     "FROM calendar ORDER BY service_id"),
+    ("calendar_dates.txt",
+     ["service_id", "date", "exception_type"],
+     "SELECT service_id, date, exception_type FROM calendar_dates ORDER BY service_id, date"),
+]
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, dt.date):
+        return value.strftime("%Y%m%d")
+    return value
+
+
+class _ZipStream:
+    """Write-only, unseekable sink; zipfile then writes data descriptors."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_batches(connection, query, batch_size=EXPORT_BATCH):
+    """CSV-ready rows of ``query`` in lists of ``batch_size``, from a server-side cursor."""
+    result = connection.execute(text(query), execution_options={"yield_per": batch_size})
+    for rows in result.partitions():
+        yield [[_csv_value(value) for value in row] for row in rows]
+
+
+def iter_gtfs_zip(connection, batch_size=EXPORT_BATCH):
+    """Yield the bytes of a zip with every GTFS file of the database.
+
+    ``connection`` should be in a REPEATABLE READ transaction so all the
+    files come from the same snapshot.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as zf:
+        for file_name, header, query in EXPORT_TABLES:
+            # force_zip64 because the size of stop_times is not known upfront.
+            with zf.open(file_name, "w", force_zip64=True) as entry, \
+                    io.TextIOWrapper(entry, encoding="utf-8", newline="") as out:
+                writer = csv.writer(out)
+                writer.writerow(header)
+                for rows in iter_batches(connection, query, batch_size):
+                    writer.writerows(rows)
+                    out.flush()
+                    chunk = stream.drain()
+                    if chunk:
+                        yield chunk
+    yield stream.drain()
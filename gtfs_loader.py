@@ -1,207 +1,778 @@
+import io
 import os
 import csv
-import pandas as pd
+import time
+import zlib
+import hashlib
+import argparse
+import tempfile
 import datetime as dt
-from models import (
-    db,
-    Route,
-    Stop,
-    Trip,
-    StopTime,
-    Agency,
-    Calendar,
-    CalendarDate,
-)
-
-
-def row_to_route(row):
-    return Route(
-        id=row["route_id"],
-        region_id=1,
-        short_name=row.get("route_short_name"),
-        long_name=row.get("route_long_name"),
-        type=row.get("route_type"),
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from models import db
+from gtfs_time import WEEKDAYS, to_seconds
+from gtfs_derived import DEFAULT_HORIZON_DAYS, build_route_patterns, build_service_days
+from dataset_version import TABLE_SCOPES, bump_version
+from export_artifact import build_export
+from metrics import REGISTRY, write_textfile
+
+
+# Rows read, staged and merged per round-trip. Peak memory of the loader is
+# bounded by this value, not by the size of the feed or the existing tables.
+DEFAULT_BATCH_SIZE = 50000
+
+LOADER_ROWS = REGISTRY.gauge(
+    "gtfs_loader_rows", "Rows of the last GTFS import by table and kind "
+    "(read, inserted, updated, deleted).", ("table", "kind"))
+LOADER_SECONDS = REGISTRY.gauge(
+    "gtfs_loader_seconds", "Duration of the last GTFS import by table.", ("table",))
+
+
+def _blank(value):
+    if value is None:
+        return None
+    value = value.strip()
+    return value or None
+
+
+def _int(value):
+    value = _blank(value)
+    return int(float(value)) if value is not None else None
+
+
+def _date(value):
+    return dt.datetime.strptime(value.strip(), "%Y%m%d").date()
+
+
+def agency_values(row):
+    return (
+        _blank(row.get("agency_id")) or row["agency_name"],
+        row["agency_name"],
+        row["agency_url"],
+        row["agency_timezone"],
+        _blank(row.get("agency_lang")),
+        _blank(row.get("agency_phone")),
     )
 
 
-def row_to_stop(row):
-    return Stop(
-        id=row["stop_id"],
-        name=row["stop_name"],
-        lat=row["stop_lat"],
-        lon=row["stop_lon"],
+def calendar_values(row):
+    return (
+        (row["service_id"],)
+        + tuple(bool(int(row[day])) for day in WEEKDAYS)
+        + (_date(row["start_date"]), _date(row["end_date"]))
     )
 
 
-def row_to_trip(row):
-    return Trip(
-        id=row["trip_id"],
-        route_id=row["route_id"],
-        service_id=row.get("service_id"),
-        headsign=row.get("trip_headsign"),
-        direction_id=row.get("direction_id"),
+def calendar_date_values(row):
+    return (
+        row["service_id"],
+        _date(row["date"]),
+        int(row["exception_type"]),
     )
 
 
-def row_to_stop_time(row):
-    return StopTime(
-        trip_id=row["trip_id"],
-        arrival_time=row.get("arrival_time"),
-        departure_time=row.get("departure_time"),
-        stop_id=row["stop_id"],
-        stop_sequence=row["stop_sequence"],
+def stop_values(row):
+    return (
+        row["stop_id"],
+        row["stop_name"],
+        float(row["stop_lat"]),
+        float(row["stop_lon"]),
     )
 
 
-def load_agency(session, path_agency_txt):
-    objs = []
-    if os.path.exists(path_agency_txt):
-        with open(path_agency_txt, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                objs.append(
-                    Agency(
-                        agency_id=row.get("agency_id"),
-                        agency_name=row["agency_name"],
-                        agency_url=row["agency_url"],
-                        agency_timezone=row["agency_timezone"],
-                        agency_lang=row.get("agency_lang"),
-                        agency_phone=row.get("agency_phone"),
-                    )
-                )
-    if objs:
-        session.bulk_save_objects(objs)
+def route_values(row):
+    return (
+        int(row["route_id"]),
+        1,
+        _blank(row.get("route_short_name")),
+        _blank(row.get("route_long_name")),
+        _int(row.get("route_type")),
+    )
 
 
-def load_calendar(session, path_calendar_txt):
-    objs = []
-    if os.path.exists(path_calendar_txt):
-        with open(path_calendar_txt, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                objs.append(
-                    Calendar(
-                        service_id=row["service_id"],
-                        monday=bool(int(row["monday"])),
-                        tuesday=bool(int(row["tuesday"])),
-                        wednesday=bool(int(row["wednesday"])),
-                        thursday=bool(int(row["thursday"])),
-                        friday=bool(int(row["friday"])),
-                        saturday=bool(int(row["saturday"])),
-                        sunday=bool(int(row["sunday"])),
-                        start_date=dt.datetime.strptime(row["start_date"], "%Y%m%d").date(),
-                        end_date=dt.datetime.strptime(row["end_date"], "%Y%m%d").date(),
-                    )
-                )
-    if objs:
-        session.bulk_save_objects(objs)
+def trip_values(row):
+    return (
+        row["trip_id"],
+        int(row["route_id"]),
+        _blank(row.get("service_id")),
+        _blank(row.get("trip_headsign")),
+        _int(row.get("direction_id")),
+    )
+
+
+def stop_time_values(row):
+    arrival = _blank(row.get("arrival_time"))
+    departure = _blank(row.get("departure_time"))
+    return (
+        row["trip_id"],
+        arrival,
+        departure,
+        row["stop_id"],
+        int(row["stop_sequence"]),
+        to_seconds(arrival),
+        to_seconds(departure),
+    )
+
+
+# GTFS file -> destination table. ``key`` lists the columns that identify a
+# row; every key is backed by a primary key or unique constraint so duplicates
+# are discarded by the database with ON CONFLICT. ``depends`` lists the tables
+# that must be loaded first because of foreign keys. ``derived`` maps extra
+# destination columns to SQL expressions over the staged row ``s``.
+GTFS_TABLES = {
+    "agency": {
+        "file": "agency.txt",
+        "table": "agency",
+        "columns": [
+            "agency_id", "agency_name", "agency_url",
+            "agency_timezone", "agency_lang", "agency_phone",
+        ],
+        "convert": agency_values,
+        "key": ["agency_id"],
+        "depends": [],
+    },
+    "calendar": {
+        "file": "calendar.txt",
+        "table": "calendar",
+        "columns": ["service_id"] + WEEKDAYS + ["start_date", "end_date"],
+        "convert": calendar_values,
+        "key": ["service_id"],
+        "depends": [],
+    },
+    "calendar_dates": {
+        "file": "calendar_dates.txt",
+        "table": "calendar_dates",
+        "columns": ["service_id", "date", "exception_type"],
+        "convert": calendar_date_values,
+        "key": ["service_id", "date"],
+        "depends": ["calendar"],
+    },
+    "stops": {
+        "file": "stops.txt",
+        "table": "stops",
+        "columns": ["id", "name", "lat", "lon"],
+        "convert": stop_values,
+        "key": ["id"],
+        "depends": [],
+    },
+    "routes": {
+        "file": "routes.txt",
+        "table": "routes",
+        "columns": ["id", "region_id", "short_name", "long_name", "type"],
+        "convert": route_values,
+        "key": ["id"],
+        "serial": "id",
+        "depends": ["agency"],
+    },
+    "trips": {
+        "file": "trips.txt",
+        "table": "trips",
+        "columns": ["id", "route_id", "service_id", "headsign", "direction_id"],
+        "convert": trip_values,
+        "key": ["id"],
+        "depends": ["routes"],
+    },
+    "stop_times": {
+        "file": "stop_times.txt",
+        "table": "stop_times",
+        "columns": [
+            "trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence",
+            "arrival_secs", "departure_secs",
+        ],
+        "convert": stop_time_values,
+        "key": ["trip_id", "stop_sequence"],
+        # Denormalized so departures can be range-scanned per stop and service.
+        "derived": {
+            "service_id": "(SELECT t.service_id FROM trips t WHERE t.id = s.trip_id)",
+        },
+        "depends": ["trips", "stops"],
+    },
+}
+
+# Topological order of GTFS_TABLES, used when loading on a single connection.
+LOAD_ORDER = [
+    "agency", "calendar", "calendar_dates", "stops", "routes", "trips", "stop_times",
+]
+
+
+def _copy_rows(connection, staging, columns, rows):
+    """Stream rows into ``staging`` with PostgreSQL ``COPY FROM STDIN``."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    # csv.writer renders None as an unquoted empty field, which COPY reads as NULL.
+    writer.writerows(rows)
+    buf.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {staging} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buf,
+        )
+    finally:
+        cursor.close()
+
+
+def _executemany_rows(connection, staging, columns, rows):
+    """Fallback for backends without COPY: one executemany per batch."""
+    stmt = text(
+        f"INSERT INTO {staging} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(':' + c for c in columns)})"
+    )
+    connection.execute(stmt, [dict(zip(columns, values)) for values in rows])
+
+
+def stage_rows(connection, staging, columns, rows):
+    if connection.dialect.name == "postgresql":
+        _copy_rows(connection, staging, columns, rows)
+    else:
+        _executemany_rows(connection, staging, columns, rows)
+
+
+def _clear_staging(connection, staging):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(f"TRUNCATE {staging}"))
+    else:
+        connection.execute(text(f"DELETE FROM {staging}"))
+
+
+def _insert_columns(spec):
+    """Destination columns and matching SELECT expressions over staging ``s``."""
+    derived = spec.get("derived", {})
+    target = spec["columns"] + list(derived)
+    source = [f"s.{c}" for c in spec["columns"]] + list(derived.values())
+    return target, source
+
+
+def _merge_staging(connection, spec, staging):
+    """Move staged rows into the destination table skipping existing keys."""
+    target, source = _insert_columns(spec)
+    return connection.execute(text(
+        f"INSERT INTO {spec['table']} ({', '.join(target)}) "
+        f"SELECT {', '.join(source)} FROM {staging} s "
+        f"WHERE true ON CONFLICT DO NOTHING"
+    )).rowcount
+
+
+def _sync_sequence(connection, spec):
+    """Advance the id sequence past ids taken from the feed (PostgreSQL)."""
+    column = spec.get("serial")
+    if column and connection.dialect.name == "postgresql":
+        table = spec["table"]
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+            f"GREATEST((SELECT MAX({column}) FROM {table}), 1))"
+        ))
+
+
+def iter_rows(file_path, convert):
+    """Yield converted rows from a GTFS file without loading it in memory."""
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            yield convert(row)
+
+
+def iter_batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_table(connection, name, data_dir, batch_size=DEFAULT_BATCH_SIZE, file_path=None):
+    """Bulk load one GTFS file through a staging table.
+
+    The file is streamed in batches of ``batch_size`` rows; each batch is
+    staged, merged and discarded before the next one is read. ``file_path``
+    overrides the file inside ``data_dir`` (used for stop_times shards).
+    Returns ``None`` when the file is absent, otherwise the number of rows
+    read and inserted together with the elapsed time and throughput.
+    """
+    spec = GTFS_TABLES[name]
+    file_path = file_path or os.path.join(data_dir, spec["file"])
+    if not os.path.exists(file_path):
+        return None
+
+    start = time.perf_counter()
+    staging = f"_stage_{spec['table']}"
+    columns = spec["columns"]
+    connection.execute(text(
+        f"CREATE TEMP TABLE {staging} AS "
+        f"SELECT {', '.join(columns)} FROM {spec['table']} WHERE 1 = 0"
+    ))
+    read = inserted = 0
+    for batch in iter_batches(iter_rows(file_path, spec["convert"]), batch_size):
+        stage_rows(connection, staging, columns, batch)
+        inserted += _merge_staging(connection, spec, staging)
+        _clear_staging(connection, staging)
+        read += len(batch)
+    connection.execute(text(f"DROP TABLE {staging}"))
+    _sync_sequence(connection, spec)
+
+    return _throughput(read, inserted, time.perf_counter() - start)
+
 
+def _throughput(read, inserted, elapsed):
+    return {
+        "read": read,
+        "inserted": inserted,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(read / elapsed, 1) if elapsed else 0.0,
+    }
 
-def load_calendar_dates(session, path_calendar_dates_txt):
-    objs = []
-    if os.path.exists(path_calendar_dates_txt):
-        with open(path_calendar_dates_txt, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
+
+def split_stop_times(data_dir, shards, out_dir):
+    """Split stop_times.txt into ``shards`` files keyed by ``trip_id``.
+
+    Every stop time of a trip lands in the same shard, so shards never
+    compete for the same rows of the (trip_id, stop_sequence) unique key.
+    """
+    file_path = os.path.join(data_dir, GTFS_TABLES["stop_times"]["file"])
+    paths = [os.path.join(out_dir, f"stop_times.{i}.txt") for i in range(shards)]
+    files = [open(path, "w", newline="", encoding="utf-8") for path in paths]
+    try:
+        with open(file_path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            trip_col = header.index("trip_id")
+            writers = [csv.writer(out) for out in files]
+            for writer in writers:
+                writer.writerow(header)
             for row in reader:
-                objs.append(
-                    CalendarDate(
-                        service_id=row["service_id"],
-                        date=dt.datetime.strptime(row["date"], "%Y%m%d").date(),
-                        exception_type=int(row["exception_type"]),
-                    )
+                shard = zlib.crc32(row[trip_col].encode("utf-8")) % shards
+                writers[shard].writerow(row)
+    finally:
+        for out in files:
+            out.close()
+    return paths
+
+
+def _load_job(database_uri, name, data_dir, batch_size, file_path):
+    """Process pool entry point: load one job on its own connection."""
+    engine = create_engine(database_uri, poolclass=NullPool)
+    try:
+        with engine.begin() as connection:
+            return load_table(connection, name, data_dir, batch_size, file_path)
+    finally:
+        engine.dispose()
+
+
+def load_parallel(database_uri, data_dir, batch_size=DEFAULT_BATCH_SIZE, workers=2):
+    """Load the GTFS tables concurrently following their dependencies.
+
+    Independent tables run at the same time on a process pool, each worker
+    with its own database connection, and stop_times is split into trip-keyed
+    shards loaded in parallel once trips and stops are in place.
+    """
+    with tempfile.TemporaryDirectory(prefix="gtfs_shards_") as shard_dir:
+        jobs = []
+        for name in LOAD_ORDER:
+            if not os.path.exists(os.path.join(data_dir, GTFS_TABLES[name]["file"])):
+                continue
+            if name == "stop_times" and workers > 1:
+                for path in split_stop_times(data_dir, workers, shard_dir):
+                    jobs.append((name, path))
+            else:
+                jobs.append((name, None))
+
+        remaining = Counter(name for name, _ in jobs)
+        started = {}
+        totals = {}
+        running = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while jobs or running:
+                for job in list(jobs):
+                    name = job[0]
+                    if all(remaining[dep] == 0 for dep in GTFS_TABLES[name]["depends"]):
+                        jobs.remove(job)
+                        started.setdefault(name, time.perf_counter())
+                        future = pool.submit(
+                            _load_job, database_uri, name, data_dir, batch_size, job[1]
+                        )
+                        running[future] = name
+                if not running:
+                    raise RuntimeError(f"Unsatisfiable GTFS dependencies: {jobs}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result = future.result()
+                    remaining[name] -= 1
+                    read, inserted = totals.get(name, (0, 0))
+                    totals[name] = (read + result["read"], inserted + result["inserted"])
+                    if remaining[name] == 0:
+                        totals[name] = _throughput(
+                            *totals[name], time.perf_counter() - started[name]
+                        )
+    return {name: totals[name] for name in LOAD_ORDER if name in totals}
+
+
+# --- Delta import -----------------------------------------------------------
+#
+# Every file is fingerprinted with its SHA-256 and every row with a hash of
+# its values keyed by the GTFS primary key. Unchanged files are skipped
+# without being parsed; for changed files only rows whose hash differs are
+# upserted and rows that disappeared from the feed are deleted. Rows that
+# were never imported through a delta run (admin edits, JSON imports) carry
+# no fingerprint and are left untouched.
+
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fingerprinted(rows, spec):
+    key_index = [spec["columns"].index(c) for c in spec["key"]]
+    for values in rows:
+        key = "|".join(str(values[i]) for i in key_index)
+        row_hash = hashlib.blake2b(
+            "\x1f".join("" if v is None else str(v) for v in values).encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+        yield values + (key, row_hash)
+
+
+def _stage_delta(connection, spec, file_path, batch_size):
+    staging = f"_delta_{spec['table']}"
+    columns = spec["columns"]
+    connection.execute(text(
+        f"CREATE TEMP TABLE {staging} AS "
+        f"SELECT {', '.join(columns)} FROM {spec['table']} WHERE 1 = 0"
+    ))
+    connection.execute(text(f"ALTER TABLE {staging} ADD COLUMN _row_key VARCHAR(255)"))
+    connection.execute(text(f"ALTER TABLE {staging} ADD COLUMN _row_hash VARCHAR(32)"))
+    read = 0
+    rows = _fingerprinted(iter_rows(file_path, spec["convert"]), spec)
+    for batch in iter_batches(rows, batch_size):
+        stage_rows(connection, staging, columns + ["_row_key", "_row_hash"], batch)
+        read += len(batch)
+    connection.execute(text(f"CREATE INDEX ix{staging}_key ON {staging} (_row_key)"))
+    return staging, read
+
+
+def _upsert_changed(connection, spec, staging):
+    """Insert or update staged rows whose fingerprint changed."""
+    table = spec["table"]
+    changed = (
+        f"FROM {staging} s WHERE NOT EXISTS ("
+        f"SELECT 1 FROM gtfs_row_fingerprints f WHERE f.table_name = :table "
+        f"AND f.row_key = s._row_key AND f.row_hash = s._row_hash)"
+    )
+    match = " AND ".join(f"t.{c} = s.{c}" for c in spec["key"])
+    # Counted per key: duplicated keys are upserted once (see DISTINCT ON below).
+    updated = connection.execute(
+        text(f"SELECT COUNT(DISTINCT s._row_key) {changed} "
+             f"AND EXISTS (SELECT 1 FROM {table} t WHERE {match})"),
+        {"table": table},
+    ).scalar()
+
+    target, source = _insert_columns(spec)
+    # PostgreSQL refuses to upsert the same key twice in one statement.
+    distinct = "DISTINCT ON (s._row_key) " if connection.dialect.name == "postgresql" else ""
+    assignments = ", ".join(f"{c} = excluded.{c}" for c in target if c not in spec["key"])
+    affected = connection.execute(
+        text(
+            f"INSERT INTO {table} ({', '.join(target)}) "
+            f"SELECT {distinct}{', '.join(source)} {changed} "
+            f"ON CONFLICT ({', '.join(spec['key'])}) DO UPDATE SET {assignments}"
+        ),
+        {"table": table},
+    ).rowcount
+    return affected - updated, updated
+
+
+def _stage_gone(connection, spec, staging):
+    """Temp table with the typed keys of fingerprinted rows absent from ``staging``.
+
+    Keys are split back from the fingerprint and staged like feed rows, so the
+    database parses them into the key columns' types and deletions can join
+    on the table's own key index.
+    """
+    table = spec["table"]
+    gone = f"_gone_{table}"
+    key = spec["key"]
+    connection.execute(text(
+        f"CREATE TEMP TABLE {gone} AS SELECT {', '.join(key)} FROM {staging} WHERE 1 = 0"
+    ))
+    connection.execute(text(f"ALTER TABLE {gone} ADD COLUMN _row_key VARCHAR(255)"))
+    result = connection.execute(text(
+        f"SELECT f.row_key FROM gtfs_row_fingerprints f WHERE f.table_name = :table "
+        f"AND NOT EXISTS (SELECT 1 FROM {staging} s WHERE s._row_key = f.row_key)"
+    ), {"table": table})
+    keys = (tuple(row_key.split("|", len(key) - 1)) + (row_key,) for row_key, in result)
+    missing = 0
+    for batch in iter_batches(keys, DEFAULT_BATCH_SIZE):
+        stage_rows(connection, gone, key + ["_row_key"], batch)
+        missing += len(batch)
+    return gone, missing
+
+
+def _check_unreferenced(connection, spec, gone):
+    """Fail with a readable error if rows to delete are still referenced.
+
+    Children imported from the feed were already deleted (deletions run in
+    reverse LOAD_ORDER), so remaining references usually come from rows the
+    feed does not own, such as admin edits or JSON imports. Raising here
+    instead of letting the foreign key fail names the rows to fix.
+    """
+    table = spec["table"]
+    match = " AND ".join(f"t.{c} = g.{c}" for c in spec["key"])
+    for child in db.metadata.sorted_tables:
+        for fk in child.foreign_keys:
+            if fk.column.table.name != table or fk.ondelete:
+                continue
+            column = fk.parent.name
+            keys = connection.execute(text(
+                f"SELECT DISTINCT c.{column} FROM {child.name} c "
+                f"JOIN {table} t ON t.{fk.column.name} = c.{column} "
+                f"JOIN {gone} g ON {match} LIMIT 5"
+            )).scalars().all()
+            if keys:
+                raise RuntimeError(
+                    f"Cannot delete {table} missing from the feed: still referenced by "
+                    f"{child.name}.{column} ({', '.join(map(str, keys))})"
                 )
-    if objs:
-        session.bulk_save_objects(objs)
 
 
-def load_gtfs(session, folder_path):
-    load_agency(session, f"{folder_path}/agency.txt")
-    load_calendar(session, f"{folder_path}/calendar.txt")
-    load_calendar_dates(session, f"{folder_path}/calendar_dates.txt")
-    session.commit()
+def _delete_missing(connection, spec, staging):
+    """Delete fingerprinted rows absent from the new feed and refresh hashes."""
+    table = spec["table"]
+    params = {"table": table}
+    gone, missing = _stage_gone(connection, spec, staging)
+    deleted = 0
+    if missing:
+        _check_unreferenced(connection, spec, gone)
+        match = " AND ".join(f"t.{c} = g.{c}" for c in spec["key"])
+        if connection.dialect.name == "postgresql":
+            delete = f"DELETE FROM {table} t USING {gone} g WHERE {match}"
+        else:
+            delete = f"DELETE FROM {table} AS t WHERE EXISTS (SELECT 1 FROM {gone} g WHERE {match})"
+        deleted = connection.execute(text(delete)).rowcount
+        connection.execute(text(
+            f"DELETE FROM gtfs_row_fingerprints WHERE table_name = :table "
+            f"AND row_key IN (SELECT _row_key FROM {gone})"
+        ), params)
+
+    distinct = "DISTINCT ON (s._row_key) " if connection.dialect.name == "postgresql" else ""
+    connection.execute(text(
+        f"INSERT INTO gtfs_row_fingerprints (table_name, row_key, row_hash) "
+        f"SELECT {distinct}:table, s._row_key, s._row_hash FROM {staging} s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM gtfs_row_fingerprints f "
+        f"WHERE f.table_name = :table AND f.row_key = s._row_key AND f.row_hash = s._row_hash) "
+        f"ON CONFLICT (table_name, row_key) DO UPDATE SET row_hash = excluded.row_hash"
+    ), params)
+    connection.execute(text(f"DROP TABLE {gone}"))
+    connection.execute(text(f"DROP TABLE {staging}"))
+    return deleted
+
+
+def _sync_stop_time_services(connection):
+    """Propagate trip service changes to the denormalized stop_times column."""
+    connection.execute(text(
+        "UPDATE stop_times SET service_id = trips.service_id FROM trips "
+        "WHERE trips.id = stop_times.trip_id "
+        "AND stop_times.service_id IS DISTINCT FROM trips.service_id"
+    ))
+
 
+def load_delta(connection, data_dir, batch_size=DEFAULT_BATCH_SIZE):
+    """Apply only the changes between the feed in ``data_dir`` and the last import.
 
-def load_gtfs_data(app, data_dir="data/gtfs"):
-    """Carga archivos GTFS desde el directorio especificado a la base de datos."""
+    Runs in the caller's transaction: upserts follow LOAD_ORDER and deletions
+    the reverse order so foreign keys hold at every step. Returns per-table
+    rows read, inserted, updated and deleted; unchanged files report
+    ``skipped``.
+    """
+    stats = {}
+    staged = []
+    for name in LOAD_ORDER:
+        spec = GTFS_TABLES[name]
+        file_path = os.path.join(data_dir, spec["file"])
+        if not os.path.exists(file_path):
+            continue
+        start = time.perf_counter()
+        digest = file_digest(file_path)
+        previous = connection.execute(
+            text("SELECT sha256 FROM gtfs_file_fingerprints WHERE file_name = :file"),
+            {"file": spec["file"]},
+        ).scalar()
+        if previous == digest:
+            stats[name] = dict(_throughput(0, 0, time.perf_counter() - start),
+                               updated=0, deleted=0, skipped=True)
+            continue
+        staging, read = _stage_delta(connection, spec, file_path, batch_size)
+        inserted, updated = _upsert_changed(connection, spec, staging)
+        _sync_sequence(connection, spec)
+        stats[name] = {"read": read, "inserted": inserted, "updated": updated,
+                       "seconds": time.perf_counter() - start, "skipped": False}
+        staged.append((name, staging, digest))
+        if name == "trips" and updated:
+            _sync_stop_time_services(connection)
+
+    for name, staging, digest in reversed(staged):
+        spec = GTFS_TABLES[name]
+        start = time.perf_counter()
+        stats[name]["deleted"] = _delete_missing(connection, spec, staging)
+        connection.execute(
+            text(
+                "INSERT INTO gtfs_file_fingerprints (file_name, sha256, rows, imported_at) "
+                "VALUES (:file, :sha256, :rows, :now) "
+                "ON CONFLICT (file_name) DO UPDATE SET sha256 = excluded.sha256, "
+                "rows = excluded.rows, imported_at = excluded.imported_at"
+            ),
+            {"file": spec["file"], "sha256": digest, "rows": stats[name]["read"],
+             "now": dt.datetime.utcnow()},
+        )
+        entry = stats[name]
+        entry.update(_throughput(entry["read"], entry["inserted"],
+                                 entry["seconds"] + time.perf_counter() - start))
+    return stats
+
+
+def refresh_derived(app, horizon_days=DEFAULT_HORIZON_DAYS, changed=None):
+    """Rebuild the tables derived from the GTFS data (see gtfs_derived).
+
+    ``changed`` lists the tables an import modified; None (the periodic
+    refresh) rebuilds everything. service_days is rebuilt when the calendars
+    changed and route patterns when trips or stop_times did. Only the
+    dataset versions of what actually changed are bumped, so an import that
+    changed nothing leaves every ETag, cached response and export valid.
+    After a bump the GTFS export of the new version is built (see
+    export_artifact) unless ``EXPORT_ON_IMPORT`` is off.
+    """
+    if changed is not None and not changed:
+        print("No changes; derived tables left as they are")
+        return {"service_days": None, "route_patterns": None}
+    changed = None if changed is None else set(changed)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            service_days = days_changed = route_patterns = None
+            if changed is None or changed & {"calendar", "calendar_dates"}:
+                service_days, days_changed = build_service_days(connection, horizon_days)
+            if changed is None or changed & {"trips", "stop_times"}:
+                route_patterns = build_route_patterns(connection)
+            scopes = [table for table in changed or () if table in TABLE_SCOPES]
+            if days_changed:
+                scopes.append("service_days")
+            bumped = bool(changed or scopes)
+            if bumped:
+                bump_version(connection, *scopes)
+    built = [f"{count} {name.replace('_', ' ')}" for name, count in
+             (("service_days", service_days), ("route_patterns", route_patterns))
+             if count is not None]
+    print(f"Built {' and '.join(built)}" if built else "Derived tables unchanged")
+    if bumped and app.config['EXPORT_ON_IMPORT']:
+        build_export(app)
+    return {"service_days": service_days, "route_patterns": route_patterns}
+
+
+def load_gtfs_data(app, data_dir="data/gtfs", batch_size=DEFAULT_BATCH_SIZE, workers=1,
+                   delta=False, horizon_days=DEFAULT_HORIZON_DAYS):
+    """Carga archivos GTFS desde el directorio especificado a la base de datos.
+
+    Cada archivo se lee en lotes de ``batch_size`` filas que se copian a una
+    tabla temporal (``COPY FROM STDIN`` en PostgreSQL, ``executemany`` en
+    otros motores) y se fusionan con la tabla destino; los duplicados los
+    descarta la base de datos mediante sus restricciones únicas. Con
+    ``workers`` mayor que 1 las tablas independientes y los fragmentos de
+    stop_times se cargan en paralelo, cada proceso con su propia conexión (por
+    defecto la carga es secuencial).
+    Con ``delta`` solo se aplican los cambios respecto a la última
+    importación incremental (ver ``load_delta``). Al terminar se regeneran las
+    tablas derivadas (días de servicio y patrones de paradas por ruta).
+    Retorna, por tabla, las filas leídas e insertadas, la duración y las
+    filas por segundo.
+    """
+    workers = workers or 1
     with app.app_context():
         if not os.path.isdir(data_dir):
             raise FileNotFoundError(f"GTFS directory '{data_dir}' not found")
 
-        counts = {}
-
-        # Stops
-        file_path = os.path.join(data_dir, "stops.txt")
-        if os.path.exists(file_path):
-            df = pd.read_csv(file_path)
-            existing = {s.id for s in Stop.query.with_entities(Stop.id).all()}
-            count = 0
-            for _, row in df.iterrows():
-                if row["stop_id"] in existing:
-                    continue
-                db.session.add(row_to_stop(row))
-                existing.add(row["stop_id"])
-                count += 1
-            db.session.commit()
-            counts["stops"] = count
-
-        # Routes
-        file_path = os.path.join(data_dir, "routes.txt")
-        if os.path.exists(file_path):
-            df = pd.read_csv(file_path)
-            existing = {r.id for r in Route.query.with_entities(Route.id).all()}
-            count = 0
-            for _, row in df.iterrows():
-                if row["route_id"] in existing:
-                    continue
-                db.session.add(row_to_route(row))
-                existing.add(row["route_id"])
-                count += 1
-            db.session.commit()
-            counts["routes"] = count
-
-        # Trips
-        file_path = os.path.join(data_dir, "trips.txt")
-        if os.path.exists(file_path):
-            df = pd.read_csv(file_path)
-            existing = {t.id for t in Trip.query.with_entities(Trip.id).all()}
-            count = 0
-            for _, row in df.iterrows():
-                if row["trip_id"] in existing:
-                    continue
-                db.session.add(row_to_trip(row))
-                existing.add(row["trip_id"])
-                count += 1
-            db.session.commit()
-            counts["trips"] = count
-
-        # Stop Times
-        file_path = os.path.join(data_dir, "stop_times.txt")
-        if os.path.exists(file_path):
-            df = pd.read_csv(file_path)
-            existing = {
-                (st.trip_id, st.stop_id, st.stop_sequence)
-                for st in db.session.query(
-                    StopTime.trip_id, StopTime.stop_id, StopTime.stop_sequence
-                ).all()
-            }
-            count = 0
-            for _, row in df.iterrows():
-                key = (row["trip_id"], row["stop_id"], row["stop_sequence"])
-                if key in existing:
-                    continue
-                db.session.add(row_to_stop_time(row))
-                existing.add(key)
-                count += 1
-            db.session.commit()
-            counts["stop_times"] = count
-
-        for k, v in counts.items():
-            print(f"Imported {v} {k}")
-        return counts
+        if delta:
+            with db.engine.begin() as connection:
+                stats = load_delta(connection, data_dir, batch_size)
+        elif workers > 1:
+            stats = load_parallel(
+                app.config["SQLALCHEMY_DATABASE_URI"], data_dir, batch_size, workers
+            )
+        else:
+            stats = {}
+            for name in LOAD_ORDER:
+                with db.engine.begin() as connection:
+                    result = load_table(connection, name, data_dir, batch_size)
+                if result is not None:
+                    stats[name] = result
+
+        for k, v in stats.items():
+            for kind in ("read", "inserted", "updated", "deleted"):
+                if kind in v:
+                    LOADER_ROWS.set(v[kind], table=k, kind=kind)
+            LOADER_SECONDS.set(v["seconds"], table=k)
+            if v.get("skipped"):
+                print(f"Unchanged {k}, skipped")
+                continue
+            changes = f"Imported {v['inserted']} {k}"
+            if delta:
+                changes += f", updated {v['updated']}, deleted {v['deleted']}"
+            print(f"{changes} ({v['read']} read in {v['seconds']}s, {v['rows_per_sec']} rows/s)")
+
+        changed = [name for name, v in stats.items()
+                   if v.get("inserted") or v.get("updated") or v.get("deleted")]
+        refresh_derived(app, horizon_days, changed)
+        return stats
 
 
 if __name__ == "__main__":
     from app import create_app
 
+    parser = argparse.ArgumentParser(description="Importa un feed GTFS a la base de datos")
+    parser.add_argument("--data-dir", default="data/gtfs")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="filas leídas y enviadas a la base de datos por lote",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="procesos de carga en paralelo, con una conexión cada uno (por defecto, 1 = secuencial)",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="importación incremental: solo aplica filas nuevas, modificadas o eliminadas",
+    )
+    parser.add_argument(
+        "--horizon-days",
+        type=int,
+        default=DEFAULT_HORIZON_DAYS,
+        help="días a futuro cubiertos por la tabla de días de servicio",
+    )
+    parser.add_argument(
+        "--refresh-service-days",
+        action="store_true",
+        help="solo regenera las tablas derivadas (para ejecutar a diario)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="escribe las métricas de la carga en formato Prometheus en este archivo",
+    )
+    args = parser.parse_args()
+
     app = create_app()
-    load_gtfs_data(app)
+    if args.refresh_service_days:
+        refresh_derived(app, args.horizon_days)
+    else:
+        load_gtfs_data(app, args.data_dir, args.batch_size, args.workers, args.delta,
+                       args.horizon_days)
+    if args.metrics_file:
+        write_textfile(args.metrics_file)
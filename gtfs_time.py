@@ -0,0 +1,43 @@
+"""GTFS time helpers.
+
+GTFS times are ``H:MM:SS`` counted from noon minus 12h of the service day
+and may exceed 24:00:00 for trips running past midnight, so they are stored
+and compared as integer seconds rather than strings.
+"""
+import re
+
+# Day columns of calendar.txt, in ``date.weekday()`` order.
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+_TIME_RE = re.compile(r"^\s*(\d{1,2})[:h](\d{2})(?::(\d{2}))?\s*(am|pm)?\s*$", re.I)
+_HOUR_RE = re.compile(r"^\s*(\d{1,2})\s*(am|pm)\s*$", re.I)
+
+
+def to_seconds(value):
+    """Convert ``"25:10:00"``, ``"7:15"`` or ``"5:30 am"`` to seconds since midnight.
+
+    Returns ``None`` for empty or unparseable values, minutes or seconds of
+    60 or more, and 12-hour times whose hour is not between 1 and 12.
+    """
+    if not value:
+        return None
+    match = _TIME_RE.match(value)
+    if match:
+        hours, minutes, seconds, meridiem = match.groups()
+    else:
+        match = _HOUR_RE.match(value)
+        if not match:
+            return None
+        (hours, meridiem), minutes, seconds = match.groups(), 0, 0
+    hours, minutes, seconds = int(hours), int(minutes), int(seconds or 0)
+    if minutes >= 60 or seconds >= 60:
+        return None
+    if meridiem:
+        if not 1 <= hours <= 12:
+            return None
+        hours = hours % 12 + (12 if meridiem.lower() == "pm" else 0)
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_seconds(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
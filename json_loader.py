@@ -1,91 +1,217 @@
 import os
 import json
+import time
+import argparse
 from uuid import uuid4
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
 from models import db, Region, Route, Stop, Trip, StopTime
+from gtfs_time import to_seconds
+from gtfs_derived import build_route_patterns
+from dataset_version import bump_version
+from export_artifact import build_export
+from metrics import REGISTRY, write_textfile
+
+
+# JSON files resolved and written per transaction.
+DEFAULT_BATCH_SIZE = 200
+
+LOADER_ROWS = REGISTRY.gauge(
+    "json_loader_rows", "Rows inserted by the last JSON import by file and table.",
+    ("file", "table"))
+LOADER_SECONDS = REGISTRY.gauge(
+    "json_loader_seconds", "Processing time of each file in the last JSON import.", ("file",))
+
+
+def _name_index(*columns) -> Dict[str, int]:
+    """Map a name column to the lowest id carrying it, in one query."""
+    index: Dict[str, int] = {}
+    for row_id, name in db.session.query(*columns).order_by(columns[0]):
+        index.setdefault(name, row_id)
+    return index
+
+
+def _load_batch(data_dir: str, fnames: List[str], regions: Dict[str, int],
+                routes: Dict[str, int], stops: Dict[str, str]) -> Dict[str, Dict[str, float]]:
+    """Resolve a batch of files against the caches and insert it in one transaction."""
+    files: List[Tuple[str, dict, Dict[str, float]]] = []
+    elapsed: Dict[str, float] = {}
+
+    # Regions: parse every file first so missing regions are created together.
+    new_regions: Dict[str, Region] = {}
+    for fname in fnames:
+        start = time.perf_counter()
+        with open(os.path.join(data_dir, fname), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        counts = {"regions": 0, "routes": 0, "stops": 0, "trips": 0, "stop_times": 0}
+        region_name = data.get("region")
+        if region_name and region_name not in regions and region_name not in new_regions:
+            new_regions[region_name] = Region(name=region_name)
+            counts["regions"] += 1
+        files.append((fname, data, counts))
+        elapsed[fname] = time.perf_counter() - start
+    if new_regions:
+        db.session.add_all(new_regions.values())
+        db.session.flush()
+        regions.update({name: region.id for name, region in new_regions.items()})
+
+    # Routes: one flush for every route missing in the batch.
+    new_routes: Dict[str, Route] = {}
+    for fname, data, counts in files:
+        start = time.perf_counter()
+        route_name = data.get("ruta") or ""
+        if route_name not in routes and route_name not in new_routes:
+            new_routes[route_name] = Route(region_id=regions.get(data.get("region")),
+                                           short_name=route_name,
+                                           long_name=route_name)
+            counts["routes"] += 1
+        elapsed[fname] += time.perf_counter() - start
+    if new_routes:
+        db.session.add_all(new_routes.values())
+        db.session.flush()
+        routes.update({name: route.id for name, route in new_routes.items()})
+
+    # Stops, trips and stop times are resolved in memory and bulk inserted.
+    route_ids = {routes[data.get("ruta") or ""] for _, data, _ in files}
+    existing_trips = {
+        trip_id for (trip_id,) in
+        db.session.query(Trip.id).filter(Trip.route_id.in_(route_ids))
+    }
+    stop_rows: List[dict] = []
+    trip_rows: List[dict] = []
+    stop_time_rows: List[dict] = []
+    for fname, data, counts in files:
+        start = time.perf_counter()
+        route_id = routes[data.get("ruta") or ""]
+
+        stop_ids = []
+        for stop_name in data.get("paradas", []):
+            stop_id = stops.get(stop_name)
+            if stop_id is None:
+                stop_id = uuid4().hex
+                stops[stop_name] = stop_id
+                stop_rows.append({"id": stop_id, "name": stop_name, "lat": 0.0, "lon": 0.0})
+                counts["stops"] += 1
+            stop_ids.append(stop_id)
+
+        for idx, salida in enumerate(data.get("salidas", []), 1):
+            trip_id = f"{route_id}_t{idx}"
+            if trip_id in existing_trips:
+                continue
+            existing_trips.add(trip_id)
+            trip_rows.append({"id": trip_id, "route_id": route_id, "service_id": None,
+                              "headsign": None, "direction_id": None})
+            counts["trips"] += 1
+
+            time_val = salida.get("hora")
+            secs = to_seconds(time_val)
+            for seq, stop_id in enumerate(stop_ids, 1):
+                stop_time_rows.append({"trip_id": trip_id,
+                                       "arrival_time": time_val,
+                                       "departure_time": time_val,
+                                       "stop_id": stop_id,
+                                       "stop_sequence": seq,
+                                       "arrival_secs": secs,
+                                       "departure_secs": secs,
+                                       "service_id": None})
+                counts["stop_times"] += 1
+        elapsed[fname] += time.perf_counter() - start
+
+    touched = ["routes"] if new_routes else []
+    for table, rows in ((Stop.__table__, stop_rows),
+                        (Trip.__table__, trip_rows),
+                        (StopTime.__table__, stop_time_rows)):
+        if rows:
+            db.session.execute(table.insert(), rows)
+            touched.append(table.name)
+    # Bumped before the commit so no reader sees these rows under the old version.
+    if touched:
+        bump_version(db.session, *touched)
+    db.session.commit()
+
+    summary: Dict[str, Dict[str, float]] = {}
+    for fname, _, counts in files:
+        counts["seconds"] = round(elapsed[fname], 4)
+        summary[fname] = counts
+    return summary
+
+
+def read_manifest(path: str) -> List[str]:
+    """Return the JSON files listed as changed by the scraper's manifest."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("changed", [])
 
 
-def json_to_db(app, data_dir: str = "data/json_routes") -> Dict[str, Dict[str, int]]:
+def clear_manifest(path: str, imported: List[str]) -> None:
+    """Remove ``imported`` from the manifest, keeping entries added meanwhile."""
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    done = set(imported)
+    manifest["changed"] = [f for f in manifest.get("changed", []) if f not in done]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def json_to_db(app, data_dir: str = "data/json_routes",
+               batch_size: int = DEFAULT_BATCH_SIZE,
+               files: Optional[List[str]] = None,
+               manifest: Optional[str] = None) -> Dict[str, Dict[str, float]]:
     """Carga archivos JSON con rutas hacia la base de datos.
 
-    Por cada archivo se insertan regiones, rutas, paradas, viajes y horarios
-    evitando duplicados. Retorna un diccionario con el conteo de registros
-    insertados por archivo.
+    Regiones, rutas y paradas existentes se leen una sola vez en memoria; los
+    archivos se resuelven contra esos diccionarios y se insertan en bloque,
+    en una transacción por cada lote de ``batch_size`` archivos. Retorna por
+    archivo el conteo de registros insertados y el tiempo de procesamiento
+    en segundos. ``files`` limita la carga a esos archivos (por ejemplo, los
+    listados en el manifiesto del scraper). Con ``manifest`` se cargan los
+    archivos de ese manifiesto y se quitan de él los que quedaron
+    importados. Al terminar se regeneran los patrones de paradas por ruta y
+    se construye la exportación GTFS de la nueva versión.
     """
-    summary: Dict[str, Dict[str, int]] = {}
+    summary: Dict[str, Dict[str, float]] = {}
     with app.app_context():
         if not os.path.isdir(data_dir):
             raise FileNotFoundError(f"JSON directory '{data_dir}' not found")
 
-        for fname in os.listdir(data_dir):
-            if not fname.endswith(".json"):
-                continue
-            path = os.path.join(data_dir, fname)
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            counts = {"regions": 0, "routes": 0, "stops": 0, "trips": 0, "stop_times": 0}
-
-            # Region
-            region_name = data.get("region")
-            region = None
-            if region_name:
-                region = Region.query.filter_by(name=region_name).first()
-                if region is None:
-                    region = Region(name=region_name)
-                    db.session.add(region)
-                    db.session.commit()
-                    counts["regions"] += 1
-
-            # Route
-            route_name = data.get("ruta") or ""
-            route = Route.query.filter_by(long_name=route_name).first()
-            if route is None:
-                route = Route(region_id=region.id if region else None,
-                              short_name=route_name,
-                              long_name=route_name)
-                db.session.add(route)
-                db.session.commit()
-                counts["routes"] += 1
-
-            # Stops
-            stop_ids = []
-            for stop_name in data.get("paradas", []):
-                stop = Stop.query.filter_by(name=stop_name).first()
-                if stop is None:
-                    stop = Stop(id=uuid4().hex, name=stop_name, lat=0.0, lon=0.0)
-                    db.session.add(stop)
-                    db.session.commit()
-                    counts["stops"] += 1
-                stop_ids.append(stop.id)
-
-            # Trips and StopTimes
-            for idx, salida in enumerate(data.get("salidas", []), 1):
-                trip_id = f"{route.id}_t{idx}"
-                if Trip.query.filter_by(id=trip_id).first():
-                    continue
-                trip = Trip(id=trip_id, route_id=route.id)
-                db.session.add(trip)
-                db.session.commit()
-                counts["trips"] += 1
-
-                for seq, stop_id in enumerate(stop_ids, 1):
-                    if StopTime.query.filter_by(trip_id=trip_id, stop_id=stop_id, stop_sequence=seq).first():
-                        continue
-                    time_val = salida.get("hora")
-                    st = StopTime(trip_id=trip_id,
-                                  arrival_time=time_val,
-                                  departure_time=time_val,
-                                  stop_id=stop_id,
-                                  stop_sequence=seq)
-                    db.session.add(st)
-                    counts["stop_times"] += 1
-                db.session.commit()
-
-            summary[fname] = counts
+        if files is None and manifest:
+            files = read_manifest(manifest)
+        fnames = sorted(f for f in (files if files is not None else os.listdir(data_dir))
+                        if f.endswith(".json") and os.path.exists(os.path.join(data_dir, f)))
+        regions = _name_index(Region.id, Region.name)
+        routes = _name_index(Route.id, Route.long_name)
+        stops = _name_index(Stop.id, Stop.name)
+
+        try:
+            for start in range(0, len(fnames), batch_size):
+                try:
+                    summary.update(_load_batch(data_dir, fnames[start:start + batch_size],
+                                               regions, routes, stops))
+                except Exception:
+                    db.session.rollback()
+                    raise
+        finally:
+            # Also after a failed batch, for those already committed. They bumped
+            # their tables; bump again with the new patterns so responses cached
+            # in between are not reused.
+            touched = [table for table in ("routes", "stops", "trips", "stop_times")
+                       if any(counts[table] for counts in summary.values())]
+            if touched:
+                with db.engine.begin() as connection:
+                    build_route_patterns(connection)
+                    bump_version(connection, *touched)
+                if app.config['EXPORT_ON_IMPORT']:
+                    build_export(app)
+            if manifest:
+                # Files deleted since the scrape are dropped too: there is nothing to import.
+                clear_manifest(manifest, list(summary) + [f for f in files if f not in fnames])
 
         for file, counts in summary.items():
+            for table, rows in counts.items():
+                if table != "seconds":
+                    LOADER_ROWS.set(rows, file=file, table=table)
+            LOADER_SECONDS.set(counts["seconds"], file=file)
             print(f"{file}: {counts}")
     return summary
 
@@ -93,5 +219,22 @@ def json_to_db(app, data_dir: str = "data/json_routes") -> Dict[str, Dict[str, i
 if __name__ == "__main__":
     from app import create_app
 
+    parser = argparse.ArgumentParser(description="Importa rutas en JSON a la base de datos")
+    parser.add_argument("--data-dir", default="data/json_routes")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        "--manifest",
+        nargs="?",
+        const="data/json_routes_manifest.json",
+        help="importa solo los archivos que el scraper marcó como modificados",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="escribe las métricas de la carga en formato Prometheus en este archivo",
+    )
+    args = parser.parse_args()
+
     app = create_app()
-    json_to_db(app)
+    json_to_db(app, args.data_dir, args.batch_size, manifest=args.manifest)
+    if args.metrics_file:
+        write_textfile(args.metrics_file)
@@ -1,4 +1,10 @@
 #!/bin/bash
+# Usage: ./load_gtfs.sh [--data-dir DIR] [--batch-size N] [--workers N] [--delta]
+#                       [--horizon-days N] [--refresh-service-days] [--metrics-file PATH]
+#
+# Arguments are passed to gtfs_loader.py (see `python gtfs_loader.py --help`).
+# The database comes from DB_USER, DB_PASSWORD, DB_HOST, DB_PORT and DB_NAME,
+# read from the environment or from .env.
 export FLASK_APP=app.py
 flask db upgrade
-python gtfs_loader.py
+python gtfs_loader.py "$@"
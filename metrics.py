@@ -0,0 +1,310 @@
+"""Request, SQL and loader metrics in the Prometheus text format.
+
+``init_metrics`` registers hooks on the app that record, per endpoint (the
+URL rule, not the raw path), request counts by status, latency histograms
+and the number and duration of the SQL statements each request ran, timed
+with SQLAlchemy engine events. ``/metrics`` renders them; requests slower
+than ``SLOW_REQUEST_SECONDS`` are logged with their slowest statements.
+
+Metrics live in the process that records them. Under gunicorn with several
+workers set ``METRICS_DIR``: every worker then writes a snapshot there (at
+most once per ``METRICS_FLUSH_SECONDS``) and ``/metrics`` adds up the
+snapshots of all of them. The loaders record into the same registry and can
+write it to a file for the node exporter's textfile collector.
+
+``QUERY_BUDGET`` caps the SQL statements a request may run (``query_budget``
+overrides it per view). Exceeding it raises ``QueryBudgetExceeded`` when the
+app is in testing mode, so N+1 regressions fail the tests, and is logged as
+an error otherwise.
+"""
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+DEFAULT_SLOW_REQUEST_SECONDS = 1.0
+DEFAULT_FLUSH_SECONDS = 1.0
+# SQL statements per request; every view needs far fewer unless it loads N+1.
+DEFAULT_QUERY_BUDGET = 10
+# Statements kept per request for the slow-request log.
+SLOWEST_STATEMENTS = 3
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more SQL statements than its budget (testing mode only)."""
+
+
+def query_budget(statements):
+    """Allow the view ``statements`` SQL statements per request instead of QUERY_BUDGET."""
+    def decorator(view):
+        view.query_budget = statements
+        return view
+    return decorator
+
+
+class Metric:
+    """A counter, gauge or histogram family with a fixed set of label names."""
+
+    def __init__(self, kind, name, help, labels=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if buckets else None
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (plus +Inf), sum and count.
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[bisect_left(self.buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), value if self.kind != "histogram" else list(value)]
+                      for key, value in self._values.items()]
+        return {"kind": self.kind, "help": self.help, "labels": list(self.labels),
+                "buckets": list(self.buckets) if self.buckets else None, "values": values}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, kind, name, help, labels=(), buckets=None):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(kind, name, help, labels, buckets)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register("counter", name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._register("gauge", name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register("histogram", name, help, labels, buckets)
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "Requests handled, by endpoint and status.",
+    ("method", "endpoint", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to produce the response, by endpoint.",
+    ("method", "endpoint"))
+REQUEST_SQL_STATEMENTS = REGISTRY.histogram(
+    "http_request_sql_statements", "SQL statements run per request, by endpoint.",
+    ("endpoint",), COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = REGISTRY.histogram(
+    "http_request_sql_seconds", "Time spent in SQL per request, by endpoint.", ("endpoint",))
+SQL_LATENCY = REGISTRY.histogram(
+    "sql_statement_duration_seconds", "Duration of every SQL statement run by the process.")
+RESPONSE_CACHE = REGISTRY.gauge(
+    "response_cache", "Response cache counters and size (see api.cache).", ("stat",))
+
+
+def merge_snapshots(snapshots):
+    """Add up registry snapshots of several processes."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, dict(family, values={}))
+            for key, value in family["values"]:
+                key = tuple(key)
+                if key not in target["values"]:
+                    target["values"][key] = value
+                elif family["kind"] == "histogram":
+                    target["values"][key] = [a + b for a, b in zip(target["values"][key], value)]
+                else:
+                    target["values"][key] = target["values"][key] + value
+    for family in merged.values():
+        family["values"] = [[list(key), value] for key, value in family["values"].items()]
+    return merged
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(snapshot):
+    """Prometheus text exposition of a registry snapshot; empty families are left out."""
+    lines = []
+    for name, family in sorted(snapshot.items()):
+        if not family["values"]:
+            continue
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        names = family["labels"]
+        for key, value in sorted(family["values"]):
+            if family["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(family["buckets"] + ["+Inf"], value[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(names, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, key)} {value[-2]}")
+            lines.append(f"{name}_count{_labels(names, key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, registry=REGISTRY):
+    """Write ``registry`` atomically to ``path`` (for a textfile collector)."""
+    with open(path + ".tmp", "w") as f:
+        f.write(render(registry.snapshot()))
+    os.replace(path + ".tmp", path)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    SQL_LATENCY.observe(elapsed)
+    if has_request_context() and "metrics_sql" in g:
+        sql = g.metrics_sql
+        sql["count"] += 1
+        sql["seconds"] += elapsed
+        sql["slowest"] = sorted(sql["slowest"] + [(elapsed, statement)],
+                                reverse=True)[:SLOWEST_STATEMENTS]
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def _flush(app, state, force=False):
+    """Write this process' snapshot to METRICS_DIR, at most once per flush interval."""
+    directory = app.config.get("METRICS_DIR")
+    now = time.monotonic()
+    if not directory or (not force and now - state["flushed_at"] < app.config["METRICS_FLUSH_SECONDS"]):
+        return
+    state["flushed_at"] = now
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def _collect(app, state):
+    cache = app.extensions.get("response_cache")
+    if cache is not None:
+        for stat, value in cache.info().items():
+            RESPONSE_CACHE.set(value, stat=stat)
+    directory = app.config.get("METRICS_DIR")
+    if not directory:
+        return REGISTRY.snapshot()
+    _flush(app, state, force=True)
+    snapshots = []
+    for name in os.listdir(directory):
+        if name.startswith("metrics-") and name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return merge_snapshots(snapshots)
+
+
+def _check_budget(app, statements):
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, "query_budget", None) or app.config["QUERY_BUDGET"]
+    if not budget or statements <= budget:
+        return
+    message = (f"{request.method} {request.full_path} ran {statements} SQL statements, "
+               f"over its budget of {budget}")
+    if app.testing:
+        raise QueryBudgetExceeded(message)
+    app.logger.error(message)
+
+
+def init_metrics(app):
+    """Record request and SQL metrics for ``app`` and serve them on ``/metrics``."""
+    app.config.setdefault("METRICS", True)
+    app.config.setdefault("METRICS_DIR", None)
+    app.config.setdefault("METRICS_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS)
+    app.config.setdefault("SLOW_REQUEST_SECONDS", DEFAULT_SLOW_REQUEST_SECONDS)
+    app.config.setdefault("QUERY_BUDGET", DEFAULT_QUERY_BUDGET)
+    if not app.config["METRICS"]:
+        return
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    state = {"flushed_at": 0.0}
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql = {"count": 0, "seconds": 0.0, "slowest": []}
+
+    @app.after_request
+    def record_request_metrics(response):
+        if "metrics_start" not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = _endpoint()
+        sql = g.metrics_sql
+        HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        HTTP_LATENCY.observe(elapsed, method=request.method, endpoint=endpoint)
+        REQUEST_SQL_STATEMENTS.observe(sql["count"], endpoint=endpoint)
+        REQUEST_SQL_SECONDS.observe(sql["seconds"], endpoint=endpoint)
+        threshold = app.config["SLOW_REQUEST_SECONDS"]
+        if threshold and elapsed >= threshold:
+            app.logger.warning(
+                "Slow request %s %s: %.3fs, %d SQL statements in %.3fs; slowest: %s",
+                request.method, request.full_path, elapsed, sql["count"], sql["seconds"],
+                "; ".join(f"{seconds:.3f}s {' '.join(statement.split())[:200]}"
+                          for seconds, statement in sql["slowest"]) or "-")
+        _check_budget(app, sql["count"])
+        _flush(app, state)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        body = render(_collect(current_app, state))
+        return current_app.response_class(body, mimetype=None, content_type=CONTENT_TYPE)
@@ -25,6 +25,9 @@ from models import (
     Stop,
     Trip,
     StopTime,
+    Agency,
+    Calendar,
+    CalendarDate,
 )
 
 Base = db.Model
@@ -0,0 +1,51 @@
+"""Route patterns
+
+Revision ID: 584e6356bd60
+Revises: a1c87eeec4aa
+Create Date: 2025-08-07 15:22:48.903114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '584e6356bd60'
+down_revision: Union[str, Sequence[str], None] = 'a1c87eeec4aa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.create_all() at app startup may already have created these on
+    # databases that were running before this revision.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('route_patterns'):
+        op.create_table('route_patterns',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('route_id', sa.Integer(), nullable=False),
+        sa.Column('direction_id', sa.Integer(), nullable=True),
+        sa.Column('trip_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['route_id'], ['routes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_route_patterns_route_id', 'route_patterns', ['route_id'])
+    if not inspector.has_table('route_pattern_stops'):
+        op.create_table('route_pattern_stops',
+        sa.Column('pattern_id', sa.Integer(), nullable=False),
+        sa.Column('sequence', sa.Integer(), nullable=False),
+        sa.Column('stop_id', sa.String(length=32), nullable=False),
+        sa.ForeignKeyConstraint(['pattern_id'], ['route_patterns.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['stop_id'], ['stops.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('pattern_id', 'sequence')
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('route_pattern_stops')
+    op.drop_index('ix_route_patterns_route_id', table_name='route_patterns')
+    op.drop_table('route_patterns')
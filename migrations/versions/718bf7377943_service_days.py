@@ -0,0 +1,35 @@
+"""Service days
+
+Revision ID: 718bf7377943
+Revises: bfd4d4157c01
+Create Date: 2025-07-23 11:05:19.634120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '718bf7377943'
+down_revision: Union[str, Sequence[str], None] = 'bfd4d4157c01'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.create_all() at app startup may already have created this on
+    # databases that were running before this revision.
+    if not sa.inspect(op.get_bind()).has_table('service_days'):
+        op.create_table('service_days',
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('service_id', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('date', 'service_id')
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('service_days')
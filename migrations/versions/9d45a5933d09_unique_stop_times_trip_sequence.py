@@ -0,0 +1,41 @@
+"""Unique stop_times (trip_id, stop_sequence)
+
+Revision ID: 9d45a5933d09
+Revises: 4f4ef0daa980
+Create Date: 2025-07-02 10:14:03.512877
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d45a5933d09'
+down_revision: Union[str, Sequence[str], None] = '4f4ef0daa980'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Keep the first row of every (trip_id, stop_sequence) pair before
+    # enforcing the GTFS primary key.
+    op.execute(
+        """
+        DELETE FROM stop_times a
+        USING stop_times b
+        WHERE a.trip_id = b.trip_id
+          AND a.stop_sequence = b.stop_sequence
+          AND a.id > b.id
+        """
+    )
+    op.create_unique_constraint(
+        'uq_stop_times_trip_sequence', 'stop_times', ['trip_id', 'stop_sequence']
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_stop_times_trip_sequence', 'stop_times', type_='unique')
@@ -0,0 +1,78 @@
+"""stop_times integer seconds
+
+Revision ID: a18316690315
+Revises: 718bf7377943
+Create Date: 2025-07-30 16:48:02.271943
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from gtfs_time import to_seconds
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a18316690315'
+down_revision: Union[str, Sequence[str], None] = '718bf7377943'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _seconds_sql(column: str) -> str:
+    return (
+        f"CASE WHEN {column} ~ '^[0-9]{{1,2}}:[0-9]{{2}}(:[0-9]{{2}})?$' THEN "
+        f"split_part({column}, ':', 1)::int * 3600 "
+        f"+ split_part({column}, ':', 2)::int * 60 "
+        f"+ COALESCE(NULLIF(split_part({column}, ':', 3), '')::int, 0) END"
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('stop_times', sa.Column('arrival_secs', sa.Integer(), nullable=True))
+    op.add_column('stop_times', sa.Column('departure_secs', sa.Integer(), nullable=True))
+    op.add_column('stop_times', sa.Column('service_id', sa.String(length=32), nullable=True))
+
+    op.execute(
+        f"""
+        UPDATE stop_times SET
+            arrival_secs = {_seconds_sql('arrival_time')},
+            departure_secs = {_seconds_sql('departure_time')},
+            service_id = trips.service_id
+        FROM trips
+        WHERE trips.id = stop_times.trip_id
+        """
+    )
+    # Times scraped as "5:30 am" are not GTFS formatted; convert them in Python.
+    bind = op.get_bind()
+    leftovers = bind.execute(sa.text(
+        "SELECT DISTINCT arrival_time, departure_time FROM stop_times "
+        "WHERE (arrival_secs IS NULL AND arrival_time IS NOT NULL) "
+        "OR (departure_secs IS NULL AND departure_time IS NOT NULL)"
+    )).all()
+    for arrival, departure in leftovers:
+        bind.execute(
+            sa.text(
+                "UPDATE stop_times SET arrival_secs = :arrival_secs, departure_secs = :departure_secs "
+                "WHERE arrival_time IS NOT DISTINCT FROM :arrival "
+                "AND departure_time IS NOT DISTINCT FROM :departure"
+            ),
+            {"arrival": arrival, "departure": departure,
+             "arrival_secs": to_seconds(arrival), "departure_secs": to_seconds(departure)},
+        )
+
+    op.create_index(
+        'ix_stop_times_stop_service_departure',
+        'stop_times',
+        ['stop_id', 'service_id', 'departure_secs'],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_stop_times_stop_service_departure', table_name='stop_times')
+    op.drop_column('stop_times', 'service_id')
+    op.drop_column('stop_times', 'departure_secs')
+    op.drop_column('stop_times', 'arrival_secs')
@@ -0,0 +1,37 @@
+"""GTFS query indexes
+
+Revision ID: a1c87eeec4aa
+Revises: a18316690315
+Create Date: 2025-08-04 09:37:41.208315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c87eeec4aa'
+down_revision: Union[str, Sequence[str], None] = 'a18316690315'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # stop_times(trip_id, stop_sequence) is served by uq_stop_times_trip_sequence
+    # and stop_times(stop_id) by ix_stop_times_stop_service_departure.
+    # Both are declared on the models, so db.create_all() creates them along
+    # with the tables on databases initialized by the app.
+    inspector = sa.inspect(op.get_bind())
+    if 'ix_trips_route_service' not in {i['name'] for i in inspector.get_indexes('trips')}:
+        op.create_index('ix_trips_route_service', 'trips', ['route_id', 'service_id'])
+    if 'ix_routes_region_id' not in {i['name'] for i in inspector.get_indexes('routes')}:
+        op.create_index('ix_routes_region_id', 'routes', ['region_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_routes_region_id', table_name='routes')
+    op.drop_index('ix_trips_route_service', table_name='trips')
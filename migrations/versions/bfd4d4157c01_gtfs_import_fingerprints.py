@@ -0,0 +1,46 @@
+"""GTFS import fingerprints
+
+Revision ID: bfd4d4157c01
+Revises: c89da9540aba
+Create Date: 2025-07-16 09:27:40.880215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bfd4d4157c01'
+down_revision: Union[str, Sequence[str], None] = 'c89da9540aba'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.create_all() at app startup may already have created these on
+    # databases that were running before this revision.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('gtfs_file_fingerprints'):
+        op.create_table('gtfs_file_fingerprints',
+        sa.Column('file_name', sa.String(length=64), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('rows', sa.Integer(), nullable=False),
+        sa.Column('imported_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('file_name')
+        )
+    if not inspector.has_table('gtfs_row_fingerprints'):
+        op.create_table('gtfs_row_fingerprints',
+        sa.Column('table_name', sa.String(length=32), nullable=False),
+        sa.Column('row_key', sa.String(length=255), nullable=False),
+        sa.Column('row_hash', sa.String(length=32), nullable=False),
+        sa.PrimaryKeyConstraint('table_name', 'row_key')
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('gtfs_row_fingerprints')
+    op.drop_table('gtfs_file_fingerprints')
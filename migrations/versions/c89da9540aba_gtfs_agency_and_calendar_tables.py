@@ -0,0 +1,80 @@
+"""GTFS agency and calendar tables
+
+Revision ID: c89da9540aba
+Revises: 9d45a5933d09
+Create Date: 2025-07-09 18:42:51.107334
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c89da9540aba'
+down_revision: Union[str, Sequence[str], None] = '9d45a5933d09'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # These tables used to be created only by db.create_all(), so they may
+    # already exist on deployed databases.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('agency'):
+        op.create_table('agency',
+        sa.Column('agency_id', sa.String(), nullable=False),
+        sa.Column('agency_name', sa.String(), nullable=False),
+        sa.Column('agency_url', sa.String(), nullable=False),
+        sa.Column('agency_timezone', sa.String(), nullable=False),
+        sa.Column('agency_lang', sa.String(), nullable=True),
+        sa.Column('agency_phone', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('agency_id')
+        )
+    if not inspector.has_table('calendar'):
+        op.create_table('calendar',
+        sa.Column('service_id', sa.String(), nullable=False),
+        sa.Column('monday', sa.Boolean(), nullable=False),
+        sa.Column('tuesday', sa.Boolean(), nullable=False),
+        sa.Column('wednesday', sa.Boolean(), nullable=False),
+        sa.Column('thursday', sa.Boolean(), nullable=False),
+        sa.Column('friday', sa.Boolean(), nullable=False),
+        sa.Column('saturday', sa.Boolean(), nullable=False),
+        sa.Column('sunday', sa.Boolean(), nullable=False),
+        sa.Column('start_date', sa.Date(), nullable=False),
+        sa.Column('end_date', sa.Date(), nullable=False),
+        sa.PrimaryKeyConstraint('service_id')
+        )
+    if not inspector.has_table('calendar_dates'):
+        op.create_table('calendar_dates',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('service_id', sa.String(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('exception_type', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['service_id'], ['calendar.service_id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    else:
+        op.execute(
+            """
+            DELETE FROM calendar_dates a
+            USING calendar_dates b
+            WHERE a.service_id = b.service_id
+              AND a.date = b.date
+              AND a.id > b.id
+            """
+        )
+    unique = {c['name'] for c in inspector.get_unique_constraints('calendar_dates')}
+    if 'uq_calendar_dates_service_date' not in unique:
+        op.create_unique_constraint(
+            'uq_calendar_dates_service_date', 'calendar_dates', ['service_id', 'date']
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The tables may predate this revision (see upgrade), so only the
+    # constraint it always adds is removed.
+    op.drop_constraint('uq_calendar_dates_service_date', 'calendar_dates', type_='unique')
@@ -0,0 +1,36 @@
+"""Dataset versions
+
+Revision ID: e2ddd1478fe5
+Revises: 584e6356bd60
+Create Date: 2025-08-12 10:03:57.186420
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2ddd1478fe5'
+down_revision: Union[str, Sequence[str], None] = '584e6356bd60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # db.create_all() at app startup may already have created this on
+    # databases that were running before this revision.
+    if not sa.inspect(op.get_bind()).has_table('dataset_versions'):
+        op.create_table('dataset_versions',
+        sa.Column('scope', sa.String(length=32), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('scope')
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('dataset_versions')
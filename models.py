@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import Boolean, Date, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Date, DateTime, ForeignKey, Integer, String
 
 db = SQLAlchemy()
 Base = db.Model
@@ -31,6 +31,10 @@ class Route(db.Model):
     type = db.Column(db.Integer)
     region = db.relationship('Region', backref=db.backref('routes', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_routes_region_id', 'region_id'),
+    )
+
 class Stop(db.Model):
     __tablename__ = 'stops'
     id = db.Column(db.String(32), primary_key=True)
@@ -47,6 +51,10 @@ class Trip(db.Model):
     direction_id = db.Column(db.Integer)
     route = db.relationship('Route', backref=db.backref('trips', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_trips_route_service', 'route_id', 'service_id'),
+    )
+
 class StopTime(db.Model):
     __tablename__ = 'stop_times'
     id = db.Column(db.Integer, primary_key=True)
@@ -55,9 +63,19 @@ class StopTime(db.Model):
     departure_time = db.Column(db.String(8))
     stop_id = db.Column(db.String(32), db.ForeignKey('stops.id'), nullable=False)
     stop_sequence = db.Column(db.Integer, nullable=False)
+    # Seconds since midnight of the service day; may exceed 86400.
+    arrival_secs = db.Column(db.Integer)
+    departure_secs = db.Column(db.Integer)
+    # Copy of trips.service_id so departures can be range-scanned per stop.
+    service_id = db.Column(db.String(32))
     trip = db.relationship('Trip', backref=db.backref('stop_times', lazy=True))
     stop = db.relationship('Stop', backref=db.backref('stop_times', lazy=True))
 
+    __table_args__ = (
+        db.UniqueConstraint('trip_id', 'stop_sequence', name='uq_stop_times_trip_sequence'),
+        db.Index('ix_stop_times_stop_service_departure', 'stop_id', 'service_id', 'departure_secs'),
+    )
+
 
 class Agency(Base):
     __tablename__ = 'agency'
@@ -89,3 +107,58 @@ class CalendarDate(Base):
     service_id = db.Column(String, ForeignKey('calendar.service_id'), nullable=False)
     date = db.Column(Date, nullable=False)
     exception_type = db.Column(Integer, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('service_id', 'date', name='uq_calendar_dates_service_date'),
+    )
+
+
+class ServiceDay(Base):
+    """Expanded calendar: one row per service running on a given date."""
+    __tablename__ = 'service_days'
+    date = db.Column(Date, primary_key=True)
+    service_id = db.Column(String, primary_key=True)
+
+
+class RoutePattern(Base):
+    """Distinct ordered stop sequence shared by the trips of a route and direction."""
+    __tablename__ = 'route_patterns'
+    id = db.Column(Integer, primary_key=True, autoincrement=False)
+    route_id = db.Column(Integer, ForeignKey('routes.id', ondelete='CASCADE'), nullable=False)
+    direction_id = db.Column(Integer)
+    trip_count = db.Column(Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_route_patterns_route_id', 'route_id'),
+    )
+
+
+class RoutePatternStop(Base):
+    __tablename__ = 'route_pattern_stops'
+    pattern_id = db.Column(Integer, ForeignKey('route_patterns.id', ondelete='CASCADE'),
+                           primary_key=True)
+    sequence = db.Column(Integer, primary_key=True)
+    stop_id = db.Column(String(32), ForeignKey('stops.id', ondelete='CASCADE'), nullable=False)
+
+
+class DatasetVersion(Base):
+    """Counter bumped on every write to a scope of the served data."""
+    __tablename__ = 'dataset_versions'
+    scope = db.Column(String(32), primary_key=True)
+    version = db.Column(Integer, nullable=False)
+    updated_at = db.Column(DateTime, nullable=False)
+
+
+class GtfsFileFingerprint(Base):
+    __tablename__ = 'gtfs_file_fingerprints'
+    file_name = db.Column(String(64), primary_key=True)
+    sha256 = db.Column(String(64), nullable=False)
+    rows = db.Column(Integer, nullable=False)
+    imported_at = db.Column(DateTime, nullable=False)
+
+
+class GtfsRowFingerprint(Base):
+    __tablename__ = 'gtfs_row_fingerprints'
+    table_name = db.Column(String(32), primary_key=True)
+    row_key = db.Column(String(255), primary_key=True)
+    row_hash = db.Column(String(32), nullable=False)
@@ -0,0 +1,263 @@
+"""Earliest-arrival journey planning over the timetable's connections.
+
+Connections (hops between consecutive stops of a trip) come from the
+timetable sorted by departure time. The connections of the trips running on
+a date are selected once and cached, grouped by the connected part of the
+network they belong to. A query only looks at the part holding its origins,
+and returns at once when no destination lies in it.
+
+The scan runs in rounds, each one a handful of NumPy operations over the
+connections departing in a time range: every trip is boarded at its first
+connection leaving a stop reached in the previous round, and ridden from
+there. Round ``k`` finds the earliest arrivals with at most ``k`` trips, so
+the rounds stop when none improves. The time range starts short and doubles
+until the best arrival falls inside it, so a query touches about the part of
+the day between its departure and arrival.
+"""
+import threading
+import datetime as dt
+from collections import namedtuple
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from timetable import SECONDS_PER_DAY
+from gtfs_time import format_seconds
+
+
+# Minimum time to change between trips at the same stop.
+DEFAULT_TRANSFER_SECONDS = 120
+# Connections departing later than this after the requested time are ignored.
+DEFAULT_WINDOW_SECONDS = 12 * 3600
+# First time range scanned after the requested time; doubled until it holds the answer.
+HORIZON_SECONDS = 3600
+MAX_ITINERARIES = 5
+# Scans allowed per itinerary, to bound the work spent on dominated ones.
+SCANS_PER_ITINERARY = 4
+# Arrival time of stops not reached yet; later than any connection.
+UNREACHED = np.iinfo(np.int32).max
+# Dates whose connections are kept per timetable snapshot: today and
+# tomorrow, warmed when it is built, and one more.
+CACHED_DAYS = 3
+
+# Connections of one date, ordered by network part and then by departure;
+# those of part ``p`` lie between ``offsets[p]`` and ``offsets[p + 1]``.
+DayConnections = namedtuple("DayConnections",
+                            "departure arrival from_stop to_stop trip offsets")
+
+_day_cache = WeakKeyDictionary()
+_day_cache_lock = threading.Lock()
+
+
+def day_connections(timetable, date):
+    """Connections of the trips running on ``date``, by network part and departure.
+
+    Trips of the previous service day past midnight are included, shifted back
+    one day. The five columns are int32 arrays (20 bytes per connection). They
+    are cached per timetable snapshot and date, dropping the least recently
+    used date; concurrent requests for a date not cached yet wait for a single
+    build.
+    """
+    with _day_cache_lock:
+        cached = _day_cache.setdefault(timetable, {})
+        if date in cached:
+            cached[date] = cached.pop(date)
+            return cached[date]
+        connections = _build_day(timetable, date)
+        if len(cached) >= CACHED_DAYS:
+            cached.pop(next(iter(cached)))
+        cached[date] = connections
+        return connections
+
+
+def _build_day(timetable, date):
+    conns = timetable.connections
+    index, departure, arrival = [], [], []
+    for offset, day in ((0, date), (SECONDS_PER_DAY, date - dt.timedelta(days=1))):
+        part = np.arange(np.searchsorted(conns.departure, offset), len(conns.departure))
+        part = part[timetable.running(timetable.trip_service[conns.trip[part]], day)]
+        index.append(part)
+        departure.append(conns.departure[part] - offset)
+        arrival.append(conns.arrival[part] - offset)
+    departure = np.concatenate(departure)
+    index = np.concatenate(index)
+    component = timetable.stop_component[conns.from_stop[index]]
+    order = np.lexsort((departure, component))
+    index = index[order]
+    return DayConnections(
+        departure=departure[order].astype(np.int32),
+        arrival=np.concatenate(arrival)[order].astype(np.int32),
+        from_stop=conns.from_stop[index],
+        to_stop=conns.to_stop[index],
+        trip=conns.trip[index],
+        offsets=np.searchsorted(component[order], np.arange(len(timetable.stop_ids) + 1)),
+    )
+
+
+def warm(timetable, today=None):
+    """Build the connections of today and tomorrow ahead of the first query."""
+    today = today or dt.date.today()
+    for date in (today, today + dt.timedelta(days=1)):
+        day_connections(timetable, date)
+
+
+class _Scan:
+    """Earliest arrivals at every stop of a part, over a growing range of connections.
+
+    ``arrival``, ``board`` and ``alight`` hold, per stop, the arrival time and
+    the connections boarded and alighted on the last leg reaching it.
+    """
+
+    def __init__(self, day, first, origins, destinations, after, transfer, stops, trips):
+        self.day = day
+        self.first = first
+        self.destinations = destinations
+        self.transfer = transfer
+        self.arrival = np.full(stops, UNREACHED, dtype=np.int64)
+        self.board = np.full(stops, -1, dtype=np.int64)
+        self.alight = np.full(stops, -1, dtype=np.int64)
+        self.ready = np.full(stops, UNREACHED, dtype=np.int64)
+        self.ready[origins] = after
+        self.is_origin = np.zeros(stops, dtype=bool)
+        self.is_origin[origins] = True
+        # Earliest connection boarded on each trip; UNREACHED for trips not boarded.
+        self.boarded = np.full(trips, UNREACHED, dtype=np.int64)
+        self._key = np.full(stops, np.iinfo(np.int64).max, dtype=np.int64)
+
+    def best(self):
+        """Reached destination with the earliest arrival, and that arrival."""
+        best = self.destinations[np.argmin(self.arrival[self.destinations])]
+        return best, self.arrival[best]
+
+    def extend(self, last):
+        """Run rounds over the connections up to ``last`` until no arrival improves."""
+        day, first = self.day, self.first
+        # Stops and trips whose changes the new connections have not seen yet.
+        stops = self.ready < UNREACHED
+        trips = self.boarded < UNREACHED
+        while first < last:
+            departure = day.departure[first:last]
+            trip = day.trip[first:last]
+            # Board each trip at its earliest connection leaving a stop reached
+            # in time; more stops are reached every round, so boarding only
+            # moves earlier.
+            leaving = np.flatnonzero(stops[day.from_stop[first:last]])
+            leaving = leaving[self.ready[day.from_stop[first:last][leaving]] <= departure[leaving]]
+            before = self.boarded[trip[leaving]]
+            np.minimum.at(self.boarded, trip[leaving], leaving + first)
+            trips[trip[leaving][self.boarded[trip[leaving]] < before]] = True
+            # Ride the trips boarded earlier than before from there on.
+            ridden = np.flatnonzero(trips[trip])
+            ridden = ridden[self.boarded[trip[ridden]] <= ridden + first]
+            trips[:] = False
+            to_stop = day.to_stop[first:last][ridden]
+            reached = day.arrival[first:last][ridden].astype(np.int64)
+            better = (reached < self.arrival[to_stop]) & ~self.is_origin[to_stop]
+            if not better.any():
+                break
+            ridden, to_stop, reached = ridden[better], to_stop[better], reached[better]
+            # Earliest arrival at each stop; of equal ones, the first connection.
+            key = (reached << 32) | ridden
+            np.minimum.at(self._key, to_stop, key)
+            won = self._key[to_stop] == key
+            self._key[to_stop] = np.iinfo(np.int64).max
+            ridden, to_stop, reached = ridden[won], to_stop[won], reached[won]
+            self.arrival[to_stop] = reached
+            self.alight[to_stop] = ridden + first
+            self.board[to_stop] = self.boarded[trip[ridden]]
+            self.ready[to_stop] = np.minimum(self.ready[to_stop], reached + self.transfer)
+            stops[:] = False
+            stops[to_stop] = True
+            # Connections leaving after the best arrival so far cannot improve it.
+            # (A Python int keeps the search on the int32 column without a copy.)
+            last = min(last, first + int(np.searchsorted(departure, int(self.best()[1]))))
+
+    def legs(self, stop):
+        """``(board, alight)`` connections of the legs from an origin to ``stop``."""
+        legs = []
+        while not self.is_origin[stop]:
+            legs.append((int(self.board[stop]), int(self.alight[stop])))
+            stop = self.day.from_stop[self.board[stop]]
+        legs.reverse()
+        return legs
+
+
+def _scan(timetable, day, part, origins, destinations, after, transfer, window):
+    """Run one earliest-arrival scan within a network part; return its legs or None."""
+    first, end = day.offsets[part], day.offsets[part + 1]
+    departure = day.departure[first:end]
+    scan = _Scan(day, first + int(np.searchsorted(departure, after)), origins, destinations,
+                 after, transfer, len(timetable.stop_ids), len(timetable.trip_ids))
+    horizon = HORIZON_SECONDS
+    while True:
+        bound = after + min(horizon, window)
+        scan.extend(first + int(np.searchsorted(departure, bound, side="right")))
+        best, arrival = scan.best()
+        # Any earlier arrival rides connections departing before ``bound``.
+        if arrival <= bound or horizon >= window:
+            break
+        horizon *= 2
+    if arrival == UNREACHED:
+        return None
+    return scan.legs(best)
+
+
+def plan(timetable, origins, destinations, date, after, itineraries=3,
+         transfer=DEFAULT_TRANSFER_SECONDS, window=DEFAULT_WINDOW_SECONDS):
+    """Plan up to ``itineraries`` journeys between two sets of stops.
+
+    ``origins`` and ``destinations`` are interned stop ids; ``after`` is the
+    earliest departure in seconds after midnight of ``date``. Each itinerary
+    is the earliest arrival for a departure later than the previous one's;
+    of several arriving at the same time only the latest departure is kept.
+    """
+    origins = np.unique(np.asarray(origins, dtype=np.int64))
+    destinations = np.setdiff1d(np.asarray(destinations, dtype=np.int64), origins)
+    # Destinations outside every origin's part of the network are never reached.
+    component = timetable.stop_component
+    parts = np.intersect1d(component[origins], component[destinations])
+    if not parts.size:
+        return []
+    day = day_connections(timetable, date)
+    departure, arrival, from_stop, to_stop, trip = day[:5]
+    queries = [(int(part), origins[component[origins] == part],
+                destinations[component[destinations] == part]) for part in parts]
+
+    result = []
+    last_arrival = None
+    start = after
+    for _ in range(itineraries * SCANS_PER_ITINERARY):
+        if len(result) == itineraries:
+            break
+        found = [legs for legs in (_scan(timetable, day, part, part_origins, part_destinations,
+                                         start, transfer, window)
+                                   for part, part_origins, part_destinations in queries)
+                 if legs is not None]
+        if not found:
+            break
+        # The earliest arrival of any part; of equal ones, the latest departure.
+        legs = min(found, key=lambda legs: (arrival[legs[-1][1]], -departure[legs[0][0]]))
+        if arrival[legs[-1][1]] == last_arrival:
+            # Leaving later and arriving at the same time dominates the previous one.
+            result.pop()
+        last_arrival = arrival[legs[-1][1]]
+        result.append({
+            'departure_time': format_seconds(int(departure[legs[0][0]])),
+            'arrival_time': format_seconds(int(arrival[legs[-1][1]])),
+            'transfers': len(legs) - 1,
+            'legs': [
+                {
+                    'trip_id': timetable.trip_ids[trip[enter]],
+                    'route_id': int(timetable.route_ids[timetable.trip_route[trip[enter]]]),
+                    'from_stop_id': timetable.stop_ids[from_stop[enter]],
+                    'from_stop_name': timetable.stop_names[from_stop[enter]],
+                    'to_stop_id': timetable.stop_ids[to_stop[exit_]],
+                    'to_stop_name': timetable.stop_names[to_stop[exit_]],
+                    'departure_time': format_seconds(int(departure[enter])),
+                    'arrival_time': format_seconds(int(arrival[exit_])),
+                }
+                for enter, exit_ in legs
+            ],
+        })
+        start = int(departure[legs[0][0]]) + 1
+    return result
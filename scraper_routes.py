@@ -1,39 +1,139 @@
 import os
 import re
 import json
-from urllib.parse import urljoin
+import random
+import hashlib
+import datetime
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin, urlsplit
+import aiohttp
 import requests
 from bs4 import BeautifulSoup
 
 BASE_URL = "https://centrocoasting.com"
 NICARAGUA_PAGE = urljoin(BASE_URL, "nicaragua/")
 OUTPUT_DIR = os.path.join("data", "json_routes")
+CACHE_DIR = os.path.join("data", "http_cache")
+# Lists the JSON files written since the last import so json_loader can
+# import only those (``python json_loader.py --manifest``).
+MANIFEST_PATH = os.path.join("data", "json_routes_manifest.json")
 
 # Matches times like 5:30 am, 17:45, 6am, etc.
 TIME_REGEX = re.compile(r"\b((?:[01]?\d|2[0-3])[:h][0-5]\d(?:\s*(?:am|pm))?|(?:[01]?\d|2[0-3])\s*(?:am|pm))", re.I)
 
 
-def get_city_links():
-    """Return dict mapping city name to url."""
-    resp = requests.get(NICARAGUA_PAGE, timeout=15)
+# Status codes worth retrying in the async crawler.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ResponseCache:
+    """Persistent cache of page bodies with their validators and content hash.
+
+    ``index.json`` maps every url to its ETag, Last-Modified and the SHA-256
+    of the body, which is stored next to it. Used to send conditional GETs
+    and to tell whether a page actually changed since the previous run.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entries = {}
+        self.pending = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def _body_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html")
+
+    def conditional_headers(self, url):
+        entry = self.entries.get(url)
+        if not entry or not os.path.exists(self._body_path(url)):
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def body(self, url):
+        with open(self._body_path(url), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def store(self, url, body, etag=None, last_modified=None):
+        """Stage a fresh response; return True when the body changed.
+
+        Nothing is recorded until ``commit(url)``, so a page whose routes
+        fail to parse or save is treated as changed again on the next run.
+        """
+        digest = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        previous = self.entries.get(url, {})
+        changed = previous.get("sha256") != digest
+        self.pending[url] = (body if changed else None,
+                             {"etag": etag, "last_modified": last_modified, "sha256": digest})
+        return changed
+
+    def commit(self, url):
+        """Record the response staged for ``url`` once it has been processed."""
+        if url not in self.pending:
+            return
+        body, entry = self.pending.pop(url)
+        if body is not None:
+            with open(self._body_path(url), "w", encoding="utf-8") as f:
+                f.write(body)
+        self.entries[url] = entry
+
+    def save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+
+def fetch_page(url, cache=None):
+    """GET ``url``, conditionally when cached. Returns ``(html, changed)``."""
+    headers = cache.conditional_headers(url) if cache else {}
+    resp = requests.get(url, headers=headers, timeout=15)
+    if resp.status_code == 304:
+        return cache.body(url), False
     resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, "html.parser")
+    if cache is None:
+        return resp.text, True
+    changed = cache.store(url, resp.text, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+    return resp.text, changed
+
+
+def parse_city_links(html, base_url=BASE_URL):
+    """Return dict mapping city name to url from the country page html."""
+    soup = BeautifulSoup(html, "html.parser")
     cities = {}
     for city_div in soup.select("div.city"):
         link = city_div.find("a")
         name_tag = city_div.find("h3")
         if link and name_tag:
-            url = urljoin(BASE_URL, link.get("href"))
+            url = urljoin(base_url, link.get("href"))
             name = name_tag.get_text(strip=True)
             cities[name] = url
     return cities
 
 
-def parse_city_page(name, url):
-    """Parse routes for a single city."""
-    resp = requests.get(url, timeout=15)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, "html.parser")
+def get_city_links(base_url=BASE_URL, cache=None):
+    """Return dict mapping city name to url."""
+    url = urljoin(base_url, "nicaragua/")
+    html, _ = fetch_page(url, cache)
+    cities = parse_city_links(html, base_url)
+    if cache:
+        cache.commit(url)
+    return cities
+
+
+def parse_routes(name, html):
+    """Parse the routes listed in a city page."""
+    soup = BeautifulSoup(html, "html.parser")
     routes = []
     for header in soup.find_all("h2"):
         route_name = header.get_text(strip=True)
@@ -68,25 +168,196 @@ def parse_city_page(name, url):
     return routes
 
 
+def parse_city_page(name, url):
+    """Parse routes for a single city."""
+    resp = requests.get(url, timeout=15)
+    resp.raise_for_status()
+    return parse_routes(name, resp.text)
+
+
 def save_routes(routes):
+    """Write one JSON file per route, skipping files whose content is unchanged.
+
+    Returns the names of the files actually written.
+    """
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    written = []
     for route in routes:
         slug = route["ruta"].replace(" ", "_").replace("/", "-")
-        path = os.path.join(OUTPUT_DIR, f"{slug}.json")
+        fname = f"{slug}.json"
+        path = os.path.join(OUTPUT_DIR, fname)
+        content = json.dumps(route, ensure_ascii=False, indent=2)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                if f.read() == content:
+                    continue
         with open(path, "w", encoding="utf-8") as f:
-            json.dump(route, f, ensure_ascii=False, indent=2)
+            f.write(content)
+        written.append(fname)
+    return written
 
 
-def scrape_all():
-    cities = get_city_links()
+def write_manifest(changed, path=MANIFEST_PATH):
+    """Add ``changed`` to the files listed in the manifest.
+
+    Entries of earlier runs stay until json_loader imports them, so running
+    the scraper twice before a load does not lose changes.
+    """
+    pending = set(changed)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            pending.update(json.load(f).get("changed", []))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "generated_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+                "changed": sorted(pending),
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    os.replace(tmp_path, path)
+
+
+def scrape_all(base_url=BASE_URL, cache_dir=CACHE_DIR):
+    """Scrape every city, re-parsing only pages that changed since the last run.
+
+    Returns the JSON files written, also recorded in ``MANIFEST_PATH``.
+    """
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    cities = get_city_links(base_url, cache)
+    changed_files = []
     for name, url in cities.items():
         try:
-            routes = parse_city_page(name, url)
-            for route in routes:
-                save_routes([route])
+            html, changed = fetch_page(url, cache)
+            if changed:
+                changed_files.extend(save_routes(parse_routes(name, html)))
+            if cache:
+                cache.commit(url)
         except Exception as exc:
             print(f"Failed to scrape {name}: {exc}")
+    if cache:
+        cache.save()
+    write_manifest(changed_files)
+    return changed_files
+
+
+class HostRateLimiter:
+    """Space out requests to the same host by at least ``1 / rate`` seconds."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = {}
+        self._locks = {}
+
+    async def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next.get(host, 0.0) - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next[host] = loop.time() + self.interval
+
+
+async def fetch(session, url, limiter, retries=3, backoff=0.5, cache=None):
+    """GET ``url`` through the shared session, retrying with exponential backoff.
+
+    Sends a conditional request when ``cache`` holds the page and returns
+    ``(html, changed)`` like ``fetch_page``.
+    """
+    headers = cache.conditional_headers(url) if cache else {}
+    for attempt in range(retries + 1):
+        await limiter.wait(url)
+        try:
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 304:
+                    return cache.body(url), False
+                if resp.status not in RETRY_STATUSES:
+                    resp.raise_for_status()
+                    html = await resp.text()
+                    if cache is None:
+                        return html, True
+                    changed = cache.store(url, html, resp.headers.get("ETag"),
+                                          resp.headers.get("Last-Modified"))
+                    return html, changed
+                error = aiohttp.ClientResponseError(
+                    resp.request_info, resp.history, status=resp.status, message=resp.reason
+                )
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+            error = exc
+        if attempt == retries:
+            raise error
+        await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+async def scrape_all_async(base_url=BASE_URL, concurrency=8, rate=4.0, retries=3,
+                           backoff=0.5, parse_workers=None, cache_dir=CACHE_DIR):
+    """Crawl every city page concurrently.
+
+    Pages are fetched through one pooled ``aiohttp`` session with at most
+    ``concurrency`` requests in flight and ``rate`` requests per second per
+    host; HTML parsing runs on a process pool so it never blocks fetching.
+    Unchanged pages are not parsed again. Returns the JSON files written,
+    also recorded in ``MANIFEST_PATH``.
+    """
+    cache = ResponseCache(cache_dir) if cache_dir else None
+    limiter = HostRateLimiter(rate)
+    loop = asyncio.get_running_loop()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=15)
+    semaphore = asyncio.Semaphore(concurrency)
+    changed_files = []
+    with ProcessPoolExecutor(parse_workers) as pool:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            index_url = urljoin(base_url, "nicaragua/")
+            html, _ = await fetch(session, index_url, limiter, retries, backoff, cache)
+            cities = await loop.run_in_executor(pool, parse_city_links, html, base_url)
+            if cache:
+                cache.commit(index_url)
+
+            async def scrape_city(name, url):
+                try:
+                    async with semaphore:
+                        html, changed = await fetch(session, url, limiter, retries, backoff, cache)
+                    if changed:
+                        routes = await loop.run_in_executor(pool, parse_routes, name, html)
+                        changed_files.extend(save_routes(routes))
+                    if cache:
+                        cache.commit(url)
+                except Exception as exc:
+                    print(f"Failed to scrape {name}: {exc}")
+
+            await asyncio.gather(*(scrape_city(name, url) for name, url in cities.items()))
+    if cache:
+        cache.save()
+    write_manifest(changed_files)
+    return changed_files
 
 
 if __name__ == "__main__":
-    scrape_all()
+    parser = argparse.ArgumentParser(description="Descarga rutas desde centrocoasting.com")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="descarga concurrente con asyncio")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="solicitudes simultáneas como máximo")
+    parser.add_argument("--rate", type=float, default=4.0,
+                        help="solicitudes por segundo por host (0 = sin límite)")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignora la caché HTTP y descarga todas las páginas")
+    args = parser.parse_args()
+
+    cache_dir = None if args.no_cache else CACHE_DIR
+    if args.use_async:
+        changed = asyncio.run(scrape_all_async(args.base_url, args.concurrency, args.rate,
+                                               args.retries, cache_dir=cache_dir))
+    else:
+        changed = scrape_all(args.base_url, cache_dir)
+    print(f"{len(changed)} archivos JSON actualizados (ver {MANIFEST_PATH})")
@@ -0,0 +1,122 @@
+"""Grid index over stop coordinates for nearest-stop and map viewport queries.
+
+Stops are bucketed into square cells of ``CELL_DEGREES`` and sorted by cell,
+so the stops of a block of cells are found with one binary search per row.
+The grid is built from a timetable snapshot and rebuilt with it.
+"""
+import math
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+
+CELL_DEGREES = 0.01
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+# Size in screen pixels of the cells stops are clustered into on the map.
+CLUSTER_PIXELS = 60
+
+_grids = WeakKeyDictionary()
+
+
+def haversine(lat, lon, lats, lons):
+    """Distance in meters from ``(lat, lon)`` to each point of ``lats``/``lons``."""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = (np.sin((lats - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class StopGrid:
+    """Stops bucketed by cell; positions refer to the arrays given to it."""
+
+    def __init__(self, lat, lon, cell=CELL_DEGREES):
+        # Stops loaded without coordinates (e.g. from the JSON routes) are
+        # stored at 0, 0 and left out.
+        located = np.isfinite(lat) & np.isfinite(lon) & ~((lat == 0) & (lon == 0))
+        self.cell = cell
+        positions = np.flatnonzero(located)
+        if len(positions):
+            self.min_lat = float(lat[positions].min())
+            self.min_lon = float(lon[positions].min())
+            max_abs_lat = float(np.abs(lat[positions]).max())
+        else:
+            self.min_lat = self.min_lon = max_abs_lat = 0.0
+        rows = self._row(lat[positions])
+        cols = self._col(lon[positions])
+        self.cols = int(cols.max()) + 1 if len(cols) else 1
+        self.rows = int(rows.max()) + 1 if len(rows) else 1
+        keys = rows.astype(np.int64) * self.cols + cols
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.positions = positions[order]
+        self.lat = lat[self.positions]
+        self.lon = lon[self.positions]
+        # Narrowest cell side, used to bound the distance covered by a block.
+        self.cell_meters = cell * METERS_PER_DEGREE * math.cos(math.radians(min(max_abs_lat, 89)))
+
+    def _row(self, lat):
+        return np.floor((np.asarray(lat) - self.min_lat) / self.cell).astype(np.int64)
+
+    def _col(self, lon):
+        return np.floor((np.asarray(lon) - self.min_lon) / self.cell).astype(np.int64)
+
+    def _block(self, row0, row1, col0, col1):
+        """Indices into the sorted arrays of the stops in a block of cells."""
+        row0, row1 = max(int(row0), 0), min(int(row1), self.rows - 1)
+        col0, col1 = max(int(col0), 0), min(int(col1), self.cols - 1)
+        if row0 > row1 or col0 > col1:
+            return np.array([], dtype=np.int64)
+        starts = np.arange(row0, row1 + 1, dtype=np.int64) * self.cols
+        lo = np.searchsorted(self.keys, starts + col0, side="left")
+        hi = np.searchsorted(self.keys, starts + col1, side="right")
+        return np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+
+    def nearest(self, lat, lon, k, radius):
+        """Positions and distances of up to ``k`` stops within ``radius`` meters."""
+        row, col = int(self._row(lat)), int(self._col(lon))
+        reach = 1
+        while True:
+            found = self._block(row - reach, row + reach, col - reach, col + reach)
+            distances = haversine(lat, lon, self.lat[found], self.lon[found])
+            # Stops outside the block are farther than reach cells away.
+            covered = reach * self.cell_meters
+            if covered >= radius or np.count_nonzero(distances <= covered) >= k \
+                    or reach > max(self.rows, self.cols):
+                break
+            reach *= 2
+        keep = distances <= radius
+        found, distances = found[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")[:k]
+        return self.positions[found[order]], distances[order]
+
+    def within(self, min_lat, min_lon, max_lat, max_lon):
+        """Positions of the stops inside a bounding box."""
+        found = self._block(self._row(min_lat), self._row(max_lat),
+                            self._col(min_lon), self._col(max_lon))
+        lat, lon = self.lat[found], self.lon[found]
+        inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        return self.positions[found[inside]]
+
+
+def cluster(lat, lon, zoom):
+    """Group points into map cells for ``zoom``; return (labels, counts, lats, lons).
+
+    ``labels`` maps every point to its cluster; the cluster position is the
+    mean of its points.
+    """
+    cell = CLUSTER_PIXELS * 360.0 / (256 * 2 ** zoom)
+    cells = np.stack([np.floor(lat / cell), np.floor(lon / cell)], axis=1)
+    _, labels, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    labels = labels.reshape(-1)
+    return (labels, counts,
+            np.bincount(labels, weights=lat) / counts,
+            np.bincount(labels, weights=lon) / counts)
+
+
+def stop_grid(timetable):
+    """Grid over the stops of a timetable snapshot, built on first use."""
+    grid = _grids.get(timetable)
+    if grid is None:
+        grid = _grids[timetable] = StopGrid(timetable.stop_lat, timetable.stop_lon)
+    return grid
@@ -0,0 +1,101 @@
+"""Shared fixtures.
+
+Tests that need PostgreSQL use the database in ``TEST_DATABASE_URL`` (for
+example ``postgresql://postgres@localhost:5432/rutas_test``), which is wiped
+and loaded with a small generated feed. They are skipped when it is not set
+or not reachable.
+"""
+import os
+import sys
+import datetime as dt
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def database_url():
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(url)
+    try:
+        with engine.connect():
+            pass
+    except OperationalError as exc:
+        pytest.skip(f"PostgreSQL not reachable: {exc.orig}")
+    finally:
+        engine.dispose()
+    return make_url(url)
+
+
+@pytest.fixture(scope="session")
+def feed_dir(tmp_path_factory):
+    """A small deterministic feed whose calendars cover the coming weeks."""
+    from benchmarks.generate_feed import generate
+
+    out = tmp_path_factory.mktemp("gtfs")
+    generate(str(out), routes=10, stops=200, trips=300, stops_per_trip=8,
+             start=dt.date.today() - dt.timedelta(days=7), days=60, seed=3)
+    return str(out)
+
+
+@pytest.fixture(scope="session")
+def app(database_url, feed_dir, tmp_path_factory):
+    """The application on a freshly loaded test database, in testing mode."""
+    env = {
+        "DB_USER": database_url.username or "",
+        "DB_PASSWORD": database_url.password or "",
+        "DB_HOST": database_url.host or "localhost",
+        "DB_PORT": str(database_url.port or 5432),
+        "DB_NAME": database_url.database,
+        "APP_BOOTSTRAP": "0",
+        "EXPORT_ON_IMPORT": "0",
+        "EXPORT_DIR": str(tmp_path_factory.mktemp("export")),
+        "RESPONSE_CACHE": "memory",
+    }
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+
+    from app import create_app
+    from models import db, Region
+    from gtfs_loader import load_gtfs_data
+
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.drop_all()
+        db.session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        db.session.commit()
+        db.create_all()
+        # The GTFS loader assigns every route to region 1.
+        db.session.add(Region(id=1, name="Managua"))
+        db.session.commit()
+        db.session.execute(text("SELECT setval('regions_id_seq', 1)"))
+        db.session.commit()
+    load_gtfs_data(app, feed_dir)
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+@pytest.fixture
+def client(app):
+    """A test client logged in to the admin panel."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["logged_in"] = True
+        session["username"] = "admin"
+    return client
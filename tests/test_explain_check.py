@@ -0,0 +1,18 @@
+from explain_check import _full_scans, check_plans
+
+
+def test_full_scans_finds_seq_and_unconditioned_index_scans():
+    plan = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "routes"},
+            {"Node Type": "Index Scan", "Relation Name": "trips",
+             "Index Cond": "(route_id = routes.id)"},
+            {"Node Type": "Index Only Scan", "Index Name": "uq_stop_times_trip_sequence"},
+        ],
+    }
+    assert _full_scans(plan) == ["routes", "uq_stop_times_trip_sequence"]
+
+
+def test_api_queries_use_indexes(app):
+    assert check_plans(app) == []
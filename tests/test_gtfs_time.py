@@ -0,0 +1,34 @@
+import pytest
+
+from gtfs_time import format_seconds, to_seconds
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("06:10:48", 6 * 3600 + 10 * 60 + 48),
+    ("25:10:00", 25 * 3600 + 10 * 60),
+    ("7:15", 7 * 3600 + 15 * 60),
+    ("7h15", 7 * 3600 + 15 * 60),
+    (" 5:30 am ", 5 * 3600 + 30 * 60),
+    ("5:30 PM", 17 * 3600 + 30 * 60),
+    ("12:00 am", 0),
+    ("12:00 pm", 12 * 3600),
+    ("12 pm", 12 * 3600),
+    ("9am", 9 * 3600),
+    ("0:00:00", 0),
+])
+def test_to_seconds(value, expected):
+    assert to_seconds(value) == expected
+
+
+@pytest.mark.parametrize("value", [
+    None, "", "  ", "abc", "7", "7:5", "7:15:5",
+    "7:60", "7:15:60", "10:99:00",
+    "13:00 pm", "0:00 am", "0 am", "13 pm", "25:00 am",
+])
+def test_to_seconds_rejects(value):
+    assert to_seconds(value) is None
+
+
+def test_format_seconds_round_trip():
+    for value in ("00:00:00", "06:10:48", "24:05:30", "27:59:59"):
+        assert format_seconds(to_seconds(value)) == value
@@ -0,0 +1,81 @@
+"""Journey planning on a small hand-built timetable."""
+import datetime as dt
+
+import pytest
+
+import planner
+from planner import day_connections, plan, warm
+from timetable import Timetable
+
+DAY = dt.date(2025, 3, 3)
+
+
+def _timetable():
+    # Line 1 runs A-B-C, line 2 C-D; E-F is a separate network.
+    stops = [(name, name, 12.0, -86.0) for name in "ABCDEF"]
+    trips = [("T1", 1, "LAB"), ("T2", 1, "LAB"), ("T3", 2, "LAB"), ("T4", 3, "LAB"),
+             ("T5", 2, "LAB")]
+    calendars = [("LAB", DAY - dt.timedelta(days=7), DAY + dt.timedelta(days=7),
+                  1, 1, 1, 1, 1, 1, 1)]
+    h = 3600
+    stop_times = [
+        ("T1", "A", 1, None, 7 * h), ("T1", "B", 2, 7 * h + 600, 7 * h + 600),
+        ("T1", "C", 3, 7 * h + 1200, 7 * h + 1200),
+        ("T2", "A", 1, None, 8 * h), ("T2", "B", 2, 8 * h + 600, 8 * h + 600),
+        ("T2", "C", 3, 8 * h + 1200, 8 * h + 1200),
+        # Too close to T1's arrival at C to make the transfer.
+        ("T3", "C", 1, None, 7 * h + 1260), ("T3", "D", 2, 7 * h + 1800, None),
+        ("T5", "C", 1, None, 7 * h + 1800), ("T5", "D", 2, 7 * h + 2400, None),
+        ("T4", "E", 1, None, 7 * h), ("T4", "F", 2, 7 * h + 600, None),
+    ]
+    return Timetable(stops, trips, (calendars, []), [stop_times], [], [])
+
+
+@pytest.fixture
+def timetable():
+    return _timetable()
+
+
+def stops(timetable, names):
+    return [timetable.stop_index[name] for name in names]
+
+
+def test_components_split_unconnected_networks(timetable):
+    component = timetable.stop_component
+    a, c, d, e, f = stops(timetable, "ACDEF")
+    assert component[a] == component[c] == component[d]
+    assert component[e] == component[f] != component[a]
+
+
+def test_plan_transfers_after_the_minimum_transfer_time(timetable):
+    [journey] = plan(timetable, stops(timetable, "A"), stops(timetable, "D"), DAY, 6 * 3600, 1)
+    assert journey["departure_time"] == "07:00:00"
+    assert journey["arrival_time"] == "07:40:00"
+    assert journey["transfers"] == 1
+    assert [leg["trip_id"] for leg in journey["legs"]] == ["T1", "T5"]
+
+
+def test_plan_lists_later_departures(timetable):
+    journeys = plan(timetable, stops(timetable, "A"), stops(timetable, "C"), DAY, 6 * 3600, 3)
+    assert [j["departure_time"] for j in journeys] == ["07:00:00", "08:00:00"]
+
+
+def test_unreachable_destination_skips_the_scan(timetable, monkeypatch):
+    monkeypatch.setattr(planner, "_scan", None)
+    assert plan(timetable, stops(timetable, "A"), stops(timetable, "F"), DAY, 0) == []
+
+
+def test_warm_caches_today_and_tomorrow(timetable):
+    warm(timetable, DAY)
+    cached = planner._day_cache[timetable]
+    assert list(cached) == [DAY, DAY + dt.timedelta(days=1)]
+    assert day_connections(timetable, DAY) is cached[DAY]
+
+
+def test_day_cache_drops_least_recently_used(timetable):
+    days = [DAY + dt.timedelta(days=n) for n in range(4)]
+    for day in days[:3]:
+        day_connections(timetable, day)
+    day_connections(timetable, days[0])
+    day_connections(timetable, days[3])
+    assert list(planner._day_cache[timetable]) == [days[2], days[0], days[3]]
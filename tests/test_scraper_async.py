@@ -0,0 +1,149 @@
+"""scrape_all_async against a local aiohttp server serving fixture pages."""
+import os
+import json
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer, unused_port
+
+import scraper_routes
+from scraper_routes import HostRateLimiter, scrape_all_async
+
+INDEX = """
+<html><body>
+  <div class="city"><h3>León</h3><a href="/city/leon/">León</a></div>
+  <div class="city"><h3>Granada</h3><a href="/city/granada/">Granada</a></div>
+  <div class="city"><h3>Rivas</h3><a href="/city/rivas/">Rivas</a></div>
+</body></html>
+"""
+CITY = """
+<html><body>
+  <h2>{city} to Managua</h2>
+  <p>Salidas a las 5:30 am, 7:15 y 13h45 via Nagarote, Mateare and Ciudad Sandino</p>
+  <h2>Help your fellow travellers</h2>
+  <p>10:00</p>
+</body></html>
+"""
+
+
+class Site:
+    """Fixture site: Granada answers 429 then 503 before succeeding, Rivas always 500."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def handle(self, request):
+        loop = asyncio.get_running_loop()
+        self.requests.append((request.path, loop.time()))
+        if request.path == "/nicaragua/":
+            return web.Response(text=INDEX, content_type="text/html")
+        city = request.path.strip("/").split("/")[-1]
+        if city == "rivas":
+            return web.Response(status=500)
+        if city == "granada":
+            failures = [429, 503]
+            attempt = sum(1 for path, _ in self.requests if path == request.path) - 1
+            if attempt < len(failures):
+                return web.Response(status=failures[attempt])
+        return web.Response(text=CITY.format(city=city.capitalize()), content_type="text/html")
+
+    def times(self, path):
+        return [t for p, t in self.requests if p == path]
+
+
+class CountingPool(ProcessPoolExecutor):
+    submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        CountingPool.submitted.append(fn.__name__)
+        return super().submit(fn, *args, **kwargs)
+
+
+async def _scrape(site, port=None, **kwargs):
+    app = web.Application()
+    app.router.add_route("GET", "/{tail:.*}", site.handle)
+    server = TestServer(app, port=port)
+    await server.start_server()
+    try:
+        return await scrape_all_async(str(server.make_url("/")), **kwargs)
+    finally:
+        await server.close()
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    # Outputs and the manifest are written relative to the working directory.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(scraper_routes, "ProcessPoolExecutor", CountingPool)
+    monkeypatch.setattr(CountingPool, "submitted", [])
+    return Site()
+
+
+def test_retries_parses_in_pool_and_writes_manifest(site, capsys):
+    changed = asyncio.run(_scrape(site, concurrency=4, rate=0, retries=2, backoff=0.05,
+                                  parse_workers=2, cache_dir=None))
+
+    assert sorted(changed) == ["Granada_-_Managua.json", "Leon_-_Managua.json"]
+    # 429 and 503 are retried with exponential backoff (0.05s, then 0.1s, plus jitter).
+    granada = site.times("/city/granada/")
+    assert len(granada) == 3
+    assert granada[1] - granada[0] >= 0.05
+    assert granada[2] - granada[1] >= 0.1
+    # A page that keeps failing is given up after the retries, without stopping the rest.
+    assert len(site.times("/city/rivas/")) == 3
+    assert "Failed to scrape Rivas" in capsys.readouterr().out
+
+    # The index and every fetched city page were parsed on the process pool.
+    assert sorted(CountingPool.submitted) == ["parse_city_links", "parse_routes", "parse_routes"]
+    with open(os.path.join("data", "json_routes", "Leon_-_Managua.json"), encoding="utf-8") as f:
+        route = json.load(f)
+    assert route["region"] == "León"
+    assert [s["hora"] for s in route["salidas"]] == ["5:30 am", "7:15", "13:45"]
+    assert route["paradas"] == ["Nagarote", "Mateare", "Ciudad Sandino"]
+    with open(os.path.join("data", "json_routes_manifest.json"), encoding="utf-8") as f:
+        assert json.load(f)["changed"] == sorted(changed)
+
+
+def test_unchanged_pages_are_not_parsed_again(site):
+    kwargs = dict(concurrency=4, rate=0, retries=2, backoff=0.01, parse_workers=1,
+                  cache_dir=os.path.join("data", "http_cache"))
+    # Cached by url, so both runs must use the same port.
+    port = unused_port()
+    first = asyncio.run(_scrape(site, port, **kwargs))
+    CountingPool.submitted.clear()
+    second = asyncio.run(_scrape(Site(), port, **kwargs))
+
+    assert first and second == []
+    # Only the index is parsed; the city pages' bodies are unchanged.
+    assert CountingPool.submitted == ["parse_city_links"]
+
+
+def test_rate_limiter_spaces_requests_per_host(site):
+    rate = 20.0
+    asyncio.run(_scrape(site, concurrency=8, rate=rate, retries=0, backoff=0.01,
+                        parse_workers=1, cache_dir=None))
+
+    times = sorted(t for _, t in site.requests)
+    assert len(times) == 4
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    # Allow for the server clock reading a little after the client's.
+    assert min(gaps) >= 1 / rate * 0.9
+
+
+def test_rate_limiter_is_per_host():
+    async def run():
+        limiter = HostRateLimiter(rate=2.0)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await limiter.wait("http://a.example/1")
+        await limiter.wait("http://b.example/1")
+        other_host = loop.time() - start
+        await limiter.wait("http://a.example/2")
+        same_host = loop.time() - start
+        return other_host, same_host
+
+    other_host, same_host = asyncio.run(run())
+    assert other_host < 0.1
+    assert same_host >= 0.45
@@ -0,0 +1,122 @@
+"""Admin and API views under the query budget.
+
+The app runs with TESTING=True, so a view that runs more SQL statements than
+its budget (``QUERY_BUDGET`` or its ``query_budget``) raises
+``QueryBudgetExceeded`` instead of only logging it, and an N+1 query fails
+here.
+"""
+import datetime as dt
+
+import pytest
+
+from metrics import QueryBudgetExceeded
+from models import db, Route, Stop, StopTime, Trip
+from timetable import get_timetable
+
+
+@pytest.fixture(scope="module")
+def sample(app):
+    """A route, one of its stops and a date on which it runs."""
+    with app.app_context():
+        route_id, stop_id = (
+            db.session.query(Trip.route_id, StopTime.stop_id)
+            .join(StopTime, StopTime.trip_id == Trip.id)
+            .filter(Trip.service_id == "LAB", StopTime.stop_sequence == 1)
+            .order_by(Trip.id).first()
+        )
+        destination = (
+            db.session.query(StopTime.stop_id)
+            .join(Trip, Trip.id == StopTime.trip_id)
+            .filter(Trip.route_id == route_id, StopTime.stop_sequence == 3)
+            .order_by(Trip.id).limit(1).scalar()
+        )
+        stop = db.session.get(Stop, stop_id)
+        lat, lon = stop.lat, stop.lon
+    day = dt.date.today()
+    while day.weekday() >= 5:
+        day += dt.timedelta(days=1)
+    # Built outside a request, as after the first request of a worker.
+    with app.test_request_context():
+        get_timetable()
+    return {"route": route_id, "stop": stop_id, "destination": destination,
+            "date": day.isoformat(), "lat": lat, "lon": lon}
+
+
+def admin_urls(sample):
+    route, stop = sample["route"], sample["stop"]
+    return [
+        "/",
+        "/?region=mana",
+        f"/?after={route}",
+        "/routes/new",
+        f"/routes/{route}/edit",
+        f"/routes/{route}/stops",
+        f"/stops/{stop}/edit?route_id={route}",
+        "/import",
+        "/export_gtfs/estado",
+    ]
+
+
+def api_urls(sample):
+    s = sample
+    return [
+        "/api/rutas",
+        "/api/rutas?region=mana&limite=5",
+        f"/api/paradas?ruta={s['route']}",
+        f"/api/horarios?ruta={s['route']}&parada={s['stop']}&fecha={s['date']}&hora=05:00",
+        f"/api/planificar?origen={s['stop']}&destino={s['destination']}"
+        f"&fecha={s['date']}&hora=05:00",
+        f"/api/paradas/cercanas?lat={s['lat']}&lon={s['lon']}&k=5",
+        f"/api/paradas/bbox?bbox={s['lon'] - 0.05},{s['lat'] - 0.05},"
+        f"{s['lon'] + 0.05},{s['lat'] + 0.05}&zoom=16",
+    ]
+
+
+def test_admin_views_within_budget(client, sample):
+    for url in admin_urls(sample):
+        response = client.get(url)
+        assert response.status_code == 200, url
+
+
+def test_api_views_within_budget(client, sample):
+    for url in api_urls(sample):
+        response = client.get(url)
+        assert response.status_code == 200, url
+        assert response.get_json() is not None, url
+
+
+def test_api_views_without_timetable_within_budget(app, client, sample):
+    app.config["TIMETABLE_ENGINE"] = False
+    try:
+        for url in api_urls(sample):
+            if url.startswith(("/api/planificar", "/api/paradas/")):
+                continue  # answered only from the timetable
+            # Skip the response cache: these must reach the database.
+            response = client.get(url + ("&" if "?" in url else "?") + "sin_motor=1")
+            assert response.status_code == 200, url
+    finally:
+        app.config["TIMETABLE_ENGINE"] = True
+
+
+def test_route_list_loads_regions_eagerly(client, app, sample):
+    with app.app_context():
+        routes = Route.query.count()
+    assert routes > 1
+    # One statement for the page of routes with their regions, whatever its size.
+    app.view_functions["list_routes"].query_budget, budget = 1, \
+        app.view_functions["list_routes"].query_budget
+    try:
+        response = client.get("/")
+        assert response.status_code == 200
+    finally:
+        app.view_functions["list_routes"].query_budget = budget
+
+
+def test_budget_overrun_fails_in_testing(client, app, sample):
+    budget = app.config["QUERY_BUDGET"]
+    app.config["QUERY_BUDGET"] = 1
+    try:
+        with pytest.raises(QueryBudgetExceeded):
+            client.get(f"/routes/{sample['route']}/stops")
+    finally:
+        app.config["QUERY_BUDGET"] = budget
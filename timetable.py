@@ -0,0 +1,360 @@
+"""In-memory timetable answering the read API without querying the database.
+
+The GTFS tables are loaded once into NumPy arrays: stop, trip, route and
+service ids are interned to integers, the departures of every stop are kept
+sorted by route and time, trips keep their ordered stops, and the days each
+service runs are stored as bitsets. Lookups are binary searches over those
+arrays.
+"""
+import time
+import threading
+import datetime as dt
+from collections import namedtuple
+from functools import cached_property
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+from models import (
+    db, Calendar, CalendarDate, Region, Route, Stop, Trip, StopTime, RoutePattern,
+    RoutePatternStop,
+)
+from gtfs_derived import expand_service_days
+from gtfs_time import WEEKDAYS, format_seconds
+from dataset_version import current_version
+
+
+SECONDS_PER_DAY = 24 * 3600
+# Rows fetched per round trip while loading stop_times.
+FETCH_SIZE = 50000
+
+
+# Elementary hops of a trip between consecutive stops, sorted by departure.
+Connections = namedtuple("Connections", "departure arrival from_stop to_stop trip")
+
+
+def _csr_offsets(keys, size):
+    """Offsets of the runs of each key in ``0..size-1`` within sorted ``keys``."""
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=size), out=offsets[1:])
+    return offsets
+
+
+def _route_key(route_id):
+    try:
+        return int(route_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _stop_time_arrays(chunks, trip_index, stop_index):
+    """Interned ``(trip, stop, sequence, arrival, departure)`` arrays of stop times.
+
+    ``chunks`` yields lists of stop_times rows; each one is converted as it
+    arrives, so only one chunk of rows is held in memory at a time.
+    """
+    columns = ([], [], [], [], [])
+    for rows in chunks:
+        count = len(rows)
+        columns[0].append(np.fromiter((trip_index[row[0]] for row in rows), np.int32, count))
+        columns[1].append(np.fromiter((stop_index[row[1]] for row in rows), np.int32, count))
+        columns[2].append(np.fromiter((row[2] for row in rows), np.int32, count))
+        columns[3].append(np.fromiter((-1 if row[3] is None else row[3] for row in rows),
+                                      np.int32, count))
+        columns[4].append(np.fromiter((-1 if row[4] is None else row[4] for row in rows),
+                                      np.int32, count))
+    return tuple(np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+                 for parts in columns)
+
+
+class Timetable:
+    """Read-only snapshot of the timetable built by :meth:`load`."""
+
+    def __init__(self, stops, trips, services, stop_times, patterns, pattern_stops,
+                 regions=()):
+        # Stops, interned in id order.
+        self.stop_ids = [row[0] for row in stops]
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self.stop_names = [row[1] for row in stops]
+        self.stop_lat = np.array([row[2] for row in stops], dtype=np.float64)
+        self.stop_lon = np.array([row[3] for row in stops], dtype=np.float64)
+
+        # Services: one bitset row per service, one bit per day from first_day.
+        calendars, exceptions = services
+        service_ids = sorted({row[0] for row in calendars}
+                             | {row[0] for row in exceptions}
+                             | {row[2] for row in trips if row[2] is not None})
+        self.service_index = {service_id: i for i, service_id in enumerate(service_ids)}
+        dates = [row[1] for row in calendars] + [row[2] for row in calendars] \
+            + [row[1] for row in exceptions]
+        self.first_day = min(dates) if dates else dt.date.today()
+        self.days = ((max(dates) - self.first_day).days + 1) if dates else 0
+        running = np.zeros((len(service_ids) + 1, max(self.days, 1)), dtype=bool)
+        last_day = self.first_day + dt.timedelta(days=self.days - 1)
+        for day, service_id in expand_service_days(calendars, exceptions, last_day):
+            if day >= self.first_day:
+                running[self.service_index[service_id], (day - self.first_day).days] = True
+        # The last row stands for trips without a service: they never run.
+        self.service_bits = np.packbits(running, axis=1)
+        no_service = len(service_ids)
+
+        # Trips and routes.
+        self.trip_ids = [row[0] for row in trips]
+        trip_index = {trip_id: i for i, trip_id in enumerate(self.trip_ids)}
+        self.route_ids = np.unique(np.array([row[1] for row in trips], dtype=np.int64))
+        self.trip_route = np.searchsorted(self.route_ids,
+                                          np.array([row[1] for row in trips], dtype=np.int64))
+        self.trip_service = np.array(
+            [self.service_index.get(row[2], no_service) for row in trips], dtype=np.int32)
+
+        # Stop times: (trip, stop, sequence, arrival, departure); -1 for unknown times.
+        trip, stop, sequence, arrival, departure = _stop_time_arrays(
+            stop_times, trip_index, self.stop_index)
+
+        # Per trip: ordered stops with their times.
+        order = np.lexsort((sequence, trip))
+        self.trip_offsets = _csr_offsets(trip[order], len(self.trip_ids))
+        self.trip_stops = stop[order]
+        self.trip_arrivals = arrival[order]
+        self.trip_departures = departure[order]
+
+        # Per stop: departures sorted by route, then time.
+        timed = departure >= 0
+        route = self.trip_route[trip[timed]]
+        order = np.lexsort((departure[timed], route, stop[timed]))
+        self.stop_offsets = _csr_offsets(stop[timed][order], len(self.stop_ids))
+        self.departure_route = route[order]
+        self.departure_trip = trip[timed][order]
+        self.departure_secs = departure[timed][order]
+        self.departure_arrival = arrival[timed][order]
+
+        # Route patterns, ordered by route and then pattern id.
+        patterns = sorted(patterns, key=lambda row: (row[1], row[0]))
+        self.pattern_ids = np.array([row[0] for row in patterns], dtype=np.int64)
+        self.pattern_route = np.array([row[1] for row in patterns], dtype=np.int64)
+        self.pattern_direction = np.array(
+            [-1 if row[2] is None else row[2] for row in patterns], dtype=np.int32)
+        self.pattern_trips = np.array([row[3] for row in patterns], dtype=np.int32)
+        position = {pattern_id: i for i, pattern_id in enumerate(self.pattern_ids.tolist())}
+        pattern = np.array([position[row[0]] for row in pattern_stops], dtype=np.int32)
+        order = np.lexsort((np.array([row[1] for row in pattern_stops], dtype=np.int32), pattern))
+        self.pattern_offsets = _csr_offsets(pattern[order], len(patterns))
+        self.pattern_stops = np.array([self.stop_index[row[2]] for row in pattern_stops],
+                                      dtype=np.int32)[order]
+
+        # Routes of every region, by region name.
+        self.region_routes = {}
+        for route_id, region_name in regions:
+            self.region_routes.setdefault(region_name, []).append(route_id)
+
+    @classmethod
+    def load(cls, connection):
+        """Build a timetable from the tables reachable through ``connection``."""
+        stops = connection.execute(
+            select(Stop.id, Stop.name, Stop.lat, Stop.lon).order_by(Stop.id)).all()
+        trips = connection.execute(
+            select(Trip.id, Trip.route_id, Trip.service_id).order_by(Trip.id)).all()
+        calendars = connection.execute(select(
+            Calendar.service_id, Calendar.start_date, Calendar.end_date,
+            *(getattr(Calendar, day) for day in WEEKDAYS),
+        )).all()
+        exceptions = connection.execute(select(
+            CalendarDate.service_id, CalendarDate.date, CalendarDate.exception_type,
+        )).all()
+        patterns = connection.execute(select(
+            RoutePattern.id, RoutePattern.route_id, RoutePattern.direction_id,
+            RoutePattern.trip_count,
+        )).all()
+        pattern_stops = connection.execute(select(
+            RoutePatternStop.pattern_id, RoutePatternStop.sequence, RoutePatternStop.stop_id,
+        )).all()
+        regions = connection.execute(
+            select(Route.id, Region.name).join(Region, Region.id == Route.region_id)).all()
+        # Streamed in chunks straight into the arrays by the constructor.
+        stop_times = connection.execute(
+            select(StopTime.trip_id, StopTime.stop_id, StopTime.stop_sequence,
+                   StopTime.arrival_secs, StopTime.departure_secs),
+            execution_options={"yield_per": FETCH_SIZE},
+        ).partitions()
+        return cls(stops, trips, (calendars, exceptions), stop_times, patterns, pattern_stops,
+                   regions)
+
+    @cached_property
+    def connections(self):
+        """Every hop between consecutive stops of a trip, sorted by departure time."""
+        trip = np.repeat(np.arange(len(self.trip_ids), dtype=np.int32), np.diff(self.trip_offsets))
+        departure = self.trip_departures[:-1]
+        # A stop without arrival time is reached at its departure time.
+        arrival = np.where(self.trip_arrivals[1:] >= 0, self.trip_arrivals[1:],
+                           self.trip_departures[1:])
+        hop = (trip[:-1] == trip[1:]) & (departure >= 0) & (arrival >= departure)
+        order = np.argsort(departure[hop], kind="stable")
+        return Connections(
+            departure=departure[hop][order],
+            arrival=arrival[hop][order],
+            from_stop=self.trip_stops[:-1][hop][order],
+            to_stop=self.trip_stops[1:][hop][order],
+            trip=trip[:-1][hop][order],
+        )
+
+    @cached_property
+    def stop_component(self):
+        """Label of the connected part of the network each stop belongs to.
+
+        Two stops share a label when some chain of trips links them, ignoring
+        direction and time; a stop is unreachable from any stop with another
+        label. Labels are the smallest stop index of the part.
+        """
+        conns = self.connections
+        size = len(self.stop_ids)
+        edges = np.unique(conns.from_stop.astype(np.int64) * size + conns.to_stop)
+        a, b = edges // size, edges % size
+        label = np.arange(size)
+        while True:
+            # Hook the label of each end of an edge onto the smaller one...
+            previous = label
+            label = label.copy()
+            low = np.minimum(label[a], label[b])
+            np.minimum.at(label, label[a], low)
+            np.minimum.at(label, label[b], low)
+            # ...then point every stop straight at the root of its label.
+            while True:
+                root = label[label]
+                if np.array_equal(root, label):
+                    break
+                label = root
+            if np.array_equal(label, previous):
+                return label
+
+    def route_stops(self, route_id):
+        """Interned ids of every stop of the patterns of ``route_id``."""
+        first = np.searchsorted(self.pattern_route, route_id, side="left")
+        last = np.searchsorted(self.pattern_route, route_id, side="right")
+        return np.unique(self.pattern_stops[self.pattern_offsets[first]:self.pattern_offsets[last]])
+
+    def region_stops(self, name):
+        """Interned ids of the stops served by regions whose name contains ``name``."""
+        name = name.casefold()
+        stops = [self.route_stops(route_id)
+                 for region_name, route_ids in self.region_routes.items()
+                 if name in region_name.casefold()
+                 for route_id in route_ids]
+        return np.unique(np.concatenate(stops)) if stops else np.array([], dtype=np.int32)
+
+    def route_position(self, route_id):
+        """Interned id of ``route_id``, or None when no trip serves it."""
+        key = _route_key(route_id)
+        if key is None:
+            return None
+        position = int(np.searchsorted(self.route_ids, key))
+        if position == len(self.route_ids) or self.route_ids[position] != key:
+            return None
+        return position
+
+    def running(self, services, date):
+        """Boolean mask of the ``services`` (interned ids) running on ``date``."""
+        day = (date - self.first_day).days
+        if not 0 <= day < self.days:
+            return np.zeros(len(services), dtype=bool)
+        return (self.service_bits[services, day >> 3] >> (7 - (day & 7))) & 1 == 1
+
+    def departures(self, route_id, stop_id, date, after=0, limit=10):
+        """Same result as ``departures_query``: next departures of a route at a stop."""
+        stop = self.stop_index.get(stop_id)
+        route = self.route_position(route_id)
+        if stop is None or route is None:
+            return []
+
+        lo, hi = self.stop_offsets[stop], self.stop_offsets[stop + 1]
+        routes = self.departure_route[lo:hi]
+        start = lo + np.searchsorted(routes, route, side="left")
+        end = lo + np.searchsorted(routes, route, side="right")
+        times = self.departure_secs[start:end]
+
+        found = []
+        # Trips of the previous service day run SECONDS_PER_DAY later.
+        for offset, day in ((0, date), (SECONDS_PER_DAY, date - dt.timedelta(days=1))):
+            events = np.arange(start + np.searchsorted(times, after + offset), end)
+            services = self.trip_service[self.departure_trip[events]]
+            events = events[self.running(services, day)]
+            found.append((self.departure_secs[events] - offset, events))
+        effective = np.concatenate([secs for secs, _ in found])
+        events = np.concatenate([events for _, events in found])
+        events = events[np.argsort(effective, kind="stable")[:limit]]
+        return [
+            {'arrival_time': format_seconds(int(self.departure_arrival[event]))
+             if self.departure_arrival[event] >= 0 else None,
+             'departure_time': format_seconds(int(self.departure_secs[event]))}
+            for event in events
+        ]
+
+    def stops(self, route_id):
+        """Same result as ``stops_query``: ordered stops of every pattern of a route."""
+        route = _route_key(route_id)
+        if route is None:
+            return []
+        first = np.searchsorted(self.pattern_route, route, side="left")
+        last = np.searchsorted(self.pattern_route, route, side="right")
+        result = []
+        for pattern in range(first, last):
+            direction = int(self.pattern_direction[pattern])
+            stops = self.pattern_stops[self.pattern_offsets[pattern]:self.pattern_offsets[pattern + 1]]
+            for sequence, stop in enumerate(stops.tolist(), 1):
+                result.append({
+                    'stop_id': self.stop_ids[stop],
+                    'stop_name': self.stop_names[stop],
+                    'stop_lat': float(self.stop_lat[stop]),
+                    'stop_lon': float(self.stop_lon[stop]),
+                    'sequence': sequence,
+                    'pattern_id': int(self.pattern_ids[pattern]),
+                    'direction_id': None if direction < 0 else direction,
+                    'trip_count': int(self.pattern_trips[pattern]),
+                })
+        return result
+
+
+def init_timetable(app):
+    """Register the timetable state on ``app``; it is built on first use."""
+    app.config.setdefault('TIMETABLE_ENGINE', True)
+    app.extensions['timetable'] = {"engine": None, "version": None, "lock": threading.Lock()}
+
+
+def get_timetable():
+    """Return the current app's timetable, or None when the engine is disabled.
+
+    It is built on the first call and rebuilt when the dataset version
+    changes, together with the planner's connections for today and
+    tomorrow; while a rebuild runs other requests keep using the previous
+    snapshot.
+    """
+    app = current_app
+    if not app.config.get('TIMETABLE_ENGINE'):
+        return None
+    state = app.extensions['timetable']
+    version = current_version()
+
+    def stale():
+        return state["engine"] is None or state["version"] != version
+
+    if stale() and state["lock"].acquire(blocking=state["engine"] is None):
+        try:
+            if stale():
+                start = time.perf_counter()
+                with db.engine.connect() as connection:
+                    timetable = Timetable.load(connection)
+                # Imported here: the planner builds on this module.
+                from planner import warm
+                warm(timetable)
+                state["engine"] = timetable
+                state["version"] = version
+                app.logger.info("Built timetable version %s in %.2fs",
+                                version, time.perf_counter() - start)
+        finally:
+            state["lock"].release()
+    return state["engine"]
+
+
+def reset_timetable(app):
+    """Drop the current snapshot so the next request rebuilds it."""
+    app.extensions['timetable']["engine"] = None